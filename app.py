@@ -1,25 +1,251 @@
+import base64
+import hashlib
+import json
+import logging
 import os
+import time
+import tracemalloc
 import uuid
+from contextlib import contextmanager
 from lxml import etree
-import traceback
 from werkzeug.utils import secure_filename
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, Response, g, request, render_template, jsonify, stream_with_context
 
-from logic.parse import parse_feature_model1, find_minimum_working_product, parse_feature_model
-from logic.xmlvalidate import validate_xml
+from logic.analysis import analyse_features
+from logic.batch import iter_validate_batch
+from logic.binary import BinaryModelStore
+from logic.edit import EditorPool, edit_error
+from logic.calculate import analyse_model, format_configuration, iter_analysis
+from logic.jobs import JobManager, QueueFull, DONE, FINISHED, TIMEOUT
+from logic.metrics import Span, attach, server_timing, stage_metrics, start_collecting, stop_collecting
+from logic.model import ModelCache, load_model
+from logic.propagate import SelectionPropagator
+from logic.results import ResultCache, SQLiteTier, result_key
+from logic.sample import draw_chunks, sample_chunks, twise_sample
+from logic.session import SessionPool
+from logic.store import EditConflict, LocalUploadStore, SQLiteUploadStore, stream_digest
+from logic.translate import compile_cnf
+from logic.tree import tree_index
 
 app = Flask(__name__)
 
-UPLOAD_FOLDER = 'uploads'
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
 ALLOWED_EXTENSIONS = {'xml'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Binary forms of the uploaded models and their CNF, for fast cold loads
+app.config['COMPILED_FOLDER'] = os.environ.get('COMPILED_FOLDER', os.path.join(UPLOAD_FOLDER, 'compiled'))
+app.config['UPLOAD_TTL'] = int(os.environ.get('UPLOAD_TTL', 24 * 3600))  # seconds
+# Larger request bodies are refused with 413 before they are read
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 16)) * 1024 * 1024
+app.config['ANALYSIS_WORKERS'] = int(os.environ.get('ANALYSIS_WORKERS', os.cpu_count() or 1))
+app.config['ANALYSIS_QUEUE'] = int(os.environ.get('ANALYSIS_QUEUE', 32))  # waiting jobs before 429
+app.config['ANALYSIS_TIMEOUT'] = int(os.environ.get('ANALYSIS_TIMEOUT', 60))  # seconds per job
+# How analysis processes start: the platform default (fork on Linux) or 'forkserver',
+# which does not copy the threads' locks of this process but re-imports the main script
+app.config['ANALYSIS_START_METHOD'] = os.environ.get('ANALYSIS_START_METHOD') or None
+app.config['RESULT_CACHE_TTL'] = int(os.environ.get('RESULT_CACHE_TTL', 3600))  # seconds in memory
+# 'local' keeps the upload index in this process; 'sqlite' shares uploads, results and
+# job states through SQLite files, so several server processes can serve any fileId
+app.config['STORE_BACKEND'] = os.environ.get('STORE_BACKEND', 'local')
+app.config['UPLOAD_DB'] = os.environ.get('UPLOAD_DB')  # index of the 'sqlite' backend; default in UPLOAD_FOLDER
+# SQLite file for persistent results, shared by every process that uses it
+app.config['RESULT_CACHE_DB'] = os.environ.get(
+    'RESULT_CACHE_DB', os.path.join(UPLOAD_FOLDER, 'results.db') if app.config['STORE_BACKEND'] == 'sqlite' else None
+)
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+app.config['TRACE_MEMORY'] = os.environ.get('TRACE_MEMORY') == '1'  # per-stage allocations, at some CPU cost
 xsd_schema = 'logic/feature-model.xsd'
 
+logging.basicConfig(
+    level=app.config['LOG_LEVEL'],
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s',
+)
+if app.config['TRACE_MEMORY'] and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+# Parsed feature models of recent uploads, keyed by content digest so that
+# re-uploading the same file reuses the parsed model
+model_cache = ModelCache()
+
+# Uploaded XML files, indexed by fileId, stored once per content and expired in the background
+if app.config['STORE_BACKEND'] == 'sqlite':
+    upload_store = SQLiteUploadStore(app.config['UPLOAD_FOLDER'], app.config['UPLOAD_DB'],
+                                     ttl=app.config['UPLOAD_TTL'])
+elif app.config['STORE_BACKEND'] == 'local':
+    upload_store = LocalUploadStore(app.config['UPLOAD_FOLDER'], ttl=app.config['UPLOAD_TTL'])
+else:
+    raise ValueError(f"Unknown STORE_BACKEND: {app.config['STORE_BACKEND']}")
+upload_store.on_remove.append(model_cache.discard)
+binary_store = BinaryModelStore(app.config['COMPILED_FOLDER'])
+upload_store.on_remove.append(binary_store.discard)
+upload_store.start_gc()
+
+# Warm SAT solvers for interactive validation, keyed by content digest
+solver_sessions = SessionPool()
+upload_store.on_remove.append(solver_sessions.discard)
+
+# Edited uploads: the model with its edits applied, its CNF and a solver session, by fileId
+model_editors = EditorPool()
+upload_store.on_expire.append(model_editors.discard)
+
+# CPU-heavy analyses run in worker processes so they don't hold the GIL of the web tier
+job_manager = JobManager(
+    max_workers=app.config['ANALYSIS_WORKERS'],
+    max_queue=app.config['ANALYSIS_QUEUE'],
+    default_timeout=app.config['ANALYSIS_TIMEOUT'],
+    start_method=app.config['ANALYSIS_START_METHOD'],
+    preload=('logic.analysis', 'logic.calculate', 'logic.sample'),
+)
+
+# Formulas, MWP lists, analyses and compiled CNF, keyed by model digest and parameters
+result_cache = ResultCache(
+    ttl=app.config['RESULT_CACHE_TTL'],
+    disk=SQLiteTier(app.config['RESULT_CACHE_DB']) if app.config['RESULT_CACHE_DB'] else None,
+)
+
+
+def publish_job(job):
+    # Polls for the job may reach other server processes, which look it up on disk
+    result_cache.disk.put(result_key('job', job.id), job.to_dict())
+
+
+if result_cache.disk is not None:
+    job_manager.on_change.append(publish_job)
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def get_model(file_id):
+    """
+    Return (key, parsed model) of an upload; the model comes from the cache or is
+    re-parsed and validated from disk. The key is the content digest, or the
+    fileId for uploads with edits, whose model is kept by its editor.
+    Returns (None, None) if the upload does not exist.
+    """
+    entry = upload_store.lookup(file_id)
+    if entry is None:
+        return None, None
+    if entry.get('edits'):
+        return file_id, get_editor(file_id, entry).model
+    return entry['digest'], cached_model(entry['digest'], entry['path'])
+
+
+def cached_model(digest, path):
+    """
+    Parsed model of a stored upload: from memory, else from its binary form
+    (which also holds the compiled CNF), else re-parsed and validated from the
+    XML on disk. Returns None if the upload's file is gone.
+    """
+    model = model_cache.get(digest)
+    if model is not None:
+        return model
+    loaded = binary_store.load(digest)
+    if loaded is None:
+        model = model_cache.get(digest, path, xsd_schema)
+        if model is not None:
+            save_binary(digest, model)
+        return model
+    model, compiled = loaded
+    model_cache.put(digest, model)
+    if compiled is not None:
+        result_cache.put(result_key('cnf', model.digest(), []), compiled, persist=False)
+    return model
+
+
+def save_binary(digest, model):
+    """Store the binary form of an upload's model and CNF; failing to is not fatal."""
+    try:
+        binary_store.save(digest, model, get_compiled(model, []))
+    except OSError:
+        app.logger.warning("Could not save the binary form of %s", digest, exc_info=True)
+
+
+def get_editor(file_id, entry):
+    """The editor of an upload, with all of its stored edits applied."""
+    return model_editors.get(
+        file_id, lambda: cached_model(entry['digest'], entry['path']),
+        lambda start: upload_store.edits(file_id, start),
+    )
+
+
+@contextmanager
+def get_session(key, model):
+    """Warm solver session for a model returned by get_model, held for the `with` block."""
+    with model_editors.checkout(key) as session:
+        if session is not None:
+            yield session
+            return
+    with solver_sessions.checkout(key, lambda: get_compiled(model, [])) as session:
+        yield session
+
+
+def get_compiled(model, constraints):
+    """
+    Compiled CNF of a model plus extra constraint formulas, kept in memory only.
+    """
+    key = result_key('cnf', model.digest(), constraints)
+    return result_cache.get_or_compute(key, lambda: compile_cnf(model, constraints), persist=False)
+
+
+def get_propagator(model):
+    """
+    Propagator for interactive selection in a model, shared by every client of
+    the model and kept in memory only; hold its lock while using it.
+    """
+    key = result_key('propagator', model.digest())
+    return result_cache.get_or_compute(key, lambda: SelectionPropagator(get_compiled(model, [])), persist=False)
+
+
+def rejected_logic(model, constraints):
+    """
+    Error response for user formulas the CNF compiler can't encode (not of the
+    form "A → B", "A requires B" or "A excludes B", or naming unknown features),
+    or None if every formula is usable. Such formulas would otherwise be
+    left out silently and the results would ignore them.
+    """
+    rules = get_compiled(model, constraints).constraint_rules[len(model.constraints):]
+    rejected = [formula for formula, rule in zip(constraints, rules) if rule is None]
+    if not rejected:
+        return None
+    return jsonify({
+        "error": "Unsupported logic: " + "; ".join(repr(formula) for formula in rejected)
+                 + ". Use \"A → B\", \"A requires B\" or \"A excludes B\" with feature names.",
+        "unsupported": rejected,
+    }), 400
+
+
+@app.before_request
+def start_request_spans():
+    # Stages measured while handling the request (see logic.metrics) end up in Server-Timing
+    g.request_started = time.perf_counter()
+    g.spans = start_collecting()
+
+
+@app.after_request
+def add_server_timing(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        total = time.perf_counter() - started
+        response.headers['Server-Timing'] = server_timing(g.spans + [Span('total', total, 0.0)])
+        stage_metrics.observe_request(request.endpoint, response.status_code, total)
+    stop_collecting()
+    return response
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    limit = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({"error": f"The file is too large (at most {limit} MB)."}), 413
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Per-stage and per-endpoint metrics in the Prometheus text format."""
+    return Response(stage_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -35,36 +261,191 @@ def parse_xml():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         unique_id = str(uuid.uuid4())
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{unique_id}_{filename}")
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        file.save(filepath)
+        # The upload is still in memory (or spooled to a temporary file if large);
+        # it is only persisted once it has been accepted
+        stream = file.stream
         try:
-            # Validate XML against XSD schema
-            if xsd_schema:
-                with open(xsd_schema, 'rb') as xsd_file:
-                    schema_doc = etree.parse(xsd_file)
-                    schema = etree.XMLSchema(schema_doc)
-                xml_doc = etree.parse(filepath)
-                schema.assertValid(xml_doc)
-            tree = etree.parse(filepath)
-            root = tree.getroot()
-            features = root.xpath('//feature/@name')
+            digest = stream_digest(stream)
+            stream.seek(0)
+            # Identical content was already parsed and validated; otherwise parse the
+            # upload and validate it against the XSD schema in one streaming pass
+            model = model_cache.get(digest)
+            if model is None:
+                try:
+                    model = load_model(stream, xsd_schema)
+                except etree.XMLSyntaxError as e:
+                    return jsonify({"error": f"Invalid XML file: {str(e)}"}), 400
+            features = model.feature_names()
             constraints = [
-                {"englishStatement": constraint.findtext('englishStatement')}
-                for constraint in root.xpath('//constraints/constraint')
-                if constraint.findtext('englishStatement')
+                {"englishStatement": statement} for statement in model.english_constraints()
             ]
             if not constraints:
                 return jsonify({"error": "No cross-tree constraints found in the XML."}), 400
+            upload_store.save(unique_id, filename, stream, digest=digest)
+            model_cache.put(digest, model)
+            if not os.path.exists(binary_store.path(digest)):
+                save_binary(digest, model)
             return jsonify({"features": features, "constraints": constraints, "fileId": unique_id})
         except Exception as e:
-            traceback.print_exc()
+            app.logger.exception("Error parsing upload %s", unique_id)
             return jsonify({"error": f"Error parsing file: {str(e)}"}), 500
     return jsonify({"error": "Invalid file type. Only XML files are allowed."}), 400
 
 
+@app.route('/models/<file_id>/edits', methods=['POST'])
+def edit_model(file_id):
+    """
+    Apply a list of edits ({"edits": [...]}, see logic.edit.EDIT_OPS) to an
+    upload. Only the CNF rules and solver clauses the edits touch are rebuilt;
+    results of earlier model states stay cached under their own digest.
+    """
+    data = request.json or {}
+    edits = data.get("edits")
+    if not isinstance(edits, list) or not all(isinstance(edit, dict) for edit in edits):
+        return jsonify({"error": "edits must be a list of objects."}), 400
+    for index, edit in enumerate(edits):
+        error = edit_error(edit)
+        if error is not None:
+            return jsonify({"error": f"Edit {index} rejected: {error}", "applied": 0}), 400
+
+    entry = upload_store.lookup(file_id)
+    if entry is None:
+        return jsonify({"error": "XML file not found."}), 404
+    try:
+        editor = get_editor(file_id, entry)
+    except etree.XMLSyntaxError:
+        return jsonify({"error": "Invalid XML file."}), 400
+
+    applied = 0
+    conflict = "The model was edited at the same time, please retry."
+    # Each edit is logged under the sequence number the editor gave it; edits logged
+    # first by another request or server process make the store reject it
+    with editor.lock:
+        if not editor.sync(lambda start: upload_store.edits(file_id, start)):
+            return jsonify({"error": conflict, "applied": applied}), 409
+        for edit in edits:
+            sequence = editor.applied
+            try:
+                editor.apply(edit)
+            except (KeyError, IndexError, ValueError, TypeError, AttributeError) as e:
+                message = e.args[0] if e.args else str(e)
+                return jsonify({"error": f"Edit {applied} rejected: {message}", "applied": applied}), 400
+            # If the edit can't be logged the editor is ahead of the log; the next request rebuilds it
+            try:
+                if not upload_store.add_edit(file_id, edit, sequence):
+                    editor.stale = True
+                    return jsonify({"error": "XML file not found.", "applied": applied}), 404
+            except EditConflict:
+                editor.stale = True
+                return jsonify({"error": conflict, "applied": applied}), 409
+            applied += 1
+        model = editor.model
+        return jsonify({
+            "fileId": file_id,
+            "applied": applied,
+            "digest": model.digest(),
+            "features": model.feature_names(),
+            # Indexed like removeConstraint expects, including constraints without English text
+            "constraints": [dict(constraint, index=index) for index, constraint in enumerate(model.constraints)],
+        })
+
+
+@app.route('/models/<file_id>/tree', methods=['GET'])
+def model_tree(file_id):
+    """
+    The feature tree of an upload in pre-order (see logic.tree.TreeIndex.nodes).
+    `root` limits it to one sub-tree and `depth` to the levels below that root,
+    so a tree view can load large models a branch at a time.
+    """
+    depth = request.args.get("depth")
+    if depth is not None and not depth.isdigit():
+        return jsonify({"error": "depth must be a non-negative integer."}), 400
+    try:
+        _, model = get_model(file_id)
+    except etree.XMLSyntaxError:
+        return jsonify({"error": "Invalid XML file."}), 400
+    if model is None:
+        return jsonify({"error": "XML file not found."}), 404
+    index = tree_index(model)
+    root = request.args.get("root")
+    if root is not None and root not in index:
+        return jsonify({"error": f"Unknown feature: {root}"}), 400
+    return jsonify({
+        "fileId": file_id,
+        "root": root or index.root,
+        "nodes": index.nodes(root, int(depth) if depth is not None else None),
+    })
+
+
+@app.route('/models/<file_id>/propagate', methods=['POST'])
+def propagate_selection(file_id):
+    """
+    What a selection in progress implies ({"decisions": [{"feature", "selected"}, ...]},
+    in the order they were made), by unit propagation: see SelectionPropagator.
+    Returns the decided features, those forced on or ruled out by them and the
+    decisions refused because they conflict with earlier ones. This is fast
+    enough for every click; /validate gives the complete answer.
+    """
+    data = request.json or {}
+    decisions = data.get("decisions")
+    if not isinstance(decisions, list) or not all(
+            isinstance(d, dict) and isinstance(d.get("feature"), str) for d in decisions):
+        return jsonify({"error": "decisions must be a list of {feature, selected} objects."}), 400
+    try:
+        _, model = get_model(file_id)
+    except etree.XMLSyntaxError:
+        return jsonify({"error": "Invalid XML file."}), 400
+    if model is None:
+        return jsonify({"error": "XML file not found."}), 404
+    propagator = get_propagator(model)
+    try:
+        with propagator.lock:
+            result = propagator.decide_all([(d["feature"], bool(d.get("selected", True))) for d in decisions])
+    except KeyError as e:
+        return jsonify({"error": str(e.args[0])}), 400
+    return jsonify(dict(result, fileId=file_id))
+
+
+@app.route('/stats/uploads', methods=['GET'])
+def upload_stats():
+    return jsonify(upload_store.stats())
+
+
+MWP_ENCODINGS = ('names', 'bitset')
+
+
+def encode_cursor(query, offset):
+    """
+    Opaque pagination cursor: the position in the enumeration plus a fingerprint
+    of the query it belongs to, so it can't be replayed against another one.
+    """
+    raw = json.dumps({"q": query[:16], "o": offset}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor, query):
+    """Offset stored in a cursor, or None if it is malformed or for another query."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, dict) or data.get("q") != query[:16]:
+        return None
+    offset = data.get("o")
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        return None
+    return offset
+
+
 @app.route('/process_logic_and_mwp', methods=['POST'])
 def process_logic_and_mwp():
+    """
+    Propositional logic and MWP configurations of an upload.
+    Optional fields: `pageSize` and `cursor` page through the configurations
+    (the response carries `nextCursor`), `encoding` is 'names' (comma-joined) or
+    'bitset' (hex bitsets over `featureOrder`), and `stream` returns the
+    configurations as JSON lines while they are found.
+    """
     try:
         data = request.json
         file_id = data.get("fileId")
@@ -77,50 +458,413 @@ def process_logic_and_mwp():
                 return jsonify({"error": "Invalid logic format"}), 400
 
         logic_mapping = {f"constraint-{logic['constraintIndex']}": logic['logic'] for logic in logic_data}
-        print("Propositional Logic Received:", logic_mapping)
-
-
+        app.logger.debug("Propositional logic received: %s", logic_mapping)
 
-        # Locate the XML file
-        xml_file = None
-        for file in os.listdir(app.config['UPLOAD_FOLDER']):
-            if file.startswith(file_id):
-                xml_file = os.path.join(app.config['UPLOAD_FOLDER'], file)
-                break
+        encoding = data.get("encoding", "names")
+        if encoding not in MWP_ENCODINGS:
+            return jsonify({"error": f"encoding must be one of {', '.join(MWP_ENCODINGS)}."}), 400
+        limit = data.get("pageSize", data.get("limit"))
+        if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+            return jsonify({"error": "pageSize must be a positive integer."}), 400
 
-        if not xml_file or not os.path.exists(xml_file):
+        # Models parsed at upload time come from the cache; anything else
+        # is re-parsed and validated from disk
+        try:
+            _, model = get_model(file_id)
+        except etree.XMLSyntaxError:
+            return jsonify({"error": "Invalid XML file."}), 400
+        if model is None:
             return jsonify({"error": "XML file not found."}), 400
 
-        # Validate XML file
-        valid = validate_xml(xml_file, xsd_schema)
-        if not valid:
-            return jsonify({"error": "Invalid XML file."}), 400
+        constraints = list(logic_mapping.values())
+        if not all(isinstance(formula, str) for formula in constraints):
+            return jsonify({"error": "Invalid logic format"}), 400
+        rejected = rejected_logic(model, constraints)
+        if rejected is not None:
+            return rejected
+        query = hashlib.sha256(result_key('mwp', model.digest(), constraints, encoding).encode('utf-8')).hexdigest()
+        offset = data.get("offset", 0)
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            return jsonify({"error": "offset must be a non-negative integer."}), 400
+        if data.get("cursor"):
+            offset = decode_cursor(data["cursor"], query)
+            if offset is None:
+                return jsonify({"error": "Invalid cursor."}), 400
 
-        # Parse the feature model and generate logic
-        propositional_logic = parse_feature_model(xml_file)
+        if data.get("stream"):
+            return stream_mwp(model, constraints, logic_mapping, query, encoding, limit, offset)
 
-        # Parse features for MWP calculation
-        features = parse_feature_model1(xml_file)
+        # The same model with the same logic always gives the same answer
+        key = result_key('mwp', model.digest(), constraints, limit, offset, encoding)
+        result = result_cache.get(key)
+        cached = result is not None
+        if not cached:
+            # Generate the propositional logic and MWP configurations in a worker process,
+            # honouring the cross-tree logic entered by the user
+            try:
+                job_id = job_manager.submit(
+                    analyse_model, get_compiled(model, constraints),
+                    limit=limit, offset=offset, encoding=encoding, shared=bool(data.get("async")),
+                )
+            except QueueFull:
+                return jsonify({"error": "Too many analyses in progress, please retry later."}), 429, {"Retry-After": "5"}
 
-        # Calculate MWP configurations
-        mwp_configurations = find_minimum_working_product(features)
-        print("MWP Configurations:", mwp_configurations)
+            # Asynchronous callers poll /jobs/<jobId> for the result
+            if data.get("async"):
+                return jsonify({"jobId": job_id, "logicMapping": logic_mapping}), 202
 
-        # Format the MWP configurations for output
-        mwp_list = [", ".join(config) for config in mwp_configurations]
+            job = job_manager.wait(job_id)
+            attach(job.spans)
+            if job.status == TIMEOUT:
+                return jsonify({"error": job.error}), 504
+            if job.status != DONE:
+                return jsonify({"error": f"Error processing logic and MWP: {job.error}"}), 500
+            result = job.result
+            result_cache.put(key, result)
+        app.logger.debug("%d MWP configurations", len(result["mwpConfigurations"]))
 
         # Return MWP, the entered logic, and propositional logic
-        response = {
-            "logicMapping": logic_mapping,
-            "mwpConfigurations": mwp_list,
-            "propositionalLogic": propositional_logic,
-        }
+        response = {"logicMapping": logic_mapping, "cached": cached}
+        response.update(result)
+        more = response.pop("hasMore", False)
+        if limit is not None:
+            response["nextCursor"] = encode_cursor(query, offset + limit) if more else None
         return jsonify(response)
 
     except Exception as e:
-        traceback.print_exc()
+        app.logger.exception("Error processing logic and MWP")
         return jsonify({"error": f"Error processing logic and MWP: {str(e)}"}), 500
 
 
+def stream_mwp(model, constraints, logic_mapping, query, encoding, limit, offset):
+    """
+    NDJSON response for /process_logic_and_mwp: a header line with the logic, one
+    line per configuration as soon as the solver finds it, and an end line with
+    the count and the next cursor. A cached page is sent straight away; otherwise
+    the enumeration runs as a job (see calculate.iter_analysis) with the usual
+    queue limit and timeout, and the page it produced is cached at the end.
+    """
+    key = result_key('mwp', model.digest(), constraints, limit, offset, encoding)
+    result = result_cache.get(key)
+    if result is not None:
+        summary = {name: value for name, value in result.items() if name not in ('mwpConfigurations', 'hasMore')}
+        # The probe for a next page is the extra item iter_analysis would yield
+        items = iter([summary] + result["mwpConfigurations"] + ([None] if result["hasMore"] else []))
+        job = None
+    else:
+        try:
+            job_id = job_manager.submit(
+                iter_analysis, get_compiled(model, constraints), limit=limit, offset=offset, encoding=encoding
+            )
+        except QueueFull:
+            return jsonify({"error": "Too many analyses in progress, please retry later."}), 429, {"Retry-After": "5"}
+        job = job_manager.get(job_id)
+        items = job_manager.iter_items(job_id)
+
+    def generate():
+        try:
+            summary = next(items, None)
+            configurations = []
+            has_more = False
+            if summary is not None:
+                header = {"type": "header", "logicMapping": logic_mapping, "cached": job is None}
+                header.update(summary)
+                yield json.dumps(header) + "\n"
+                for configuration in items:
+                    if len(configurations) == limit:
+                        has_more = True
+                        break
+                    line = {"type": "configuration", "index": offset + len(configurations),
+                            "configuration": configuration}
+                    yield json.dumps(line) + "\n"
+                    configurations.append(configuration)
+        finally:
+            # Stops the job once the page is complete or the client went away
+            if job is not None:
+                job_manager.cancel(job.id)
+
+        if job is not None and not has_more and job.status != DONE:
+            error = job.error if job.status == TIMEOUT else f"Error processing logic and MWP: {job.error}"
+            yield json.dumps({"type": "error", "error": error}) + "\n"
+            return
+        if job is not None:
+            summary.update(mwpConfigurations=configurations, hasMore=has_more)
+            result_cache.put(key, summary)
+        next_cursor = encode_cursor(query, offset + limit) if has_more else None
+        yield json.dumps({"type": "end", "count": len(configurations), "nextCursor": next_cursor}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/analyse', methods=['POST'])
+def analyse():
+    """
+    Dead, core and false-optional features and the number of valid configurations.
+    """
+    try:
+        data = request.json
+        file_id = data.get("fileId")
+        if not file_id:
+            return jsonify({"error": "Missing file ID."}), 400
+        constraints = data.get("constraints", [])
+        if not isinstance(constraints, list) or not all(isinstance(c, str) for c in constraints):
+            return jsonify({"error": "constraints must be a list of formulas."}), 400
+
+        try:
+            _, model = get_model(file_id)
+        except etree.XMLSyntaxError:
+            return jsonify({"error": "Invalid XML file."}), 400
+        if model is None:
+            return jsonify({"error": "XML file not found."}), 400
+        rejected = rejected_logic(model, constraints)
+        if rejected is not None:
+            return rejected
+
+        key = result_key('analysis', model.digest(), constraints)
+        result = result_cache.get(key)
+        if result is None:
+            try:
+                job = job_manager.run(analyse_features, model, constraints)
+            except QueueFull:
+                return jsonify({"error": "Too many analyses in progress, please retry later."}), 429, {"Retry-After": "5"}
+            attach(job.spans)
+            if job.status == TIMEOUT:
+                return jsonify({"error": job.error}), 504
+            if job.status != DONE:
+                return jsonify({"error": f"Error analysing the model: {job.error}"}), 500
+            result = job.result
+            result_cache.put(key, result)
+        return jsonify(result)
+
+    except Exception as e:
+        app.logger.exception("Error analysing the model")
+        return jsonify({"error": f"Error analysing the model: {str(e)}"}), 500
+
+
+SAMPLE_METHODS = ('random', 'twise')
+MAX_SAMPLE_SIZE = 10000
+
+
+def run_sample(model, method, count, t, seed, constraints, max_configurations):
+    """
+    Draw a sample on the analysis workers. Random samples are split into chunks
+    spread over the workers; their seeds come from `seed`, so the result does
+    not depend on the number of workers. Returns (result, failed Job or None).
+    """
+    if method == 'twise':
+        job = job_manager.run(twise_sample, model, t, seed, constraints, max_configurations)
+        attach(job.spans)
+        return (job.result, None) if job.status == DONE else (None, job)
+
+    chunks = sample_chunks(count, seed)
+    workers = max(1, min(job_manager.max_workers, len(chunks)))
+    share = -(-len(chunks) // workers)
+    job_ids = []
+    configurations = []
+    try:
+        # A QueueFull part way still cancels the chunks already submitted
+        for i in range(0, len(chunks), share):
+            job_ids.append(job_manager.submit(draw_chunks, model, chunks[i:i + share], constraints))
+        for job_id in job_ids:
+            job = job_manager.wait(job_id)
+            attach(job.spans)
+            if job.status != DONE:
+                return None, job
+            configurations += job.result
+    finally:
+        for job_id in job_ids:
+            job_manager.cancel(job_id)
+    return {'configurations': configurations}, None
+
+
+@app.route('/sample', methods=['POST'])
+def sample():
+    """
+    Valid configurations for test generation. `method` 'random' draws `count`
+    configurations uniformly at random; 'twise' builds a covering array in which
+    every valid combination of `t` feature values occurs (at most
+    `maxConfigurations` configurations, if given). `seed` makes both
+    reproducible; `constraints` adds formulas and `encoding` works as for MWP.
+    """
+    try:
+        data = request.json or {}
+        file_id = data.get("fileId")
+        if not file_id:
+            return jsonify({"error": "Missing file ID."}), 400
+        method = data.get("method", "random")
+        if method not in SAMPLE_METHODS:
+            return jsonify({"error": f"method must be one of {', '.join(SAMPLE_METHODS)}."}), 400
+        count, t, seed = data.get("count", 10), data.get("t", 2), data.get("seed", 0)
+        max_configurations = data.get("maxConfigurations")
+        # JSON true and false would pass as the integers 1 and 0
+        if any(isinstance(value, bool) for value in (count, t, seed, max_configurations)):
+            return jsonify({"error": "count, t, seed and maxConfigurations must be integers."}), 400
+        if not isinstance(count, int) or not 1 <= count <= MAX_SAMPLE_SIZE:
+            return jsonify({"error": f"count must be an integer from 1 to {MAX_SAMPLE_SIZE}."}), 400
+        if not isinstance(t, int) or not 1 <= t <= 3:
+            return jsonify({"error": "t must be 1, 2 or 3."}), 400
+        if not isinstance(seed, int):
+            return jsonify({"error": "seed must be an integer."}), 400
+        if max_configurations is not None and (not isinstance(max_configurations, int) or max_configurations < 1):
+            return jsonify({"error": "maxConfigurations must be a positive integer."}), 400
+        constraints = data.get("constraints", [])
+        if not isinstance(constraints, list) or not all(isinstance(c, str) for c in constraints):
+            return jsonify({"error": "constraints must be a list of formulas."}), 400
+        encoding = data.get("encoding", "names")
+        if encoding not in MWP_ENCODINGS:
+            return jsonify({"error": f"encoding must be one of {', '.join(MWP_ENCODINGS)}."}), 400
+
+        try:
+            _, model = get_model(file_id)
+        except etree.XMLSyntaxError:
+            return jsonify({"error": "Invalid XML file."}), 400
+        if model is None:
+            return jsonify({"error": "XML file not found."}), 400
+        rejected = rejected_logic(model, constraints)
+        if rejected is not None:
+            return rejected
+
+        params = [count] if method == 'random' else [t, max_configurations]
+        key = result_key('sample', model.digest(), method, seed, constraints, *params)
+        result = result_cache.get(key)
+        if result is None:
+            try:
+                result, failed = run_sample(model, method, count, t, seed, constraints, max_configurations)
+            except QueueFull:
+                return jsonify({"error": "Too many analyses in progress, please retry later."}), 429, {"Retry-After": "5"}
+            if failed is not None:
+                if failed.status == TIMEOUT:
+                    return jsonify({"error": failed.error}), 504
+                return jsonify({"error": f"Error sampling the model: {failed.error}"}), 500
+            result_cache.put(key, result)
+
+        feature_ids = get_compiled(model, constraints).feature_ids
+        response = dict(result, method=method, seed=seed, configurations=[
+            format_configuration(config, encoding, feature_ids) for config in result['configurations']
+        ])
+        if encoding == 'bitset':
+            response["featureOrder"] = sorted(feature_ids, key=feature_ids.get)
+        return jsonify(response)
+
+    except Exception as e:
+        app.logger.exception("Error sampling the model")
+        return jsonify({"error": f"Error sampling the model: {str(e)}"}), 500
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Poll a background analysis. `?wait=<seconds>` holds the request until the
+    job finishes or the time is up (long polling).
+    """
+    wait = min(request.args.get('wait', 0, type=float), 30)
+    job = job_manager.wait(job_id, wait) if wait > 0 else job_manager.get(job_id)
+    if job is not None:
+        return jsonify(job.to_dict())
+    record = shared_job(job_id, wait)
+    if record is None:
+        return jsonify({"error": "Unknown job ID."}), 404
+    return jsonify(record)
+
+
+def shared_job(job_id, wait=0):
+    """
+    State of an asynchronous job started by another server process, as published
+    by publish_job, waiting up to `wait` seconds for it to finish. None if unknown.
+    """
+    if result_cache.disk is None:
+        return None
+    deadline = time.monotonic() + wait
+    while True:
+        record = result_cache.disk.get(result_key('job', job_id))
+        if record is None or record['status'] in FINISHED or time.monotonic() >= deadline:
+            return record
+        time.sleep(0.2)
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if job_manager.get(job_id) is None:
+        record = shared_job(job_id)
+        if record is None:
+            return jsonify({"error": "Unknown job ID."}), 404
+        if record['status'] in FINISHED:
+            return jsonify({"jobId": job_id, "cancelled": False})
+        return jsonify({"error": "The job runs in another server process."}), 409
+    cancelled = job_manager.cancel(job_id)
+    return jsonify({"jobId": job_id, "cancelled": cancelled})
+
+
+@app.route('/stats/jobs', methods=['GET'])
+def job_stats():
+    return jsonify(job_manager.stats())
+
+
+@app.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+
+@app.route('/validate', methods=['POST'])
+def validate_selection():
+    try:
+        data = request.json
+        file_id = data.get("fileId")
+        if not file_id:
+            return jsonify({"error": "Missing file ID."}), 400
+        selected = data.get("selected_features", [])
+        deselected = data.get("deselected_features", [])
+        if not isinstance(selected, list) or not isinstance(deselected, list):
+            return jsonify({"error": "Feature selections must be lists."}), 400
+
+        try:
+            digest, model = get_model(file_id)
+        except etree.XMLSyntaxError:
+            return jsonify({"error": "Invalid XML file."}), 400
+        if model is None:
+            return jsonify({"error": "XML file not found."}), 400
+        try:
+            with get_session(digest, model) as session:
+                result = session.implied(selected, deselected)
+        except KeyError as e:
+            return jsonify({"error": str(e.args[0])}), 400
+        return jsonify(result)
+
+    except Exception as e:
+        app.logger.exception("Error validating configuration")
+        return jsonify({"error": f"Error validating configuration: {str(e)}"}), 500
+
+
+@app.route('/validate_batch', methods=['POST'])
+def validate_batch():
+    """
+    Validate many complete configurations of one model. Results are streamed back
+    as JSON lines ({"index", "valid", "reason"}) in the order they were sent.
+    """
+    data = request.json or {}
+    file_id = data.get("fileId")
+    if not file_id:
+        return jsonify({"error": "Missing file ID."}), 400
+    configurations = data.get("configurations")
+    # Checked in full before streaming starts, so a bad item can't cut the response short
+    if not isinstance(configurations, list) or not all(
+            isinstance(c, list) and all(isinstance(name, str) for name in c) for c in configurations):
+        return jsonify({"error": "configurations must be a list of feature name lists."}), 400
+
+    try:
+        digest, model = get_model(file_id)
+    except etree.XMLSyntaxError:
+        return jsonify({"error": "Invalid XML file."}), 400
+    if model is None:
+        return jsonify({"error": "XML file not found."}), 400
+    def generate():
+        with get_session(digest, model) as session:
+            for result in iter_validate_batch(model, configurations, session):
+                yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    # Development server only; see server.py for production
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,64 @@
+"""
+ASGI entry point, for serving the app with an ASGI server such as uvicorn:
+    STORE_BACKEND=sqlite uvicorn asgi:application --workers 4
+
+(With more than one worker the stores must be shared, see server.py.)
+
+Request bodies are received on the event loop, so slow clients don't occupy a
+worker thread; the Flask app then runs in a thread pool once the whole request
+has arrived. Bodies over MAX_CONTENT_LENGTH are refused while they stream in.
+"""
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class BodyLimit:
+    """
+    ASGI middleware answering 413 to requests whose body exceeds `max_bytes`,
+    judged by Content-Length up front or by counting chunked bodies as they arrive.
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.max_bytes:
+            return await self.app(scope, receive, send)
+        for name, value in scope.get('headers', []):
+            if name == b'content-length' and value.isdigit() and int(value) > self.max_bytes:
+                return await self._reject(send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    raise _BodyTooLarge()
+            return message
+
+        try:
+            await self.app(scope, limited_receive, send)
+        except _BodyTooLarge:
+            # WsgiToAsgi reads the whole body before calling the app, so nothing was sent yet
+            await self._reject(send)
+
+    async def _reject(self, send):
+        limit = self.max_bytes // (1024 * 1024)
+        body = f'{{"error": "The file is too large (at most {limit} MB)."}}'.encode('utf-8')
+        await send({
+            'type': 'http.response.start', 'status': 413,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+application = BodyLimit(WsgiToAsgi(app), app.config['MAX_CONTENT_LENGTH'])
@@ -0,0 +1,201 @@
+from logic.metrics import timed
+from logic.model import as_model
+from logic.session import SolverSession
+from logic.translate import compile_cnf
+
+
+class CountBudgetExceeded(Exception):
+    """Raised when exact model counting needs more decisions than allowed."""
+
+
+def subtree_counts(model):
+    """
+    Number of configurations of each feature's sub-tree given that the feature
+    is selected, ignoring cross-tree constraints, by feature name. Computed
+    bottom-up in linear time: every solitary child multiplies by (its count + 1
+    if optional), an xor group by the sum of its members' counts and an or
+    group by prod(count + 1) - 1.
+    """
+    counts = {}
+    # Document order is a pre-order, so walking it backwards sees children first
+    for name in reversed(list(model.features)):
+        feature = model[name]
+        total = 1
+        for child in feature.children:
+            total *= counts[child] + (0 if model[child].mandatory else 1)
+        if feature.group_type == 'xor':
+            total *= sum(counts[member] for member in feature.group)
+        elif feature.group_type == 'or':
+            combined = 1
+            for member in feature.group:
+                combined *= counts[member] + 1
+            total *= combined - 1
+        counts[name] = total
+    return counts
+
+
+def count_tree_configurations(model):
+    """Number of valid configurations of a model without cross-tree constraints (see subtree_counts)."""
+    if model.root is None:
+        return 1
+    return subtree_counts(model)[model.root]
+
+
+def _condition(clauses, lit):
+    # Assign lit: drop satisfied clauses and shorten the others; None on conflict
+    result = []
+    for clause in clauses:
+        if lit in clause:
+            continue
+        if -lit in clause:
+            clause = clause - {-lit}
+            if not clause:
+                return None
+        result.append(clause)
+    return result
+
+
+def _components(clauses):
+    # Split clauses into groups that share no variables (union-find over variables)
+    parent = {}
+
+    def find(v):
+        while parent.setdefault(v, v) != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    for clause in clauses:
+        first = None
+        for lit in clause:
+            root = find(abs(lit))
+            if first is None:
+                first = root
+            elif root != first:
+                parent[root] = first
+    groups = {}
+    for clause in clauses:
+        groups.setdefault(find(abs(next(iter(clause)))), []).append(clause)
+    return list(groups.values())
+
+
+class ModelCounter:
+    """
+    Exact #SAT by DPLL with unit propagation, connected-component decomposition
+    and component caching (the search trace of a decision-DNNF compiler).
+    `max_decisions` bounds the work; beyond it CountBudgetExceeded is raised.
+    """
+
+    def __init__(self, max_decisions=200000):
+        self.max_decisions = max_decisions
+        self.decisions = 0
+        self._cache = {}
+
+    def count(self, clauses, variables):
+        """Count the assignments of `variables` satisfying `clauses` (lists of ints)."""
+        return self._count([frozenset(clause) for clause in clauses], set(variables))
+
+    def _count(self, clauses, variables):
+        # Unit propagation
+        while True:
+            unit = next((clause for clause in clauses if len(clause) == 1), None)
+            if unit is None:
+                break
+            lit = next(iter(unit))
+            variables.discard(abs(lit))
+            clauses = _condition(clauses, lit)
+            if clauses is None:
+                return 0
+
+        used = {abs(lit) for clause in clauses for lit in clause}
+        total = 2 ** len(variables - used)
+        for component in _components(clauses):
+            total *= self._count_component(component)
+            if total == 0:
+                return 0
+        return total
+
+    def _count_component(self, clauses):
+        key = frozenset(clauses)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        self.decisions += 1
+        if self.decisions > self.max_decisions:
+            raise CountBudgetExceeded(f"more than {self.max_decisions} decisions")
+
+        # Branch on the most frequent variable
+        occurrences = {}
+        for clause in clauses:
+            for lit in clause:
+                occurrences[abs(lit)] = occurrences.get(abs(lit), 0) + 1
+        var = max(occurrences, key=occurrences.get)
+        rest = set(occurrences) - {var}
+
+        total = 0
+        for lit in (var, -var):
+            conditioned = _condition(clauses, lit)
+            if conditioned is not None:
+                total += self._count(conditioned, set(rest))
+        self._cache[key] = total
+        return total
+
+
+@timed('count_configurations')
+def count_configurations(model, compiled, max_decisions=200000):
+    """
+    Number of valid configurations and how it was obtained ('tree' or 'dpll').
+    Returns (None, None) if counting would take more than max_decisions decisions.
+    """
+    if not any(kind == 'constraint' for kind, _, _, _ in compiled.rules):
+        return count_tree_configurations(model), 'tree'
+    try:
+        count = ModelCounter(max_decisions).count(compiled.clauses, range(1, compiled.nv + 1))
+    except (CountBudgetExceeded, RecursionError):
+        return None, None
+    return count, 'dpll'
+
+
+@timed('analyse_features')
+def analyse_features(source, constraints=(), max_decisions=200000):
+    """
+    Dead, core and false-optional features and the number of valid configurations,
+    all from one compiled CNF and one incremental solver.
+    Core and dead features are the solver's backbone (see SolverSession.implied);
+    a solitary optional feature is false-optional when its parent cannot be
+    selected without it.
+    """
+    model = as_model(source)
+    compiled = compile_cnf(model, constraints, exact=True)
+
+    with SolverSession(compiled) as session:
+        backbone = session.implied()
+        if not backbone['valid']:
+            # Void model: no configuration at all, so every feature is dead
+            return {
+                'valid': False, 'core': [], 'dead': model.feature_names(),
+                'falseOptional': [], 'configurations': 0, 'countMethod': 'sat',
+            }
+
+        dead = set(backbone['forbidden'])
+        ids = compiled.feature_ids
+        false_optional = []
+        for name, feature in model.features.items():
+            if not feature.parent or feature.mandatory or name in dead:
+                continue
+            if name in model[feature.parent].group:
+                continue  # group members are governed by their group
+            if not session.solve_literals([ids[feature.parent], -ids[name]]):
+                false_optional.append(name)
+
+    configurations, method = count_configurations(model, compiled, max_decisions)
+    return {
+        'valid': True,
+        'core': backbone['forced'],
+        'dead': sorted(dead),
+        'falseOptional': sorted(false_optional),
+        'configurations': configurations,
+        'countMethod': method,
+    }
+
@@ -0,0 +1,136 @@
+import numpy as np
+
+from logic.metrics import timed
+from logic.model import as_model
+from logic.session import SolverSession
+from logic.tree import tree_index
+
+# Configurations checked together in one boolean matrix
+CHUNK_SIZE = 4096
+
+
+class StructureChecks:
+    """
+    Column indices describing the tree of a feature model, so the structural
+    rules can be checked for many configurations at once on a boolean matrix
+    of configurations x features (column i holds the feature with variable id i + 1).
+    """
+
+    def __init__(self, model, feature_ids):
+        column = {name: feature_ids[name] - 1 for name in model.features}
+        self.column = column
+        self.width = max(column.values(), default=-1) + 1
+        self.names = [None] * self.width  # column -> feature name
+        for name, col in column.items():
+            self.names[col] = name
+        self.root = column[model.root] if model.root is not None else None
+
+        # Parents, mandatory flags and groups come from the model's tree index, in pre-order
+        index = tree_index(model)
+        children = range(1, len(index))
+        self.child_cols = np.array([column[index.names[i]] for i in children], dtype=np.intp)
+        self.parent_cols = np.array([column[index.names[index.parent[i]]] for i in children], dtype=np.intp)
+
+        mandatory = [i for i in children if model[index.names[i]].mandatory]
+        self.mandatory_cols = np.array([column[index.names[i]] for i in mandatory], dtype=np.intp)
+        self.mandatory_parent_cols = np.array([column[index.names[index.parent[i]]] for i in mandatory],
+                                              dtype=np.intp)
+
+        # All group members laid out contiguously, one slice per group
+        groups = [model[name] for name in index.names if model[name].group]
+        self.group_names = [f.name for f in groups]
+        self.group_parent_cols = np.array([column[f.name] for f in groups], dtype=np.intp)
+        self.group_is_xor = np.array([f.group_type == 'xor' for f in groups], dtype=bool)
+        self.member_cols = np.array([column[m] for f in groups for m in f.group], dtype=np.intp)
+        self.group_offsets = np.cumsum([0] + [len(f.group) for f in groups[:-1]]).astype(np.intp)
+
+    def matrix(self, configurations):
+        """
+        Build the boolean matrix for a list of configurations (lists of selected names).
+        Returns (matrix, errors) where errors[i] names unknown features of row i, if any.
+        """
+        matrix = np.zeros((len(configurations), self.width), dtype=bool)
+        errors = [None] * len(configurations)
+        for row, configuration in enumerate(configurations):
+            columns = [self.column.get(name) for name in configuration]
+            if None in columns:
+                unknown = [name for name, col in zip(configuration, columns) if col is None]
+                errors[row] = f"Unknown features: {', '.join(map(str, unknown))}"
+                continue
+            matrix[row, columns] = True
+        return matrix, errors
+
+    def violations(self, matrix):
+        """
+        Return a reason string (or None) for every row of the matrix.
+        """
+        reasons = [None] * len(matrix)
+        checks = []
+
+        if self.root is not None:
+            checks.append((~matrix[:, [self.root]], lambda col: f"Root feature {self.names[self.root]} must be selected"))
+
+        if len(self.child_cols):
+            orphaned = matrix[:, self.child_cols] & ~matrix[:, self.parent_cols]
+            checks.append((orphaned, lambda col: f"{self.names[self.child_cols[col]]} is selected without its parent"))
+
+        if len(self.mandatory_cols):
+            missing = matrix[:, self.mandatory_parent_cols] & ~matrix[:, self.mandatory_cols]
+            checks.append((missing, lambda col: f"Mandatory feature {self.names[self.mandatory_cols[col]]} is missing"))
+
+        if len(self.group_parent_cols):
+            counts = np.add.reduceat(matrix[:, self.member_cols].astype(np.int32), self.group_offsets, axis=1)
+            active = matrix[:, self.group_parent_cols]
+            wrong = active & np.where(self.group_is_xor, counts != 1, counts == 0)
+
+            def group_reason(col):
+                kind = "exactly one" if self.group_is_xor[col] else "at least one"
+                return f"Group of {self.group_names[col]} needs {kind} selected feature"
+            checks.append((wrong, group_reason))
+
+        for violated, reason in checks:
+            failing = np.flatnonzero(violated.any(axis=1))
+            first = violated[failing].argmax(axis=1)
+            for row, col in zip(failing, first):
+                if reasons[row] is None:
+                    reasons[row] = reason(col)
+        return reasons
+
+
+@timed('validate_batch')
+def iter_validate_batch(source, configurations, session=None):
+    """
+    Validate many complete configurations (lists of selected feature names; every
+    other feature is deselected) of one model and yield one result per configuration,
+    in order: {'index', 'valid', 'reason'}.
+    Structural rules are checked with NumPy first; only configurations passing them
+    are handed to the SAT solver (for the cross-tree constraints), as assumptions
+    on a single solver instance. Pass a SolverSession to reuse a warm solver.
+    """
+    model = as_model(source)
+    own_session = session is None
+    if own_session:
+        session = SolverSession(model)
+    checks = StructureChecks(model, session.compiled.feature_ids)
+    feature_vars = session.compiled.feature_vars()
+
+    try:
+        for start in range(0, len(configurations), CHUNK_SIZE):
+            chunk = configurations[start:start + CHUNK_SIZE]
+            matrix, errors = checks.matrix(chunk)
+            reasons = checks.violations(matrix)
+            for row in range(len(chunk)):
+                reason = errors[row] or reasons[row]
+                if reason is None:
+                    selected = matrix[row]
+                    assumptions = [v if selected[v - 1] else -v for v in feature_vars]
+                    if not session.solve_literals(assumptions):
+                        reason = "Violates the cross-tree constraints"
+                yield {'index': start + row, 'valid': reason is None, 'reason': reason}
+    finally:
+        if own_session:
+            session.close()
+
+
+def validate_batch(source, configurations, session=None):
+    return list(iter_validate_batch(source, configurations, session))
@@ -0,0 +1,398 @@
+"""
+Benchmarks for the request pipeline.
+
+Run from the repository root:
+    python -m logic.benchmark                  # micro-benchmarks
+    python -m logic.benchmark pipeline         # every stage and endpoint across model sizes
+    python -m logic.benchmark pipeline --save-baseline
+    python -m logic.benchmark pipeline --compare
+
+The pipeline suite runs on synthetic models (see logic.generate). --save-baseline
+records the results in benchmark-baseline.json next to this file; --compare
+reports stages that got slower or use more memory than the baseline allows and
+exits with status 1 if there are any.
+"""
+import argparse
+import gc
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from lxml import etree
+
+from logic.binary import load_binary, save_binary
+from logic.generate import write_model
+from logic.model import build_model, load_model
+from logic.parse import ConstraintTranslator, find_minimum_working_product, parse_feature_model
+from logic.translate import compile_cnf
+from logic.tree import tree_index
+from logic.validate import validate_configuration
+from logic.xmlvalidate import assert_valid, clear_schema_cache
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+XSD_FILE = os.path.join(HERE, 'feature-model.xsd')
+# Settings of app.py that place files; the endpoint benchmark points them all at a temporary folder
+APP_FOLDERS = ('UPLOAD_FOLDER', 'COMPILED_FOLDER', 'UPLOAD_DB', 'RESULT_CACHE_DB')
+XML_FILE = os.path.join(HERE, 'feature-model.xml')
+BASELINE_FILE = os.path.join(HERE, 'benchmark-baseline.json')
+
+# Synthetic model sizes for the pipeline suite (options of logic.generate.generate_model)
+MODEL_SIZES = {
+    'small': {'depth': 3, 'branching': 3, 'seed': 1},
+    'medium': {'depth': 5, 'branching': 3, 'seed': 1},
+    'large': {'depth': 6, 'branching': 4, 'seed': 1},
+}
+
+# MWP products enumerated per run; the full set grows exponentially with the model
+MWP_LIMIT = 50
+
+
+def bench_schema(number=500):
+    """
+    Compare compiling the XSD on every request (the old /parse behaviour)
+    against validating with the process-wide cached schema.
+    """
+    def uncached():
+        schema = etree.XMLSchema(etree.parse(XSD_FILE))
+        schema.assertValid(etree.parse(XML_FILE))
+
+    def cached():
+        assert_valid(etree.parse(XML_FILE), XSD_FILE)
+
+    clear_schema_cache()
+    cached()  # warm the cache once, as the first request would
+    uncached_time = timeit.timeit(uncached, number=number) / number
+    cached_time = timeit.timeit(cached, number=number) / number
+    return {
+        'uncached_ms': uncached_time * 1000,
+        'cached_ms': cached_time * 1000,
+        'speedup': uncached_time / cached_time,
+    }
+
+
+def write_wide_model(path, groups):
+    """
+    Write a valid model with `groups` xor groups of three features under the root.
+    """
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('<featureModel>\n<feature name="Root">\n')
+        for i in range(groups):
+            out.write(f'<feature name="Group{i}" mandatory="true"><group type="xor">'
+                      f'<feature name="A{i}"/><feature name="B{i}"/><feature name="C{i}"/>'
+                      f'</group></feature>\n')
+        out.write('</feature>\n<constraints><constraint>'
+                  '<englishStatement>A0 depends on B1</englishStatement>'
+                  '</constraint></constraints>\n</featureModel>\n')
+
+
+def _tree_load(path):
+    # The pre-streaming path: validation parse, then a second DOM parse for the model
+    assert_valid(etree.parse(path), XSD_FILE)
+    return build_model(etree.parse(path).getroot())
+
+
+def _stream_load(path):
+    return load_model(path, XSD_FILE)
+
+
+def _measure(loader, path, queue):
+    import resource  # not available on Windows
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    model = loader(path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, (peak - before) / 1024, len(model)))
+
+
+def bench_loader(groups=50000):
+    """
+    Peak memory (growth of the max RSS, in MB) and time of loading a large model
+    with the old DOM path and the streaming loader. Each measurement runs in a
+    fresh process so the peaks do not hide each other.
+
+    On the default 50k-group model (200k features, 7.3 MB of XML) the DOM path
+    peaked at about +170 MB and the streaming loader at about +52 MB, which is
+    essentially the resulting FeatureModel; the DOM path also holds complete
+    lxml trees of the document.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.xml')
+        write_wide_model(path, groups)
+        results['xml_mb'] = os.path.getsize(path) / (1024 * 1024)
+        for name, loader in (('dom', _tree_load), ('stream', _stream_load)):
+            queue = context.Queue()
+            process = context.Process(target=_measure, args=(loader, path, queue))
+            process.start()
+            elapsed, peak_mb, features = queue.get()
+            process.join()
+            results[name] = {'seconds': elapsed, 'peak_mb': peak_mb, 'features': features}
+    return results
+
+
+def _translate_per_feature(english, feature_mapping):
+    # The pre-compiled-translator approach: one re.sub per feature, then the patterns
+    english = english.strip().lower()
+    for english_feature, variable_name in feature_mapping.items():
+        english = re.sub(rf'\b{re.escape(english_feature)}\b', variable_name.lower(), english)
+    for pattern, builder in ConstraintTranslator.patterns:
+        match = pattern.match(english)
+        if match:
+            return builder(match)
+    return None
+
+
+def bench_constraints(features=1000, constraints=100):
+    """
+    Time translating English constraints with a per-feature re.sub loop against
+    the single-pass ConstraintTranslator (built once per model).
+    """
+    feature_mapping = {f"feature {i}": f"feature{i}" for i in range(features)}
+    statements = [f"Feature {i} depends on Feature {i + 1}" for i in range(constraints)]
+
+    start = time.perf_counter()
+    for statement in statements:
+        _translate_per_feature(statement, feature_mapping)
+    per_feature = time.perf_counter() - start
+
+    start = time.perf_counter()
+    translator = ConstraintTranslator(feature_mapping)
+    for statement in statements:
+        translator.translate(statement)
+    compiled = time.perf_counter() - start
+    return {'per_feature_ms': per_feature * 1000, 'compiled_ms': compiled * 1000}
+
+
+def _run_stage(func, repeat):
+    # Best wall time of `repeat` runs (the least noisy figure to compare) and the peak of Python allocations in one run
+    # (tracemalloc does not see libxml2's or the SAT solver's own allocations)
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'ms': min(times) * 1000, 'peak_kb': peak / 1024}
+
+
+def _calibrate(repeat=5):
+    # Time of a fixed pure-Python workload, used to factor machine speed out of comparisons
+    return min(timeit.repeat(lambda: sum(i * i for i in range(200000)), number=1, repeat=repeat)) * 1000
+
+
+def _pipeline_stages(path):
+    # (name, callable) for each pipeline stage on the model at `path`
+    model = load_model(path, XSD_FILE)
+    compiled = compile_cnf(model)
+    cnf, feature_ids = compiled.to_cnf(), compiled.feature_ids
+    hierarchy = tree_index(model)
+    selection = find_minimum_working_product(model, limit=1)
+    selection = selection[0] if selection else [model.root]
+    binary_path = os.path.splitext(path)[0] + '.fmb'
+    save_binary(binary_path, model, compiled)
+    return [
+        ('load_model', lambda: load_model(path, XSD_FILE)),
+        ('load_binary', lambda: load_binary(binary_path)),
+        ('parse_feature_model', lambda: parse_feature_model(model)),
+        ('compile_cnf', lambda: compile_cnf(model)),
+        ('find_minimum_working_product', lambda: find_minimum_working_product(model, limit=MWP_LIMIT)),
+        ('validate_configuration', lambda: validate_configuration(cnf, feature_ids, selection, hierarchy)),
+    ]
+
+
+def _endpoint_stages(client, path):
+    # (name, callable) for the HTTP endpoints, called through Flask's test client
+    with open(path, 'rb') as f:
+        data = f.read()
+    uploads = []
+
+    def upload():
+        # Repeated uploads of the same bytes reuse the stored blob and parsed model
+        response = client.post('/parse', data={'xml': (io.BytesIO(data), 'model.xml')})
+        uploads.append(response.get_json().get('fileId'))
+        return response
+
+    names = upload().get_json().get('features', [])
+    file_id = uploads[0]
+    if file_id is None:
+        return [], uploads
+    mwp_request = {'fileId': file_id, 'logicData': [], 'pageSize': MWP_LIMIT}
+    result = client.post('/process_logic_and_mwp', json=mwp_request).get_json()
+    first = (result.get('mwpConfigurations') or [''])[0].split(', ')
+    # Each run adds a different "X → X", which changes nothing but the cache key, so
+    # the CNF is compiled and the products enumerated every time (up to one run per feature)
+    tautologies = itertools.cycle([f"{name} → {name}" for name in names])
+
+    def mwp(**options):
+        logic = [{'constraintIndex': 0, 'logic': next(tautologies)}]
+        return client.post('/process_logic_and_mwp', json=dict(mwp_request, logicData=logic, **options)).get_data()
+
+    return [
+        ('POST /parse', upload),
+        ('POST /process_logic_and_mwp', mwp),
+        ('POST /process_logic_and_mwp (stream)', lambda: mwp(stream=True)),
+        ('POST /validate', lambda: client.post('/validate', json={'fileId': file_id, 'selected_features': first})),
+    ], uploads
+
+
+def bench_pipeline(sizes=None, repeat=5, endpoints=True):
+    """
+    Latency (best of `repeat`, in ms) and peak Python memory (KB) of every pipeline stage and,
+    with `endpoints`, the HTTP endpoints, for each synthetic model size.
+    Returns {size: {'features': n, 'stages': {stage: {'ms', 'peak_kb'}}}}.
+    The endpoints are served by app.py, imported here with its uploads, compiled
+    models and caches in a temporary folder that is removed afterwards, so it
+    runs once per process.
+    """
+    if not endpoints:
+        return _bench_sizes(sizes, repeat, None)
+    with tempfile.TemporaryDirectory() as folder:
+        # app.py creates its stores when imported, so they are pointed at `folder` first
+        previous = {name: os.environ.get(name) for name in APP_FOLDERS}
+        os.environ['UPLOAD_FOLDER'] = folder
+        os.environ['COMPILED_FOLDER'] = os.path.join(folder, 'compiled')
+        os.environ['UPLOAD_DB'] = os.path.join(folder, 'index.db')
+        os.environ['RESULT_CACHE_DB'] = os.path.join(folder, 'results.db')
+        try:
+            sys.path.insert(0, os.path.dirname(HERE))
+            import app
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        try:
+            return _bench_sizes(sizes, repeat, app)
+        finally:
+            app.upload_store.stop_gc()
+            app.job_manager.shutdown()
+            if app.result_cache.disk is not None:
+                app.result_cache.disk.close()
+
+
+def _bench_sizes(sizes, repeat, app):
+    client = app.app.test_client() if app is not None else None
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes or MODEL_SIZES:
+            path = os.path.join(tmp, f'{size}.xml')
+            features = write_model(path, **MODEL_SIZES[size])
+            calibration = _calibrate()
+            stages = {}
+            for name, func in _pipeline_stages(path):
+                stages[name] = _run_stage(func, repeat)
+            if client is not None:
+                endpoint_stages, uploads = _endpoint_stages(client, path)
+                for name, func in endpoint_stages:
+                    stages[name] = _run_stage(func, repeat)
+                for file_id in uploads:
+                    if file_id:
+                        app.upload_store.delete(file_id)
+            results[size] = {'features': features, 'calibration_ms': calibration, 'stages': stages}
+    return results
+
+
+def compare_results(results, baseline, tolerance=1.0, min_ms=5.0):
+    """
+    Regressions against a baseline: stages whose time or peak memory grew by
+    more than `tolerance` (a fraction). Baseline times are first scaled by how much
+    slower or faster the calibration workload ran, so a busier or different machine
+    does not count as a regression. Timings under `min_ms` are too noisy to judge.
+    """
+    regressions = []
+    for size, result in results.items():
+        base_result = baseline.get(size, {})
+        base_stages = base_result.get('stages', {})
+        scale = 1.0
+        if base_result.get('calibration_ms') and result.get('calibration_ms'):
+            scale = result['calibration_ms'] / base_result['calibration_ms']
+        for stage, measured in result['stages'].items():
+            base = base_stages.get(stage)
+            if base is None:
+                continue
+            expected = base['ms'] * scale
+            if max(measured['ms'], expected) >= min_ms and measured['ms'] > expected * (1 + tolerance):
+                regressions.append(f"{size} {stage}: {expected:.1f} ms expected, {measured['ms']:.1f} ms measured")
+            if measured['peak_kb'] > base['peak_kb'] * (1 + tolerance) + 64:
+                regressions.append(f"{size} {stage}: {base['peak_kb']:.0f} KB -> {measured['peak_kb']:.0f} KB peak")
+    return regressions
+
+
+def print_pipeline(results):
+    for size, result in results.items():
+        print(f"{size} model ({result['features']} features):")
+        for stage, measured in result['stages'].items():
+            print(f"  {stage:38} {measured['ms']:9.2f} ms  {measured['peak_kb']:9.0f} KB peak")
+
+
+def main_micro():
+    result = bench_schema()
+    print("Schema validation per request:")
+    print(f"  compile every time: {result['uncached_ms']:.3f} ms")
+    print(f"  cached schema:      {result['cached_ms']:.3f} ms")
+    print(f"  speedup:            {result['speedup']:.1f}x")
+
+    result = bench_constraints()
+    print("Translating 100 constraints over 1000 features:")
+    print(f"  re.sub per feature: {result['per_feature_ms']:.1f} ms")
+    print(f"  compiled translator: {result['compiled_ms']:.1f} ms")
+
+    result = bench_loader()
+    print(f"Loading a {result['xml_mb']:.1f} MB model ({result['stream']['features']} features):")
+    for name in ('dom', 'stream'):
+        print(f"  {name:6}: {result[name]['seconds'] * 1000:8.1f} ms, peak +{result[name]['peak_mb']:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the request pipeline.")
+    parser.add_argument('suite', nargs='?', choices=('micro', 'pipeline'), default='micro')
+    parser.add_argument('--sizes', nargs='+', choices=sorted(MODEL_SIZES), help="model sizes to run")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-endpoints', action='store_true', help="skip the HTTP endpoints")
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--tolerance', type=float, default=1.0, help="allowed growth, 1.0 = twice the baseline")
+    args = parser.parse_args(argv)
+
+    if args.suite == 'micro':
+        main_micro()
+        return 0
+
+    results = bench_pipeline(args.sizes, args.repeat, endpoints=not args.no_endpoints)
+    print_pipeline(results)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    if args.compare:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
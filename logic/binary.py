@@ -0,0 +1,341 @@
+"""
+Versioned binary format for parsed feature models and their compiled CNF.
+
+A file is a header, a section table and 8-byte aligned sections. Everything is
+little-endian; integer sections are flat int32 arrays and every string (feature
+names, group types, constraint texts, rule formulas) is interned once in a
+NUL-separated UTF-8 string table and referenced by its index (-1 for None).
+
+    header    "FMB\\0", version (u16), flags (u16), number of sections (u32)
+    table     per section: tag (4 bytes), offset (u64), length in bytes (u64)
+    STRS      string table
+    META      root feature index, number of features, constraints and variables
+    FEAT      per feature: name, parent feature index, mandatory, group type
+    COFF/CIDX solitary children as offsets (features + 1) into child indices
+    GOFF/GIDX group members, likewise
+    CONS      per constraint: englishStatement, booleanExpression
+    and with the CNF flag:
+    VARS      per variable: name, id
+    LOFF/LITS clauses as offsets (clauses + 1) into the flat literal array
+    RULE      per rule: kind, first clause, end clause
+    AOFF/ARGS rule arguments (strings) as offsets (rules + 1) into string indices
+    UNSP      unsupported constraint formulas
+    CRUL      rule index per constraint formula, -1 when it could not be encoded
+
+Files are read through mmap and each section is converted to Python with one
+bulk tolist() instead of value by value. The model and CNF are then built as
+the usual Python objects, so a loaded file takes as much memory as a parsed
+and compiled model; what it saves is the XML parsing, validation and
+compilation. Run from the repository root to compile a model:
+    python -m logic.binary model.xml model.fmb
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from logic.metrics import timed
+from logic.model import Feature, FeatureModel, load_model
+from logic.translate import CompiledCNF, compile_cnf
+
+MAGIC = b'FMB\0'
+VERSION = 1
+HAS_CNF = 1  # header flag
+
+_HEADER = struct.Struct('<4sHHI')
+_SECTION = struct.Struct('<4sQQ')
+
+RULE_KINDS = ('root', 'mandatory', 'parent', 'xor', 'or', 'constraint', 'retired')
+
+
+class BinaryFormatError(ValueError):
+    """Raised for files that are not in (this version of) the binary model format."""
+
+
+class _Strings:
+    # Interning table of the strings written to a file
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def __call__(self, value):
+        if value is None:
+            return -1
+        ref = self.index.get(value)
+        if ref is None:
+            ref = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return ref
+
+
+def _int32(values):
+    data = array('i', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def _rule_args(kind, args):
+    if kind in ('root', 'constraint'):
+        return [args]
+    if kind in ('mandatory', 'parent'):
+        return list(args)
+    if kind in ('xor', 'or'):
+        return [args[0]] + list(args[1])
+    return []  # retired rules are never rendered, so their arguments are dropped
+
+
+def _offsets(lists):
+    offsets = [0]
+    for items in lists:
+        offsets.append(offsets[-1] + len(items))
+    return offsets
+
+
+def encode(model, compiled=None):
+    """The binary form of a model (and optionally its CompiledCNF) as bytes."""
+    strings = _Strings()
+    positions = {name: i for i, name in enumerate(model.features)}
+    features = list(model.features.values())
+
+    feat = []
+    for feature in features:
+        feat += [strings(feature.name), positions.get(feature.parent, -1),
+                 int(feature.mandatory), strings(feature.group_type)]
+    cons = []
+    for constraint in model.constraints:
+        cons += [strings(constraint.get('englishStatement')), strings(constraint.get('booleanExpression'))]
+
+    sections = [
+        (b'META', [positions.get(model.root, -1), len(features), len(model.constraints),
+                   compiled.nv if compiled is not None else 0]),
+        (b'FEAT', feat),
+        (b'COFF', _offsets(f.children for f in features)),
+        (b'CIDX', [positions[name] for f in features for name in f.children]),
+        (b'GOFF', _offsets(f.group for f in features)),
+        (b'GIDX', [positions[name] for f in features for name in f.group]),
+        (b'CONS', cons),
+    ]
+    if compiled is not None:
+        variables = []
+        for name, feature_id in compiled.feature_ids.items():
+            variables += [strings(name), feature_id]
+        rules, args = [], []
+        for kind, rule_args, start, end in compiled.rules:
+            rules += [RULE_KINDS.index(kind), start, end]
+            args.append([strings(arg) for arg in _rule_args(kind, rule_args)])
+        sections += [
+            (b'VARS', variables),
+            (b'LOFF', _offsets(compiled.clauses)),
+            (b'LITS', [lit for clause in compiled.clauses for lit in clause]),
+            (b'RULE', rules),
+            (b'AOFF', _offsets(args)),
+            (b'ARGS', [ref for refs in args for ref in refs]),
+            (b'UNSP', [strings(formula) for formula in compiled.unsupported]),
+            (b'CRUL', [-1 if rule is None else rule for rule in compiled.constraint_rules]),
+        ]
+    # NUL can't occur in XML text, so it safely separates the strings
+    blobs = [(b'STRS', '\0'.join(strings.strings).encode('utf-8'))]
+    blobs += [(tag, _int32(values)) for tag, values in sections]
+
+    offset = _HEADER.size + _SECTION.size * len(blobs)
+    table, body = [], []
+    for tag, blob in blobs:
+        padding = -offset % 8
+        body.append(b'\0' * padding)
+        offset += padding
+        table.append(_SECTION.pack(tag, offset, len(blob)))
+        body.append(blob)
+        offset += len(blob)
+    header = _HEADER.pack(MAGIC, VERSION, HAS_CNF if compiled is not None else 0, len(blobs))
+    return b''.join([header] + table + body)
+
+
+@timed('save_binary')
+def save_binary(path, model, compiled=None):
+    """
+    Write a model (and optionally its CompiledCNF) to `path`. The file is
+    written under a temporary name and renamed, so readers never see half of it.
+    """
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as out:
+        out.write(encode(model, compiled))
+    os.replace(tmp, path)
+
+
+def _sections(buffer):
+    if len(buffer) < _HEADER.size:
+        raise BinaryFormatError("File too short")
+    magic, version, flags, count = _HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise BinaryFormatError("Not a binary feature model")
+    if version != VERSION:
+        raise BinaryFormatError(f"Unsupported format version {version}")
+    sections = {}
+    for i in range(count):
+        tag, offset, length = _SECTION.unpack_from(buffer, _HEADER.size + i * _SECTION.size)
+        if offset + length > len(buffer):
+            raise BinaryFormatError(f"Section {tag!r} is truncated")
+        sections[tag] = buffer[offset:offset + length]
+    return flags, sections
+
+
+def _ints(view):
+    # A view of the mapping on little-endian machines, a byte-swapped copy elsewhere
+    if sys.byteorder == 'little':
+        return view.cast('i')
+    data = array('i', view)
+    data.byteswap()
+    return memoryview(data)
+
+
+def decode(buffer):
+    """Rebuild (model, CompiledCNF or None) from the binary form in `buffer`."""
+    views = [memoryview(buffer)]
+    try:
+        flags, raw = _sections(views[0])
+        views += raw.values()
+
+        def ints(tag):
+            if tag not in raw:
+                raise BinaryFormatError(f"Missing section {tag!r}")
+            view = _ints(raw[tag])
+            views.append(view)
+            return view
+
+        strings = bytes(raw[b'STRS']).decode('utf-8').split('\0')
+
+        def string(ref):
+            return strings[ref] if ref >= 0 else None
+
+        root, feature_count, constraint_count, nv = ints(b'META').tolist()
+
+        feat = ints(b'FEAT').tolist()
+        names = [strings[ref] for ref in feat[0::4]]
+        # Resolve all child and member names at once; each feature then takes a slice
+        child_offsets = ints(b'COFF').tolist()
+        children = [names[i] for i in ints(b'CIDX').tolist()]
+        group_offsets = ints(b'GOFF').tolist()
+        members = [names[i] for i in ints(b'GIDX').tolist()]
+        model = FeatureModel()
+        for i, name in enumerate(names):
+            parent = feat[4 * i + 1]
+            feature = Feature(name, bool(feat[4 * i + 2]), names[parent] if parent >= 0 else None, i)
+            feature.group_type = string(feat[4 * i + 3])
+            feature.children = tuple(children[child_offsets[i]:child_offsets[i + 1]])
+            feature.group = tuple(members[group_offsets[i]:group_offsets[i + 1]])
+            model.features[name] = feature
+        model.root = names[root] if root >= 0 else None
+        cons = ints(b'CONS').tolist()
+        model.constraints = [
+            {'englishStatement': string(cons[2 * i]), 'booleanExpression': string(cons[2 * i + 1])}
+            for i in range(constraint_count)
+        ]
+        model.source_size = len(buffer)
+        if not flags & HAS_CNF:
+            return model, None
+
+        variables = ints(b'VARS').tolist()
+        compiled = CompiledCNF({strings[ref]: feature_id
+                                for ref, feature_id in zip(variables[0::2], variables[1::2])})
+        compiled.nv = nv
+        offsets, lits = ints(b'LOFF').tolist(), ints(b'LITS').tolist()
+        compiled.clauses = [lits[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        rules = ints(b'RULE').tolist()
+        arg_offsets = ints(b'AOFF').tolist()
+        args = [string(ref) for ref in ints(b'ARGS').tolist()]
+        for i in range(len(rules) // 3):
+            kind = RULE_KINDS[rules[3 * i]]
+            values = args[arg_offsets[i]:arg_offsets[i + 1]]
+            if kind in ('root', 'constraint'):
+                rule_args = values[0]
+            elif kind in ('mandatory', 'parent'):
+                rule_args = tuple(values)
+            elif kind in ('xor', 'or'):
+                rule_args = (values[0], tuple(values[1:]))
+            else:
+                rule_args = None
+            compiled.rules.append((kind, rule_args, rules[3 * i + 1], rules[3 * i + 2]))
+        compiled.unsupported = [strings[ref] for ref in ints(b'UNSP').tolist()]
+        compiled.constraint_rules = [None if rule < 0 else rule for rule in ints(b'CRUL').tolist()]
+        return model, compiled
+    except (IndexError, UnicodeDecodeError, struct.error) as e:
+        raise BinaryFormatError(f"Corrupt binary feature model: {e}") from e
+    finally:
+        # Views into an mmap must be released before it can be closed
+        for view in reversed(views):
+            view.release()
+
+
+@timed('load_binary')
+def load_binary(path):
+    """
+    Load (model, CompiledCNF or None) from a file written by save_binary.
+    Raises BinaryFormatError for files in another format or version.
+    """
+    with open(path, 'rb') as source:
+        if os.fstat(source.fileno()).st_size == 0:
+            raise BinaryFormatError("File too short")
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return decode(buffer)
+
+
+def is_binary(path):
+    """Whether `path` starts like a binary feature model."""
+    try:
+        with open(path, 'rb') as source:
+            return source.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class BinaryModelStore:
+    """
+    Binary forms of uploaded models on disk, keyed by content digest
+    (<root>/<first two chars>/<digest>.fmb), so a model evicted from memory or
+    needed after a restart is loaded without re-parsing and re-encoding its XML.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.fmb")
+
+    def load(self, digest):
+        """(model, CompiledCNF or None) stored for `digest`, or None if there is none usable."""
+        try:
+            return load_binary(self.path(digest))
+        except (OSError, BinaryFormatError):
+            return None
+
+    def save(self, digest, model, compiled=None):
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        save_binary(path, model, compiled)
+
+    def discard(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a feature model XML file to the binary format.")
+    parser.add_argument('xml')
+    parser.add_argument('out')
+    parser.add_argument('--xsd', help="validate against this schema while parsing")
+    parser.add_argument('--no-cnf', action='store_true', help="store the model only")
+    args = parser.parse_args(argv)
+    model = load_model(args.xml, args.xsd)
+    compiled = None if args.no_cnf else compile_cnf(model)
+    save_binary(args.out, model, compiled)
+    print(f"{len(model)} features written to {args.out} ({os.path.getsize(args.out)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
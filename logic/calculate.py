@@ -1,19 +1,172 @@
-def calculate_mwp(features, feature_ids, cnf):
-    from pysat.solvers import Solver
-    
-    solver = Solver()
-    for clause in cnf.clauses:
-        solver.add_clause(clause)
+from pysat.solvers import Solver
+
+from logic.metrics import timed
+from logic.translate import compile_cnf
+
 
+def calculate_mwp(features, feature_ids, cnf):
     selected_ids = set()
     id_to_feature = {v: k for k, v in feature_ids.items()}
     mwp_features = []
 
-    # Try enabling features one by one to find the minimal working configuration
-    for feature, feature_id in feature_ids.items():
-        if feature_id not in selected_ids:
-            if solver.solve(assumptions=list(selected_ids) + [feature_id]):
-                selected_ids.add(feature_id)
-                mwp_features.append(feature)
+    with Solver(bootstrap_with=cnf.clauses) as solver:
+        # Try enabling features one by one to find the minimal working configuration
+        for feature, feature_id in feature_ids.items():
+            if feature_id not in selected_ids:
+                if solver.solve(assumptions=list(selected_ids) + [feature_id]):
+                    selected_ids.add(feature_id)
+                    mwp_features.append(feature)
+
+    return mwp_features
+
+
+def _parent_vars(compiled):
+    """
+    Tree parent of every feature variable, from the compiled rules: solitary
+    children have a child → parent rule and group members are listed in their
+    parent's xor/or rule. Read from the CNF rather than a TreeIndex because
+    analysis jobs get only the compiled CNF, not the model.
+    """
+    ids = compiled.feature_ids
+    parents = {}
+    for kind, args, _, _ in compiled.rules:
+        if kind == 'parent':
+            child, parent = args
+            parents[ids[child]] = ids[parent]
+        elif kind in ('xor', 'or'):
+            parent, members = args
+            for member in members:
+                parents[ids[member]] = ids[parent]
+    return parents
+
+
+def _frontier(selected, parents):
+    """
+    The selected features none of whose children are selected. A selection that
+    follows the tree contains every ancestor of these, so "all of `selected`" and
+    "all of the frontier" are the same condition and the shorter one is used in clauses.
+    """
+    inner = {parents.get(v) for v in selected}
+    return [v for v in selected if v not in inner]
+
+
+def _shrink(solver, selected, feature_vars, next_var, parents):
+    """
+    Shrink a satisfying selection until no valid strict subset of it exists.
+    Each step asks for a model that keeps every unselected feature off and drops at
+    least one selected feature (dropping any of them drops a frontier feature with
+    it); the "drop one" clause is switched on by a fresh activation literal so it can
+    be retired afterwards. Returns (selected, next_var).
+    """
+    while True:
+        activation = next_var
+        next_var += 1
+        solver.add_clause([-activation] + [-v for v in _frontier(selected, parents)])
+        selected_set = set(selected)
+        assumptions = [activation] + [-v for v in feature_vars if v not in selected_set]
+        found = solver.solve(assumptions=assumptions)
+        if found:
+            positive = {lit for lit in solver.get_model() if lit > 0}
+            selected = [v for v in feature_vars if v in positive]
+        solver.add_clause([-activation])  # retire the temporary clause
+        if not found:
+            return selected, next_var
+
+
+@timed('mwp')
+def iter_minimum_working_products(source, constraints=(), limit=None, offset=0):
+    """
+    Lazily enumerate the Minimum Working Products of a feature model: the valid
+    configurations (cross-tree constraints included) of which no strict subset is valid.
+    `source` may be a FeatureModel, an XML path or an already compiled CNF.
+    Each configuration is a sorted list of feature names. After a product is found,
+    a blocking clause rules out it and every superset, so the solver is reused
+    incrementally and nothing is materialised up front.
+    """
+    compiled = compile_cnf(source, constraints)
+    id_to_feature = compiled.names
+    feature_vars = compiled.feature_vars()
+    parents = _parent_vars(compiled)
+    next_var = compiled.nv + 1
+
+    with Solver(name='m22', bootstrap_with=compiled.clauses) as solver:
+        # Prefer leaving features out, which keeps the shrinking steps short
+        solver.set_phases([-v for v in feature_vars])
+        produced = 0
+        while limit is None or produced < offset + limit:
+            if not solver.solve():
+                return
+            positive = {lit for lit in solver.get_model() if lit > 0}
+            selected = [v for v in feature_vars if v in positive]
+            selected, next_var = _shrink(solver, selected, feature_vars, next_var, parents)
+
+            # Block this product and all of its supersets
+            solver.add_clause([-v for v in _frontier(selected, parents)])
+            if produced >= offset:
+                yield sorted(id_to_feature[v] for v in selected)
+            produced += 1
+
+
+def encode_bitset(configuration, feature_ids):
+    """
+    Encode a configuration as a hex bitset: bit (id - 1) is set for every selected
+    feature. Decode with decode_bitset and the model's feature order.
+    """
+    bits = 0
+    for name in configuration:
+        bits |= 1 << (feature_ids[name] - 1)
+    return format(bits, 'x')
+
+
+def decode_bitset(bits, feature_order):
+    """
+    Feature names of a hex bitset; `feature_order[i]` is the feature with id i + 1.
+    """
+    value = int(bits, 16)
+    return [name for i, name in enumerate(feature_order) if value >> i & 1]
+
+
+def format_configuration(configuration, encoding, feature_ids):
+    """
+    A configuration as returned to clients: comma-joined names or a hex bitset.
+    """
+    if encoding == 'bitset':
+        return encode_bitset(configuration, feature_ids)
+    return ", ".join(configuration)
+
+
+def iter_analysis(source, constraints=(), limit=None, offset=0, encoding='names'):
+    """
+    analyse_model as a generator, for streaming: it first yields the result
+    without the configurations, then each formatted configuration as it is
+    found. With a `limit`, up to `limit` + 1 are yielded; an extra one means
+    more would follow.
+    """
+    compiled = compile_cnf(source, constraints)
+    summary = {
+        "propositionalLogic": compiled.formulas(),
+        "unsupported": list(compiled.unsupported),
+    }
+    if encoding == 'bitset':
+        summary["featureOrder"] = [compiled.names[v] for v in compiled.feature_vars()]
+    yield summary
+    probe = limit + 1 if limit is not None else None
+    for config in iter_minimum_working_products(compiled, limit=probe, offset=offset):
+        yield format_configuration(config, encoding, compiled.feature_ids)
+
 
-    return mwp_features
\ No newline at end of file
+def analyse_model(source, constraints=(), limit=None, offset=0, encoding='names'):
+    """
+    Compile a model once and compute what /process_logic_and_mwp returns:
+    the propositional logic formulas and the formatted MWP configurations.
+    With a `limit`, one extra product is looked for to tell whether more follow
+    (`hasMore`). With encoding='bitset' configurations are hex bitsets over
+    `featureOrder`. `unsupported` lists the constraint formulas that could not be
+    encoded and so were left out of the products.
+    """
+    items = iter_analysis(source, constraints, limit, offset, encoding)
+    result = next(items)
+    configurations = list(items)
+    result["mwpConfigurations"] = configurations[:limit]
+    result["hasMore"] = limit is not None and len(configurations) > limit
+    return result
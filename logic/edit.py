@@ -0,0 +1,249 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from logic.metrics import timed
+from logic.parse import constraint_translator
+from logic.session import SolverSession
+from logic.translate import add_constraint_rule, add_group_rule, compile_cnf, variable_lookup
+
+# Supported edit operations, as sent by clients:
+#   {"op": "addConstraint", "englishStatement": "...", "booleanExpression": "..."}
+#   {"op": "removeConstraint", "index": 0}
+#   {"op": "setMandatory", "feature": "GPS", "mandatory": true}
+#   {"op": "setGroupType", "feature": "Location", "groupType": "xor"}
+EDIT_OPS = ('addConstraint', 'removeConstraint', 'setMandatory', 'setGroupType')
+
+
+def edit_error(edit):
+    """Why `edit` is not a well-formed edit (see EDIT_OPS), or None if it is."""
+    op = edit.get('op')
+    if op not in EDIT_OPS:
+        return f"op must be one of {', '.join(EDIT_OPS)}."
+    if op == 'addConstraint':
+        english, expression = edit.get('englishStatement'), edit.get('booleanExpression')
+        if not all(value is None or isinstance(value, str) for value in (english, expression)):
+            return "englishStatement and booleanExpression must be strings."
+        if not english and not expression:
+            return "addConstraint needs an englishStatement or a booleanExpression."
+    elif op == 'removeConstraint':
+        index = edit.get('index')
+        if not isinstance(index, int) or isinstance(index, bool):
+            return "removeConstraint needs an integer index."
+    elif op == 'setMandatory':
+        if not isinstance(edit.get('feature'), str) or not isinstance(edit.get('mandatory'), bool):
+            return "setMandatory needs a feature name and a boolean mandatory."
+    elif not isinstance(edit.get('feature'), str) or not isinstance(edit.get('groupType'), str):
+        return "setGroupType needs a feature name and a groupType."
+    return None
+
+
+class ModelEditor:
+    """
+    An editable copy of a feature model with its compiled CNF and, once used, a
+    warm solver session. Each edit recompiles only the rules it touches: the old
+    rule is retired in place, the new one is appended, and the solver session
+    is updated incrementally, so an edit costs time in proportion to its own
+    size rather than the model's.
+    """
+
+    def __init__(self, model):
+        self.model = model.copy()
+        self.compiled = compile_cnf(self.model)
+        self.applied = 0  # edits applied so far, i.e. the sequence number of the next one
+        self.stale = False  # set when an applied edit did not make it into the edit log
+        self.lock = threading.RLock()  # held while applying edits
+        self._session = None
+        # Feature names never change, so the base model's translator keeps serving
+        self._translator = constraint_translator(model)
+        self._lookup = variable_lookup(self.compiled)
+        self._rules = {}  # ('mandatory' | 'group', feature name) -> rule index
+        for index, (kind, args, _, _) in enumerate(self.compiled.rules):
+            if kind == 'mandatory':
+                self._rules[('mandatory', args[1])] = index
+            elif kind in ('xor', 'or'):
+                self._rules[('group', args[0])] = index
+        # Rule index of each of the model's constraints, or None when it could not be encoded
+        self._constraint_rules = self.compiled.constraint_rules[:len(self.model.constraints)]
+
+    def sync(self, load_edits):
+        """
+        Apply the logged edits this editor lacks. `load_edits(start)` reads the
+        edit log from sequence number `start` on; it is called under the
+        editor's lock with the sequence number of the editor's next edit, so
+        only the missing edits are read and replayed. Returns False, applying
+        nothing, if the editor is stale and must be rebuilt.
+        """
+        with self.lock:
+            if self.stale:
+                return False
+            for edit in load_edits(self.applied):
+                self.apply(edit)
+            return True
+
+    def session(self):
+        """The solver session of the edited model, kept up to date by apply()."""
+        with self.lock:
+            if self._session is None or self._session.closed:
+                # Every rule an edit can retire gets a selector, so no edit rebuilds the solver
+                retirable = [rule for rule in self._constraint_rules if rule is not None]
+                retirable += self._rules.values()
+                self._session = SolverSession(self.compiled, retirable)
+            return self._session
+
+    @timed('apply_edit')
+    def apply(self, edit):
+        """
+        Apply one edit (see EDIT_OPS). Raises KeyError, IndexError or ValueError
+        for edits that are malformed or don't fit the model; the model is then
+        left unchanged.
+        """
+        with self.lock:
+            self._apply(edit)
+            self.applied += 1
+
+    def _apply(self, edit):
+        # Everything that can fail is checked before the model changes
+        error = edit_error(edit)
+        if error is not None:
+            raise ValueError(error)
+        op = edit['op']
+        if op == 'addConstraint':
+            english, expression = edit.get('englishStatement'), edit.get('booleanExpression')
+            formula = expression or self._translator.translate(english)
+            rule = add_constraint_rule(self.compiled, formula, self._lookup)
+            self.model.add_constraint(english, expression)
+            self._constraint_rules.append(rule)
+            self._added(rule)
+        elif op == 'removeConstraint':
+            index = edit['index']
+            self.model.remove_constraint(index)
+            self._retired(self._constraint_rules.pop(index))
+        elif op == 'setMandatory':
+            name, mandatory = edit['feature'], edit['mandatory']
+            self.model.set_mandatory(name, mandatory)
+            if (('mandatory', name) in self._rules) == mandatory:
+                return  # already encoded that way
+            rule = self._rules.pop(('mandatory', name), None)
+            self._retired(rule)
+            if mandatory:
+                feature = self.model[name]
+                parent_id, feature_id = self.compiled.var(feature.parent), self.compiled.var(name)
+                rule = self.compiled.add_rule('mandatory', (feature.parent, name), [[-parent_id, feature_id]])
+                self._rules[('mandatory', name)] = rule
+                self._added(rule)
+        else:
+            name = edit['feature']
+            self.model.set_group_type(name, edit.get('groupType'))
+            current = self._rules.get(('group', name))
+            if current is not None and self.compiled.rules[current][0] == edit.get('groupType'):
+                return  # already encoded that way
+            self._retired(self._rules.pop(('group', name), None))
+            rule = add_group_rule(self.compiled, self.model[name])
+            self._rules[('group', name)] = rule
+            self._added(rule)
+
+    def _added(self, rule):
+        if rule is not None and self._session is not None and not self._session.closed:
+            self._session.add_rule(rule)
+
+    def _retired(self, rule):
+        if rule is None:
+            return
+        self.compiled.retire_rule(rule)
+        if self._session is not None and not self._session.closed:
+            self._session.retire_rule(rule)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+class EditorPool:
+    """
+    Model editors of edited uploads, keyed by fileId; the least recently used
+    beyond `max_editors` are closed and rebuilt from the stored edits when needed.
+    Requests hold an editor's solver session through checkout(); an editor that
+    is evicted, replaced or discarded meanwhile is closed once it is returned.
+    """
+
+    def __init__(self, max_editors=64):
+        self.max_editors = max_editors
+        self._editors = OrderedDict()
+        self._users = {}  # editor -> number of checkouts not yet returned
+        self._dropped = set()  # editors out of the pool, closed once returned
+        self._lock = threading.Lock()
+
+    def get(self, key, base_factory, load_edits):
+        """
+        Return the editor for `key` with every edit of its log applied, building
+        it on `base_factory()` (the unedited model) if needed. `load_edits` reads
+        the log (see ModelEditor.sync) under the editor's lock, so edits logged by
+        other requests or processes meanwhile are neither skipped nor applied twice.
+        """
+        with self._lock:
+            editor = self._editors.get(key)
+            if editor is not None:
+                self._editors.move_to_end(key)
+        if editor is None or not editor.sync(load_edits):
+            editor = ModelEditor(base_factory())
+            editor.sync(load_edits)
+        evicted = []
+        with self._lock:
+            old = self._editors.get(key)
+            if old is not None and old is not editor:
+                evicted.append(self._drop(old))  # stale, or built by another request meanwhile
+            self._editors[key] = editor
+            while len(self._editors) > self.max_editors:
+                evicted.append(self._drop(self._editors.popitem(last=False)[1]))
+        for old in evicted:
+            if old is not None:
+                old.close()
+        return editor
+
+    @contextmanager
+    def checkout(self, key):
+        """
+        Solver session of the editor for `key`, or None if there is no such
+        editor, kept open until the `with` block is left.
+        """
+        with self._lock:
+            editor = self._editors.get(key)
+            if editor is not None:
+                self._users[editor] = self._users.get(editor, 0) + 1
+        if editor is None:
+            yield None
+            return
+        try:
+            yield editor.session()
+        finally:
+            self._release(editor)
+
+    def _drop(self, editor):
+        # Under self._lock: the editor left the pool, returned if it can be closed now
+        if editor in self._users:
+            self._dropped.add(editor)
+            return None
+        return editor
+
+    def _release(self, editor):
+        with self._lock:
+            users = self._users.pop(editor) - 1
+            if users:
+                self._users[editor] = users
+                return
+            if editor not in self._dropped:
+                return
+            self._dropped.discard(editor)
+        editor.close()
+
+    def discard(self, key):
+        with self._lock:
+            editor = self._editors.pop(key, None)
+            if editor is not None:
+                editor = self._drop(editor)
+        if editor is not None:
+            editor.close()
+
+    def __contains__(self, key):
+        return key in self._editors
@@ -0,0 +1,110 @@
+"""
+Synthetic feature models for benchmarks and load tests.
+
+Run from the repository root:
+    python -m logic.generate out.xml --depth 5 --branching 3 --seed 1
+"""
+import argparse
+import random
+import string
+from xml.sax.saxutils import quoteattr, escape
+
+
+def feature_name(index):
+    """
+    Letters-only name for the index-th feature ("Fa", "Fb", ..., "Fba", ...), so
+    English constraints about it can be translated.
+    """
+    letters = []
+    while True:
+        index, digit = divmod(index, 26)
+        letters.append(string.ascii_lowercase[digit])
+        if index == 0:
+            break
+    return "F" + "".join(reversed(letters))
+
+
+def generate_model(out, depth=4, branching=3, group_ratio=0.3, xor_ratio=0.5,
+                   mandatory_ratio=0.3, constraint_density=0.1, exclude_ratio=0.2, seed=None):
+    """
+    Write an XSD-valid feature model to the text stream `out` and return its
+    number of features.
+
+    Every feature above `depth` has `branching` children; with probability
+    `group_ratio` they form a group (xor with probability `xor_ratio`, otherwise
+    or), else they are solitary and each is mandatory with probability
+    `mandatory_ratio`. `constraint_density` cross-tree constraints are written
+    per feature: English "A depends on B" statements, of which `exclude_ratio`
+    are "A excludes B" boolean expressions instead.
+    """
+    rng = random.Random(seed)
+    names = []
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n<featureModel>\n')
+
+    # Depth-first with an explicit stack of (level, mandatory) entries and closing tags
+    stack = [(0, None)]
+    while stack:
+        entry = stack.pop()
+        if isinstance(entry, str):
+            out.write(entry)
+            continue
+        level, mandatory = entry
+        name = feature_name(len(names))
+        names.append(name)
+        attributes = f' name={quoteattr(name)}'
+        if mandatory is not None:
+            attributes += f' mandatory="{"true" if mandatory else "false"}"'
+        if level + 1 >= depth or branching < 1:
+            out.write(f'<feature{attributes}/>\n')
+            continue
+
+        out.write(f'<feature{attributes}>\n')
+        stack.append('</feature>\n')
+        if branching > 1 and rng.random() < group_ratio:
+            group_type = 'xor' if rng.random() < xor_ratio else 'or'
+            out.write(f'<group type="{group_type}">\n')
+            stack.append('</group>\n')
+            stack.extend([(level + 1, None)] * branching)
+        else:
+            stack.extend((level + 1, rng.random() < mandatory_ratio) for _ in range(branching))
+
+    constraints = int(round(constraint_density * len(names)))
+    if constraints and len(names) > 1:
+        out.write('<constraints>\n')
+        for _ in range(constraints):
+            a, b = rng.sample(names, 2)
+            if rng.random() < exclude_ratio:
+                body = f'<booleanExpression>{escape(a)} excludes {escape(b)}</booleanExpression>'
+            else:
+                body = f'<englishStatement>{escape(a)} depends on {escape(b)}</englishStatement>'
+            out.write(f'<constraint>{body}</constraint>\n')
+        out.write('</constraints>\n')
+    out.write('</featureModel>\n')
+    return len(names)
+
+
+def write_model(path, **options):
+    """Write a synthetic model to `path`; see generate_model for the options."""
+    with open(path, 'w', encoding='utf-8') as out:
+        return generate_model(out, **options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic feature model.")
+    parser.add_argument('path')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--branching', type=int, default=3)
+    parser.add_argument('--group-ratio', type=float, default=0.3)
+    parser.add_argument('--xor-ratio', type=float, default=0.5)
+    parser.add_argument('--mandatory-ratio', type=float, default=0.3)
+    parser.add_argument('--constraint-density', type=float, default=0.1)
+    parser.add_argument('--exclude-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    options = vars(args)
+    path = options.pop('path')
+    print(f"{write_model(path, **options)} features written to {path}")
+
+
+if __name__ == "__main__":
+    main()
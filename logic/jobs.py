@@ -0,0 +1,298 @@
+import inspect
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from multiprocessing.connection import wait
+
+from logic.metrics import Span, stage_metrics, start_collecting
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, TIMEOUT, CANCELLED)
+
+_ITEM = 'item'  # message of a worker with one item yielded by a generator job
+_END = object()  # marks the end of a job's items
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised by JobManager.submit when too many jobs are waiting."""
+
+
+class Job:
+    def __init__(self, func, args, kwargs, timeout, shared=False):
+        self.id = str(uuid.uuid4())
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.shared = shared  # reported to JobManager.on_change, for polling from other processes
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.spans = []  # metrics.Span of the stages measured while the job ran
+        self.items = queue.SimpleQueue()  # items of a generator job as they arrive, then _END
+        self.done = threading.Event()
+        self.process = None
+        self.conn = None
+
+    def to_dict(self):
+        data = {'jobId': self.id, 'status': self.status}
+        if self.status == DONE:
+            data['result'] = self.result
+        elif self.error:
+            data['error'] = self.error
+        if self.started:
+            end = self.finished or time.time()
+            data['elapsed'] = round(end - self.started, 3)
+        return data
+
+
+def _run_job(conn, func, args, kwargs):
+    # Runs in the worker process; the outcome and the spans measured on the way
+    # are sent back through the pipe, after the items of a generator job
+    spans = start_collecting()
+    try:
+        result = func(*args, **kwargs)
+        if inspect.isgenerator(result):
+            for item in result:
+                conn.send((_ITEM, item, None))
+            result = None
+        conn.send((DONE, result, [span.to_tuple() for span in spans]))
+    except BaseException as e:
+        logger.exception("Job %s failed", getattr(func, '__name__', func))
+        conn.send((FAILED, f"{type(e).__name__}: {e}", [span.to_tuple() for span in spans]))
+    finally:
+        conn.close()
+
+
+class JobManager:
+    """
+    Runs CPU-heavy functions in separate processes, at most `max_workers` at a time.
+    Each job gets its own process so it can be killed on timeout or cancellation.
+    At most `max_queue` jobs wait for a free worker; beyond that submit() raises
+    QueueFull. The last `keep_finished` finished jobs are kept for polling.
+    Jobs are started with `start_method` (the platform default if None). A
+    forked job inherits every lock of this multi-threaded process in whatever
+    state it was in; 'forkserver' starts jobs from a clean single-threaded
+    process instead, with the `preload` modules already imported. Functions
+    and arguments must then be picklable.
+    Jobs submitted with shared=True are passed to the `on_change` callbacks
+    whenever they are queued, started or finished, so their state can be
+    published where other server processes find it. A job whose function is a
+    generator sends each item as it is yielded; iter_items() hands them out.
+    """
+
+    def __init__(self, max_workers=None, max_queue=64, default_timeout=60, keep_finished=256,
+                 start_method=None, preload=()):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self.keep_finished = keep_finished
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver' and preload:
+            self._context.set_forkserver_preload(list(preload))
+        self._jobs = OrderedDict()
+        self._queue = deque()
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._dispatcher = None
+        self.on_change = []  # callbacks taking a shared Job; called with the lock held
+
+    def submit(self, func, *args, timeout=None, shared=False, **kwargs):
+        """Queue func(*args, **kwargs) and return the job id."""
+        job = Job(func, args, kwargs, timeout or self.default_timeout, shared)
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFull(f"{len(self._queue)} jobs are already waiting")
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._prune()
+            self._changed(job)
+        self._start_dispatcher()
+        self._wakeup.set()
+        return job.id
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job has finished (or timeout seconds passed) and return it."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.done.wait(timeout)
+        return job
+
+    def iter_items(self, job_id):
+        """
+        Yield the items of a generator job as they arrive, until it has finished.
+        Whether it finished normally is then told by the job's status.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        while True:
+            item = job.items.get()
+            if item is _END:
+                return
+            yield item
+
+    def run(self, func, *args, timeout=None, **kwargs):
+        """Submit a job and wait for it; returns the finished Job."""
+        job_id = self.submit(func, *args, timeout=timeout, **kwargs)
+        job = self._jobs[job_id]
+        job.done.wait()
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns False if it had already finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return False
+            if job.status == QUEUED:
+                self._queue.remove(job)
+            else:
+                self._stop(job)
+            self._finish(job, CANCELLED, error="Cancelled")
+        self._wakeup.set()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'running': len(self._running),
+                'queued': len(self._queue),
+                'maxQueue': self.max_queue,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            for job in list(self._queue):
+                self._finish(job, CANCELLED, error="Shut down")
+            self._queue.clear()
+            for job in list(self._running.values()):
+                self._stop(job)
+                self._finish(job, CANCELLED, error="Shut down")
+        self._wakeup.set()
+
+    def _start_dispatcher(self):
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name='job-dispatcher', daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch(self):
+        while not self._stopped:
+            with self._lock:
+                while self._queue and len(self._running) < self.max_workers:
+                    self._launch(self._queue.popleft())
+                conns = [job.conn for job in self._running.values()]
+
+            if conns:
+                ready = wait(conns, timeout=0.05)
+            else:
+                self._wakeup.wait(1.0)
+                ready = []
+            self._wakeup.clear()
+
+            with self._lock:
+                now = time.time()
+                for job in list(self._running.values()):
+                    status, value, spans = self._receive(job) if job.conn in ready else (None, None, None)
+                    if status is not None:
+                        # The worker's stages count towards this process's metrics
+                        job.spans = [Span('job_queue', job.started - job.submitted, 0.0)]
+                        job.spans += [Span(*span) for span in spans]
+                        for span in job.spans:
+                            stage_metrics.observe(span)
+                        self._stop(job)
+                        if status == DONE:
+                            self._finish(job, DONE, result=value)
+                        else:
+                            self._finish(job, FAILED, error=value)
+                    elif now - job.started > job.timeout:
+                        self._stop(job)
+                        self._finish(job, TIMEOUT, error=f"Timed out after {job.timeout} s")
+
+    def _receive(self, job):
+        # Pass on the items waiting in the job's pipe; returns its outcome message
+        # once it arrives, or (None, None, None) if there is none yet
+        while True:
+            try:
+                status, value, spans = job.conn.recv()
+            except (EOFError, OSError):
+                return FAILED, "Worker process died", []
+            if status != _ITEM:
+                return status, value, spans
+            job.items.put(value)
+            if not job.conn.poll():
+                return None, None, None
+
+    def _launch(self, job):
+        parent_conn, child_conn = self._context.Pipe(duplex=False)
+        job.conn = parent_conn
+        job.process = self._context.Process(
+            target=_run_job, args=(child_conn, job.func, job.args, job.kwargs), daemon=True
+        )
+        job.process.start()
+        child_conn.close()
+        job.status = RUNNING
+        job.started = time.time()
+        self._running[job.id] = job
+        self._changed(job)
+
+    def _stop(self, job):
+        # Kill the worker process (if any) and release its resources
+        self._running.pop(job.id, None)
+        if job.process is not None:
+            if job.process.is_alive():
+                job.process.terminate()
+            job.process.join(1)
+            job.process = None
+        if job.conn is not None:
+            job.conn.close()
+            job.conn = None
+
+    def _finish(self, job, status, result=None, error=None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished = time.time()
+        job.func = job.args = job.kwargs = None
+        job.items.put(_END)
+        job.done.set()
+        self._changed(job)
+
+    def _changed(self, job):
+        # Callbacks see the job's states in order, since they run under the lock
+        if not job.shared:
+            return
+        for callback in self.on_change:
+            try:
+                callback(job)
+            except Exception:
+                logger.exception("Job state callback failed for %s", job.id)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
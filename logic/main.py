@@ -1,26 +1,149 @@
-from parse import parse_feature_model, find_minimum_working_product, parse_feature_model1
-from validate import validate_configuration
-from translate import translate_to_cnf
-from xmlvalidate import validate_xml
-from calculate import calculate_mwp
+"""
+Analyse feature models from the command line: schema validation, propositional
+logic formulas and minimum working products (MWP) for every model, in parallel
+worker processes. One JSON line per model is written, in input order.
 
-xml_file = 'feature-model.xml'
+    python -m logic.main 'models/**/*.xml' --workers 8 --timeout 120 --out results.jsonl
+    python logic/main.py                  # the bundled feature-model.xml
 
-valid = validate_xml(xml_file, 'feature-model.xsd')
+Models may also be in the binary format of logic/binary.py. The exit status is
+1 when any model was invalid, failed or timed out.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
 
-# Step 1: Parse XML
-#logic_formulas, feature_ids = parse_feature_model(xml_file)
-logic_formulas = parse_feature_model(xml_file)
-for formula in logic_formulas:
-        print(formula)
+# Allow running this script directly from the logic folder
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
 
-features = parse_feature_model1(xml_file)
+from lxml import etree
 
-    # Find the Minimum Working Product (MWP) configurations that satisfy crosstree constraints
-mwp_configurations = find_minimum_working_product(features)
+from logic.binary import is_binary, load_binary
+from logic.calculate import analyse_model
+from logic.jobs import JobManager, DONE
+from logic.model import load_model
+from logic.translate import compile_cnf
+from logic.xmlvalidate import get_schema
 
-    # Output the MWP configurations
-print("Minimum Working Product (MWP) configurations satisfying crosstree constraints:")
-for config in mwp_configurations:
-    print(", ".join(config))
+XML_FILE = os.path.join(HERE, 'feature-model.xml')
+XSD_FILE = os.path.join(HERE, 'feature-model.xsd')
 
+
+def expand_paths(patterns):
+    """
+    Files named by `patterns` (paths or globs, `**` included), in order and
+    without duplicates. Patterns matching nothing are kept so they are reported.
+    """
+    paths, seen = [], set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for path in matches or [pattern]:
+            if path not in seen and not os.path.isdir(path):
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def analyse_file(path, xsd_file=None, mwp_limit=None):
+    """
+    Validate and analyse one model file; returns the fields of its result line.
+    Runs in a worker process.
+    """
+    compiled = None
+    if is_binary(path):
+        model, compiled = load_binary(path)
+    else:
+        try:
+            model = load_model(path, xsd_file)
+        except etree.XMLSyntaxError as e:
+            return {'status': 'invalid', 'error': str(e)}
+    compiled = compiled or compile_cnf(model)
+    result = analyse_model(compiled, limit=mwp_limit)
+    return {
+        'status': DONE,
+        'features': len(model),
+        'constraints': len(model.constraints),
+        'unsupported': compiled.unsupported,
+        'propositionalLogic': result['propositionalLogic'],
+        'mwpConfigurations': result['mwpConfigurations'],
+        'hasMore': result['hasMore'],
+    }
+
+
+def run_batch(paths, out, workers=None, timeout=60, xsd_file=XSD_FILE, mwp_limit=None):
+    """
+    Analyse `paths` on `workers` processes and write one JSON line per model to
+    `out`, in input order. Returns the number of models that did not succeed.
+    """
+    if xsd_file:
+        # Compiled once here; forked workers inherit it instead of recompiling it
+        get_schema(xsd_file)
+    jobs = JobManager(max_workers=workers, max_queue=len(paths) or 1, default_timeout=timeout)
+    failures = 0
+    # Only a few jobs ahead of the output are submitted, so finished results don't pile up
+    window = 2 * jobs.max_workers
+    pending = []
+    remaining = iter(paths)
+    try:
+        while True:
+            for path in remaining:
+                if not os.path.isfile(path):
+                    pending.append((path, None))
+                else:
+                    pending.append((path, jobs.submit(analyse_file, path, xsd_file, mwp_limit)))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+            path, job_id = pending.pop(0)
+            line = {'path': path}
+            if job_id is None:
+                line.update(status='failed', error="No such file")
+            else:
+                job = jobs.wait(job_id)
+                line['elapsed'] = round(job.finished - job.started, 3) if job.started else 0.0
+                if job.status == DONE:
+                    line.update(job.result)
+                else:
+                    line.update(status=job.status, error=job.error)
+            if line['status'] != DONE:
+                failures += 1
+            out.write(json.dumps(line, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        jobs.shutdown()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse feature models in parallel, one JSON line per model.")
+    parser.add_argument('paths', nargs='*', default=[XML_FILE],
+                        help="model files or glob patterns (default: the bundled feature-model.xml)")
+    parser.add_argument('--out', help="write the JSON lines to this file instead of stdout")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--timeout', type=float, default=60, help="seconds per model")
+    parser.add_argument('--mwp-limit', type=int, help="at most this many MWP configurations per model")
+    parser.add_argument('--xsd', default=XSD_FILE, help="schema the XML models are validated against")
+    parser.add_argument('--no-validate', action='store_true', help="skip schema validation")
+    args = parser.parse_args(argv)
+
+    paths = expand_paths(args.paths)
+    xsd_file = None if args.no_validate else args.xsd
+    started = time.perf_counter()
+    out = open(args.out, 'w', encoding='utf-8') if args.out else sys.stdout
+    try:
+        failures = run_batch(paths, out, args.workers, args.timeout, xsd_file, args.mwp_limit)
+    finally:
+        if args.out:
+            out.close()
+    print(f"{len(paths)} models analysed in {time.perf_counter() - started:.1f} s, {failures} failed",
+          file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Spans of the request (or job) being handled in this context, or None when not collecting
+_current_spans = contextvars.ContextVar('current_spans', default=None)
+
+
+class Span:
+    """
+    One timed stage: wall time and CPU time in seconds, and the net memory it
+    allocated in bytes (None unless tracemalloc is tracing).
+    """
+
+    __slots__ = ('name', 'wall', 'cpu', 'allocated')
+
+    def __init__(self, name, wall, cpu, allocated=None):
+        self.name = name
+        self.wall = wall
+        self.cpu = cpu
+        self.allocated = allocated
+
+    def to_tuple(self):
+        return (self.name, self.wall, self.cpu, self.allocated)
+
+
+class StageMetrics:
+    """
+    Process-wide aggregates of every span: a duration histogram plus CPU time and
+    allocated bytes per stage, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._stages = {}  # name -> [bucket counts, count, wall sum, cpu sum, allocated sum]
+        self._requests = {}  # (endpoint, status) -> [count, wall sum]
+        self._lock = threading.Lock()
+
+    def _after_fork(self):
+        # Another thread may have held the lock when this process was forked
+        self._lock = threading.Lock()
+
+    def observe(self, span):
+        with self._lock:
+            stage = self._stages.get(span.name)
+            if stage is None:
+                stage = self._stages[span.name] = [[0] * len(self.buckets), 0, 0.0, 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if span.wall <= bound:
+                    stage[0][i] += 1
+            stage[1] += 1
+            stage[2] += span.wall
+            stage[3] += span.cpu
+            stage[4] += span.allocated or 0
+
+    def observe_request(self, endpoint, status, wall):
+        with self._lock:
+            request = self._requests.setdefault((endpoint, status), [0, 0.0])
+            request[0] += 1
+            request[1] += wall
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP feature_model_stage_seconds Wall time of pipeline stages.",
+            "# TYPE feature_model_stage_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            requests = sorted(self._requests.items())
+        for name, (buckets, count, wall, _, _) in stages:
+            for bound, bucket in zip(self.buckets, buckets):
+                lines.append(f'feature_model_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {bucket}')
+            lines.append(f'feature_model_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'feature_model_stage_seconds_sum{{stage="{name}"}} {wall}')
+            lines.append(f'feature_model_stage_seconds_count{{stage="{name}"}} {count}')
+        lines += [
+            "# HELP feature_model_stage_cpu_seconds_total CPU time spent in pipeline stages.",
+            "# TYPE feature_model_stage_cpu_seconds_total counter",
+        ]
+        for name, (_, _, _, cpu, _) in stages:
+            lines.append(f'feature_model_stage_cpu_seconds_total{{stage="{name}"}} {cpu}')
+        lines += [
+            "# HELP feature_model_stage_allocated_bytes_total Net memory allocated by pipeline stages (with tracemalloc).",
+            "# TYPE feature_model_stage_allocated_bytes_total counter",
+        ]
+        for name, (_, _, _, _, allocated) in stages:
+            lines.append(f'feature_model_stage_allocated_bytes_total{{stage="{name}"}} {allocated}')
+        lines += [
+            "# HELP feature_model_requests_total Handled HTTP requests.",
+            "# TYPE feature_model_requests_total counter",
+        ]
+        for (endpoint, status), (count, _) in requests:
+            lines.append(f'feature_model_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+        lines += [
+            "# HELP feature_model_request_seconds_total Time spent handling HTTP requests.",
+            "# TYPE feature_model_request_seconds_total counter",
+        ]
+        for (endpoint, status), (_, wall) in requests:
+            lines.append(f'feature_model_request_seconds_total{{endpoint="{endpoint}",status="{status}"}} {wall}')
+        return "\n".join(lines) + "\n"
+
+
+# Aggregates of this process; spans recorded in job workers are merged in when their results arrive
+stage_metrics = StageMetrics()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=stage_metrics._after_fork)
+
+
+def start_collecting():
+    """
+    Start collecting the spans of the current request or job in a fresh list,
+    which is returned.
+    """
+    spans = []
+    _current_spans.set(spans)
+    return spans
+
+
+def stop_collecting():
+    _current_spans.set(None)
+
+
+def attach(spans):
+    """Add already aggregated spans (e.g. those of a finished job) to the current collection."""
+    current = _current_spans.get()
+    if current is not None:
+        current.extend(spans)
+
+
+def record(span):
+    """Add a finished span to the aggregates and the current collection."""
+    stage_metrics.observe(span)
+    attach([span])
+
+
+@contextmanager
+def span(name):
+    """Measure the enclosed block as the pipeline stage `name`."""
+    tracing = tracemalloc.is_tracing()
+    allocated = tracemalloc.get_traced_memory()[0] if tracing else None
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        cpu = time.thread_time() - cpu
+        wall = time.perf_counter() - wall
+        if tracing:
+            allocated = tracemalloc.get_traced_memory()[0] - allocated
+        record(Span(name, wall, cpu, allocated))
+
+
+def timed(name):
+    """
+    Decorator measuring every call of a function as the stage `name`. For
+    generator functions the span covers the whole iteration.
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator(*args, **kwargs):
+                with span(name):
+                    yield from func(*args, **kwargs)
+            return generator
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(spans):
+    """
+    Server-Timing header value for a list of spans; spans of the same stage are
+    summed, durations are in milliseconds.
+    """
+    totals = {}
+    for s in spans:
+        totals[s.name] = totals.get(s.name, 0.0) + s.wall
+    return ", ".join(f"{name.replace(' ', '_')};dur={wall * 1000:.2f}" for name, wall in totals.items())
@@ -0,0 +1,354 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from lxml import etree
+
+from logic.metrics import timed
+from logic.xmlvalidate import checkout_schema
+
+
+class Feature:
+    """
+    A single feature of the model.
+    `children` holds the names of the solitary (optional/mandatory) sub-features
+    and `group` the members of the feature's xor/or group, both as tuples.
+    `index` is the feature's position in document order.
+    """
+
+    __slots__ = ('name', 'mandatory', 'parent', 'children', 'group_type', 'group', 'index')
+
+    def __init__(self, name, mandatory=False, parent=None, index=0):
+        self.name = name
+        self.mandatory = mandatory
+        self.parent = parent
+        self.children = ()
+        self.group_type = None
+        self.group = ()
+        self.index = index
+
+    def copy(self):
+        feature = Feature(self.name, self.mandatory, self.parent, self.index)
+        feature.children = self.children
+        feature.group_type = self.group_type
+        feature.group = self.group
+        return feature
+
+    def __repr__(self):
+        return f"Feature({self.name!r})"
+
+
+class FeatureModel:
+    """
+    Parsed representation of a feature model XML file: the feature tree,
+    its groups and the cross-tree constraints. Every logic function works
+    on this instead of re-reading the XML file.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.features = {}  # name -> Feature, in document order
+        self.constraints = []  # [{'englishStatement': ..., 'booleanExpression': ...}]
+        self.source_size = 0  # size of the XML the model was built from, in bytes
+        self._digest = None  # memoized digest(); reset whenever the model changes
+
+    def __getitem__(self, name):
+        return self.features[name]
+
+    def __contains__(self, name):
+        return name in self.features
+
+    def __len__(self):
+        return len(self.features)
+
+    def feature_names(self):
+        return list(self.features)
+
+    def english_constraints(self):
+        return [c['englishStatement'] for c in self.constraints if c.get('englishStatement')]
+
+    def copy(self):
+        """
+        A copy that can be edited without touching this model. Features are shared
+        until an edit replaces them, so copying costs one dict and one list copy.
+        """
+        model = FeatureModel()
+        model.root = self.root
+        model.features = dict(self.features)
+        model.constraints = list(self.constraints)
+        model.source_size = self.source_size
+        return model
+
+    def _edit_feature(self, name):
+        # Features may be shared with other copies, so edits go to a private clone
+        if name not in self.features:
+            raise KeyError(f"Unknown feature: {name}")
+        feature = self.features[name] = self.features[name].copy()
+        self._digest = None
+        return feature
+
+    def add_constraint(self, english=None, expression=None):
+        """Append a cross-tree constraint and return its index."""
+        if not english and not expression:
+            raise ValueError("A constraint needs an englishStatement or a booleanExpression")
+        self.constraints.append({'englishStatement': english, 'booleanExpression': expression})
+        self._digest = None
+        return len(self.constraints) - 1
+
+    def remove_constraint(self, index):
+        """Remove and return the cross-tree constraint at `index`."""
+        if not 0 <= index < len(self.constraints):
+            raise IndexError(f"No constraint at index {index}")
+        self._digest = None
+        return self.constraints.pop(index)
+
+    def set_mandatory(self, name, mandatory):
+        """Make a solitary feature mandatory or optional."""
+        feature = self.features.get(name)
+        if feature is None:
+            raise KeyError(f"Unknown feature: {name}")
+        if feature.parent is None:
+            raise ValueError(f"{name} is the root feature")
+        if name in self.features[feature.parent].group:
+            raise ValueError(f"{name} is governed by the group of {feature.parent}")
+        self._edit_feature(name).mandatory = bool(mandatory)
+
+    def set_group_type(self, name, group_type):
+        """Turn the group owned by feature `name` into an xor or an or group."""
+        if group_type not in ('xor', 'or'):
+            raise ValueError(f"Unknown group type: {group_type}")
+        feature = self.features.get(name)
+        if feature is None:
+            raise KeyError(f"Unknown feature: {name}")
+        if not feature.group:
+            raise ValueError(f"{name} has no group")
+        self._edit_feature(name).group_type = group_type
+
+    def digest(self):
+        """
+        SHA-256 of the model's structure and constraints. Models that mean the
+        same thing hash the same, whatever their XML formatting.
+        """
+        if self._digest is not None:
+            return self._digest
+        canonical = [
+            self.root,
+            [[f.name, f.parent, f.mandatory, f.group_type, f.children, f.group] for f in self.features.values()],
+            [[c.get('englishStatement'), c.get('booleanExpression')] for c in self.constraints],
+        ]
+        self._digest = hashlib.sha256(json.dumps(canonical).encode('utf-8')).hexdigest()
+        return self._digest
+
+
+def build_model(root):
+    """
+    Build a FeatureModel from the root <featureModel> element of an already parsed document.
+    """
+    model = FeatureModel()
+
+    root_feature = root.find("feature")
+    # Depth-first walk with an explicit stack so deep models don't hit the recursion limit
+    stack = [(root_feature, None, False)] if root_feature is not None else []
+    while stack:
+        element, parent, in_group = stack.pop()
+        name = element.attrib.get("name")
+        if name in model.features:
+            raise ValueError(f"Duplicate feature name: {name}")
+        # Group members are governed by the group, never by the mandatory flag
+        mandatory = not in_group and element.attrib.get("mandatory", "false") == "true"
+
+        feature = Feature(name, mandatory, parent, len(model.features))
+        model.features[name] = feature
+        if parent is None:
+            model.root = name
+
+        children = element.findall("feature")
+        feature.children = tuple(child.attrib.get("name") for child in children)
+        members = []
+        group = element.find("group")
+        if group is not None:
+            feature.group_type = group.attrib.get("type")
+            members = group.findall("feature")
+            feature.group = tuple(child.attrib.get("name") for child in members)
+
+        # Pushed in reverse so they are visited in document order
+        for child in reversed(members):
+            stack.append((child, name, True))
+        for child in reversed(children):
+            stack.append((child, name, False))
+
+    constraints = root.find("constraints")
+    if constraints is not None:
+        for constraint in constraints.findall("constraint"):
+            model.constraints.append({
+                "englishStatement": constraint.findtext("englishStatement"),
+                "booleanExpression": constraint.findtext("booleanExpression"),
+            })
+    return model
+
+
+def _release(element):
+    # Drop a finished element and its already processed siblings from the partial tree
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def stream_model(source, schema=None):
+    """
+    Build a FeatureModel in a single iterparse pass over `source` (a path or a
+    binary file object), validating against `schema` during the same pass.
+    Elements are released as soon as they have been read, so besides the
+    FeatureModel itself only the current root-to-leaf path of the document is
+    held in memory. Raises etree.XMLSyntaxError when the document is malformed
+    or fails validation. Uploads are untrusted: the DTD is not loaded and entities
+    are not expanded, so entity bombs are rejected instead of being expanded
+    under the validator.
+    """
+    model = FeatureModel()
+    path = []  # open elements: [Feature, children, members] for <feature>, None for <group>
+    skipped = 0  # depth inside ignored top-level features
+    constraint = None
+
+    context = etree.iterparse(source, events=("start", "end"), schema=schema, remove_comments=True,
+                              remove_pis=True, resolve_entities=False, load_dtd=False)
+    for event, element in context:
+        tag = element.tag
+        if event == "start":
+            if skipped:
+                if tag == "feature":
+                    skipped += 1
+            elif tag == "feature":
+                if not path and model.root is not None:
+                    skipped = 1  # like the tree parsers, only the first root feature counts
+                    continue
+                name = element.attrib.get("name")
+                if name in model.features:
+                    raise ValueError(f"Duplicate feature name: {name}")
+                in_group = bool(path) and path[-1] is None
+                owner = path[-2] if in_group else (path[-1] if path else None)
+                # Group members are governed by the group, never by the mandatory flag
+                mandatory = not in_group and element.attrib.get("mandatory", "false") == "true"
+                feature = Feature(name, mandatory, owner[0].name if owner else None, len(model.features))
+                model.features[name] = feature
+                if owner is None:
+                    model.root = name
+                elif in_group:
+                    owner[2].append(name)
+                else:
+                    owner[1].append(name)
+                path.append([feature, [], []])
+            elif tag == "group" and path:
+                path[-1][0].group_type = element.attrib.get("type")
+                path.append(None)
+            elif tag == "constraint":
+                constraint = {"englishStatement": None, "booleanExpression": None}
+            continue
+
+        if skipped:
+            if tag == "feature":
+                skipped -= 1
+                if not skipped:
+                    _release(element)
+            continue
+        if tag == "feature":
+            # Store the finished child lists as tuples, which are smaller than lists
+            feature, children, members = path.pop()
+            feature.children = tuple(children)
+            feature.group = tuple(members)
+            _release(element)
+        elif tag == "group":
+            path.pop()
+            _release(element)
+        elif tag in ("englishStatement", "booleanExpression") and constraint is not None:
+            constraint[tag] = element.text
+        elif tag == "constraint":
+            model.constraints.append(constraint)
+            constraint = None
+            _release(element)
+    return model
+
+
+@timed('load_model')
+def load_model(source, xsd_file=None):
+    """
+    Parse (and optionally validate) an XML feature model into a FeatureModel in one
+    streaming pass; see stream_model. `source` is a path or a binary file object.
+    """
+    if xsd_file:
+        # A schema of its own, so other uploads are validated at the same time
+        with checkout_schema(xsd_file) as schema:
+            model = stream_model(source, schema)
+    else:
+        model = stream_model(source)
+    if isinstance(source, (str, os.PathLike)):
+        model.source_size = os.path.getsize(source)
+    elif hasattr(source, 'tell'):
+        model.source_size = source.tell()  # the parser has read the stream to its end
+    return model
+
+
+def as_model(source):
+    """
+    Accept either a FeatureModel or an XML source (path or binary file object).
+    """
+    if isinstance(source, FeatureModel):
+        return source
+    return load_model(source)
+
+
+class ModelCache:
+    """
+    Bounded LRU cache of parsed models keyed by upload (fileId or content digest).
+    Entries are weighted by the size of their source XML and the least
+    recently used ones are evicted once max_bytes is exceeded. On a miss
+    the model is re-parsed from the upload on disk, if a path is given.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, file_id, model):
+        size = max(model.source_size, 1)
+        with self._lock:
+            old = self._entries.pop(file_id, None)
+            if old is not None:
+                self._size -= max(old.source_size, 1)
+            self._entries[file_id] = model
+            self._size += size
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= max(evicted.source_size, 1)
+
+    def get(self, file_id, file_path=None, xsd_file=None):
+        with self._lock:
+            model = self._entries.get(file_id)
+            if model is not None:
+                self._entries.move_to_end(file_id)
+                return model
+        if file_path is None or not os.path.exists(file_path):
+            return None
+        # Disk fallback: rebuild from the stored upload
+        model = load_model(file_path, xsd_file)
+        self.put(file_id, model)
+        return model
+
+    def discard(self, file_id):
+        with self._lock:
+            model = self._entries.pop(file_id, None)
+            if model is not None:
+                self._size -= max(model.source_size, 1)
+
+    def __contains__(self, file_id):
+        return file_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,327 +1,194 @@
-import xml.etree.ElementTree as ET
-import xml.etree.ElementTree as ET
 import re
+import weakref
+from functools import lru_cache
 
-def convert_english_to_propositional(english, feature_mapping):
-    """
-    Convert an English constraint into a propositional logic formula using the feature mapping.
-    """
-    english = english.strip().lower()
-
-    # Replace feature names in the English statement with their corresponding variable names
-    for english_feature, variable_name in feature_mapping.items():
-        # Replace only whole words (case insensitive) to avoid partial replacements
-        english = re.sub(rf'\b{re.escape(english_feature)}\b', variable_name.lower(), english)
-
-    # Match patterns like "The Location feature is required to filter the catalog by location."
-    match = re.match(r"the\s([a-zA-Z\s]+)\sfeature\sis\srequired\s(?:to|for)\sfilter\s([a-zAZ\s]+)", english)
-    if match:
-        dependent_feature = match.group(1).strip().replace(" ", "")  # Dependent feature (on the left)
-        required_feature = match.group(2).strip().replace(" ", "")  # Required feature (on the right)
-        
-        # Return the implication: required_feature → dependent_feature
-        return f"{required_feature} → {dependent_feature}"
-
-    # Match patterns like "Feature A depends on Feature B"
-    match = re.match(r"([a-zA-Z\s]+) depends on ([a-zAZ\s]+)", english)
-    if match:
-        feature_a = match.group(1).strip().replace(" ", "")
-        feature_b = match.group(2).strip().replace(" ", "")
-        # Return the implication as a propositional logic formula
-        return f"{feature_b} → {feature_a}"
-
-    # Match patterns like "Feature A cannot be used without Feature B"
-    match = re.match(r"([a-zA-Z\s]+) cannot be used without ([a-zAZ\s]+)", english)
-    if match:
-        feature_a = match.group(1).strip().replace(" ", "")
-        feature_b = match.group(2).strip().replace(" ", "")
-        # Return the implication as a propositional logic formula
-        return f"{feature_b} → {feature_a}"
-
-    # Handle generic "must be selected before" case
-    match = re.match(r"([a-zA-Z\s]+) must be selected before ([a-zAZ\s]+)", english)
-    if match:
-        feature_a = match.group(1).strip().replace(" ", "")
-        feature_b = match.group(2).strip().replace(" ", "")
-        # Return the implication as a propositional logic formula
-        return f"{feature_a} → {feature_b}"
-
-    # If no match found, return None to indicate unsupported format
-    return None
-
-
-def parse_feature_model(file_path):
-    """
-    Parse the XML feature model and generate propositional logic formulas.
-    """
-    tree = ET.parse(file_path)
-    root = tree.getroot()
+from logic.model import as_model
 
-    formulas = []
-    feature_mapping = {}
 
-    def parse_feature(feature, parent=None):
-        name = feature.attrib.get("name")
-        mandatory = feature.attrib.get("mandatory", "false") == "true"
+def _words(text):
+    return text.strip().replace(" ", "")
 
-        # Add to feature mapping: English name -> Variable name
-        variable_name = name.replace(" ", "")  # Variable name is the feature name without spaces
-        feature_mapping[name.lower()] = variable_name.lower()  # Map English name to variable name
 
-        # Generate logic for mandatory features
-        if parent and mandatory:
-            formulas.append(f"{parent} → {variable_name}")
+class ConstraintTranslator:
+    """
+    Translates English constraints into propositional logic for one feature mapping.
+    Feature names are replaced in a single pass with one alternation regex built once
+    (longest names first), the phrasings are precompiled, and results are memoized
+    per statement. New phrasings are added with ConstraintTranslator.register.
+    """
 
-        # Add child-to-parent relationship
-        if parent:
-            formulas.append(f"{variable_name} → {parent}")
+    # (compiled pattern, builder taking the match and returning a formula), tried in order
+    patterns = []
 
-        # Parse child features
-        for child in feature.findall("feature"):
-            parse_feature(child, name)
+    def __init__(self, feature_mapping):
+        self.feature_mapping = {name: variable.lower() for name, variable in feature_mapping.items()}
+        names = sorted(self.feature_mapping, key=len, reverse=True)
+        # Replace only whole words to avoid partial replacements
+        self._names = re.compile(r"\b(?:" + "|".join(map(re.escape, names)) + r")\b") if names else None
+        self._memo = {}
 
-        # Parse groups
-        group = feature.find("group")
-        if group is not None:
-            group_type = group.attrib.get("type")
-            child_names = [child.attrib.get("name") for child in group.findall("feature")]
+    @classmethod
+    def register(cls, pattern, builder):
+        """Add a phrasing: a regex (matched at the start of the statement) and a formula builder."""
+        cls.patterns.append((re.compile(pattern), builder))
 
-            if group_type == "xor":
-                # XOR: Exactly one child can be selected
-                xor_logic = " ∨ ".join(child_names)
-                pairwise_exclusions = " ∧ ".join(
-                    [f"~({a} ∧ {b})" for i, a in enumerate(child_names) for b in child_names[i + 1:]]
-                )
-                formulas.append(f"{name} → ({xor_logic})")
-                formulas.append(f"{name} → ({pairwise_exclusions})")
+    def substitute(self, english):
+        """Replace the feature names in a lower-cased statement with their variable names."""
+        if self._names is None:
+            return english
+        return self._names.sub(lambda match: self.feature_mapping[match.group(0)], english)
 
-                # Add child-to-parent relationships for XOR
-                for child in child_names:
-                    formulas.append(f"{child} → {name}")
-            elif group_type == "or":
-                # OR: At least one child must be selected
-                or_logic = " ∨ ".join(child_names)
-                formulas.append(f"{name} → ({or_logic})")
+    def translate(self, english):
+        """
+        Return the formula for an English statement, or None if no phrasing matches.
+        """
+        try:
+            return self._memo[english]
+        except KeyError:
+            pass
+        text = self.substitute(english.strip().lower())
+        formula = None
+        for pattern, builder in self.patterns:
+            match = pattern.match(text)
+            if match:
+                formula = builder(match)
+                break
+        self._memo[english] = formula
+        return formula
+
+
+# Patterns like "The Location feature is required to filter the catalog by location."
+# Return the implication: required_feature → dependent_feature
+ConstraintTranslator.register(
+    r"the\s([a-z\s]+)\sfeature\sis\srequired\s(?:to|for)\sfilter\s([a-z\s]+)",
+    lambda m: f"{_words(m.group(2))} → {_words(m.group(1))}",
+)
+# Patterns like "Feature A depends on Feature B"
+ConstraintTranslator.register(
+    r"([a-z\s]+) depends on ([a-z\s]+)",
+    lambda m: f"{_words(m.group(2))} → {_words(m.group(1))}",
+)
+# Patterns like "Feature A cannot be used without Feature B"
+ConstraintTranslator.register(
+    r"([a-z\s]+) cannot be used without ([a-z\s]+)",
+    lambda m: f"{_words(m.group(2))} → {_words(m.group(1))}",
+)
+# Generic "must be selected before" case
+ConstraintTranslator.register(
+    r"([a-z\s]+) must be selected before ([a-z\s]+)",
+    lambda m: f"{_words(m.group(1))} → {_words(m.group(2))}",
+)
+
+
+@lru_cache(maxsize=32)
+def _translator_for_mapping(mapping_items):
+    return ConstraintTranslator(dict(mapping_items))
+
+
+# One translator per parsed model, dropped together with the model
+_model_translators = weakref.WeakKeyDictionary()
+
+
+def constraint_translator(model):
+    """
+    Return the (memoizing) ConstraintTranslator of a parsed feature model.
+    """
+    translator = _model_translators.get(model)
+    if translator is None:
+        feature_mapping = {name.lower(): name.replace(" ", "").lower() for name in model.features}
+        translator = ConstraintTranslator(feature_mapping)
+        _model_translators[model] = translator
+    return translator
 
-                # Add child-to-parent relationships for OR
-                for child in child_names:
-                    formulas.append(f"{child} → {name}")
 
-    # Start parsing from the root
-    root_feature = root.find("feature")
-    if root_feature is not None:
-        root_name = root_feature.attrib.get("name")
-        formulas.append(f"{root_name} = True")  # Root feature is always true
-        parse_feature(root_feature)
+def convert_english_to_propositional(english, feature_mapping):
+    """
+    Convert an English constraint into a propositional logic formula using the feature mapping.
+    Returns None if the statement's phrasing is not supported.
+    """
+    return _translator_for_mapping(tuple(feature_mapping.items())).translate(english)
 
-    return formulas
 
+def parse_feature_model(source, constraints=()):
+    """
+    Generate propositional logic formulas for a parsed feature model (or an XML file path).
+    The formulas are rendered from the model's compiled CNF.
+    """
+    from logic.translate import compile_cnf
 
+    return compile_cnf(source, constraints).formulas()
 
-import itertools
 
-def parse_feature_model1(file_path):
+def parse_feature_model1(source):
     """
-    Parse the XML feature model and extract features, groups, and their relationships.
+    Extract features, groups, and their relationships from a parsed feature model (or an XML file path).
     """
-    tree = ET.parse(file_path)
-    root = tree.getroot()
+    model = as_model(source)
 
     features = {}
-    # Start parsing the root feature
-    def parse_feature(feature, parent=None):
-        name = feature.attrib.get("name")
-        mandatory = feature.attrib.get("mandatory", "false") == "true"
-
-        # Initialize feature in the dictionary if not already present
-        if name not in features:
-            features[name] = {'mandatory': mandatory, 'parents': [], 'children': [], 'group': None}
-
-        # Add the current feature as a child to its parent
-        if parent:
-            features[parent]['children'].append(name)
-            features[name]['parents'].append(parent)
-
-        # Parse child features
-        for child in feature.findall("feature"):
-            parse_feature(child, name)
-
-        # Parse groups (xor, or)
-        group = feature.find("group")
-        if group is not None:
-            group_type = group.attrib.get("type")
-            features[name]['group'] = group_type
-
-            child_names = [child.attrib.get("name") for child in group.findall("feature")]
-            for child_name in child_names:
-                # Add group relationships (parent-child)
-                if child_name not in features:
-                    features[child_name] = {'mandatory': False, 'parents': [], 'children': [], 'group': None}
-                features[name]['children'].append(child_name)
-                features[child_name]['parents'].append(name)
-
-    # Parse root feature
-    root_feature = root.find("feature")
-    if root_feature is not None:
-        parse_feature(root_feature)
+    for name, feature in model.features.items():
+        features[name] = {
+            'mandatory': feature.mandatory,
+            'parents': [feature.parent] if feature.parent else [],
+            'children': list(feature.children + feature.group),
+            'group': feature.group_type,
+        }
 
     return features
 
-import itertools
-
-def find_minimum_working_product(features):
+def find_minimum_working_product(source, constraints=(), limit=None, offset=0):
     """
-    Find the Minimum Working Product (MWP) from the parsed features, creating sets for xor configurations.
+    Find the Minimum Working Products (MWP) of a parsed feature model (or an XML file path,
+    or its compiled CNF).
+    Products respect the group semantics and the cross-tree constraints; `constraints`
+    adds formulas such as "Location -> ByLocation" on top of the model's own.
+    Use limit/offset to page through large result sets.
     """
-    mwp_set = set()
-    mandatory_features = [feature for feature, details in features.items() if details['mandatory']]
-
-    # Add root node (it will always be in the MWP)
-    root_node = next((feature for feature, details in features.items() if details['parents'] == []), None)
-    if root_node:
-        mwp_set.add(root_node)
-
-    # Add all mandatory features to the MWP
-    for feature in mandatory_features:
-        mwp_set.add(feature)
-
-    xor_sets = []
-    or_sets = []
-
-    # Iterate through the features
-    for feature in mandatory_features:
-        group_type = features[feature].get('group')
-
-        if group_type == 'xor':
-            # If feature is in an xor group, we need to ensure exactly one is selected from its group
-            group_features = features[feature]['children']
-            xor_combinations = []
-
-            # Generate all possible combinations of features where exactly one is selected
-            for combination in itertools.combinations(group_features, 1):
-                xor_combinations.append(set(combination))
-            
-            xor_sets.append(xor_combinations)
-
-        elif group_type == 'or':
-            # For 'or' group, at least one feature must be included, but only one feature is allowed in the MWP
-            group_features = features[feature]['children']
-            # Select only one feature from the OR group for MWP
-            or_sets.append([set([feature]) for feature in group_features])
-
-    # Now, we need to combine the mandatory features with xor and or sets
-    all_configurations = []
-    # Start by adding the mandatory features to each possible combination of xor and or configurations
-    for xor_combination in itertools.product(*xor_sets):
-        for or_combination in itertools.product(*or_sets):
-            mwp_configuration = set(mwp_set)  # Start with mandatory features
-
-            # Add xor group configuration
-            for combination in xor_combination:
-                mwp_configuration.update(combination)
-
-            # Add or group configuration, ensuring that only one child is added for 'or'
-            for combination in or_combination:
-                mwp_configuration.update(combination)
-
-            # Convert the set to a sorted list for a more readable output
-            all_configurations.append(sorted(mwp_configuration))
-
-    return all_configurations
+    from logic.calculate import iter_minimum_working_products
 
-# feature_model_parser.py
+    return list(iter_minimum_working_products(source, constraints, limit=limit, offset=offset))
 
-import xml.etree.ElementTree as ET
+# feature_model_parser.py
 
-def parse_feature_model2(file_path):
+def parse_feature_model2(source):
     """
-    Parse the XML feature model and extract features, groups, and their relationships.
+    Extract features, groups, and their relationships from a parsed feature model (or an XML file path).
     Features are parsed with additional logic for mandatory/optional constraints, parent-child relationships, 
     group types (XOR/OR), and dynamic constraint validation.
     """
-    tree = ET.parse(file_path)
-    root = tree.getroot()
+    model = as_model(source)
 
     features = {}
+    for name, feature in model.features.items():
+        features[name] = {
+            'mandatory': feature.mandatory,
+            'parents': [feature.parent] if feature.parent else [],
+            'children': list(feature.children + feature.group),
+            'group': list(feature.group) or None,
+            'group_type': feature.group_type,
+            'is_selected': False  # Tracks whether the feature is selected
+        }
+
+    from logic.propagate import SelectionPropagator
+
+    propagator = SelectionPropagator(model)
+    # The root and the features it forces are selected from the start
+    for name in propagator.state()['forced']:
+        features[name]['is_selected'] = True
 
-    def parse_feature(feature, parent=None):
-        """
-        Recursively parse each feature in the feature model XML.
-        This function supports:
-        - Parsing mandatory/optional features
-        - Parent-child relationships
-        - Group types (XOR/OR) with proper constraints
-        """
-        name = feature.attrib.get("name")
-        mandatory = feature.attrib.get("mandatory", "false") == "true"
-
-        # Initialize the feature in the dictionary if it hasn't been initialized
-        if name not in features:
-            features[name] = {
-                'mandatory': mandatory,
-                'parents': [],
-                'children': [],
-                'group': None,
-                'group_type': None,
-                'is_selected': False  # Tracks whether the feature is selected
-            }
-
-        # If the feature has a parent, add the parent-child relationship
-        if parent:
-            features[parent]['children'].append(name)
-            features[name]['parents'].append(parent)
-
-        # Parse child features
-        for child in feature.findall("feature"):
-            parse_feature(child, name)
-
-        # Parse groups (XOR/OR)
-        group = feature.find("group")
-        if group is not None:
-            group_type = group.attrib.get("type")  # 'xor' or 'or'
-            features[name]['group'] = group
-            features[name]['group_type'] = group_type
-
-            child_names = [child.attrib.get("name") for child in group.findall("feature")]
-            for child_name in child_names:
-                # Add group relationships (parent-child)
-                if child_name not in features:
-                    features[child_name] = {'mandatory': False, 'parents': [], 'children': [], 'group': None, 'group_type': None, 'is_selected': False}
-                features[name]['children'].append(child_name)
-                features[child_name]['parents'].append(name)
-
-    # Start parsing the root feature
-    root_feature = root.find("feature")
-    if root_feature is not None:
-        parse_feature(root_feature)
-
-    # Helper function to validate feature selection based on constraints
     def validate_feature_selection(feature_name, is_selected):
         """
-        Validates the feature selection based on mandatory/optional constraints.
-        If a mandatory feature is deselected, all dependent features must also be deselected.
-        If a feature in an XOR group is selected, other features in the group must be deselected.
+        Select or deselect a feature and propagate the consequences through the
+        model's rules and cross-tree constraints (see SelectionPropagator).
+        `is_selected` is updated for every feature that changed; the report of
+        forced, excluded and released features is returned.
         """
-        feature = features[feature_name]
-        feature['is_selected'] = is_selected
-
-        # Handle mandatory constraint - if deselected, deselect dependent features
-        if feature['mandatory'] and not is_selected:
-            for child in feature['children']:
-                validate_feature_selection(child, False)
-            for parent in feature['parents']:
-                validate_feature_selection(parent, False)
-
-        # Handle XOR group constraint - if selected, deselect other features in the same group
-        if feature['group_type'] == 'xor' and is_selected:
-            for sibling in feature['children']:
-                if sibling != feature_name:  # Don't deselect the selected feature
-                    validate_feature_selection(sibling, False)
-
-        # Handle OR group constraint - no deselection logic required for OR
-        if feature['group_type'] == 'or' and is_selected:
-            for sibling in feature['children']:
-                validate_feature_selection(sibling, True)
+        report = propagator.decide(feature_name, is_selected)
+        for name in report['forced']:
+            features[name]['is_selected'] = True
+        for name in report['excluded'] + report['released']:
+            features[name]['is_selected'] = False
+        return report
 
     # Function to visualize the feature model (convert to a suitable structure for rendering)
     def visualize_feature_model(features):
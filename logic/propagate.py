@@ -0,0 +1,238 @@
+import threading
+
+from logic.metrics import timed
+from logic.translate import compile_cnf
+
+
+class SelectionPropagator:
+    """
+    Unit propagation over a model's compiled CNF for interactive configurators.
+
+    Every clause watches two of its literals and is only looked at when one of
+    them becomes false, so a decision costs time in proportion to what it
+    affects rather than to the model's size. Assignments are kept on a trail:
+    undoing a decision pops the trail back to where the decision started.
+    Propagation finds what follows clause by clause; features that are implied
+    only by reasoning over several clauses at once are left open (see
+    SolverSession.implied for the complete answer). Hold `lock` while using
+    a propagator that other threads share.
+    """
+
+    def __init__(self, source, constraints=()):
+        self.compiled = compile_cnf(source, constraints)
+        nv = self.compiled.nv
+        self._values = [0] * (nv + 1)  # variable -> 1 true, -1 false, 0 open
+        self._watches = [[] for _ in range(2 * nv + 2)]  # literal slot -> clauses watching it
+        self._clauses = []
+        self._trail = []  # assigned literals, in order
+        self._head = 0  # trail position up to which propagation has run
+        self._decisions = []  # (literal, trail length before it)
+        self.consistent = True  # False when the model itself has no valid product
+        self.lock = threading.Lock()
+
+        units = []
+        for clause in self.compiled.clauses:
+            clause = list(dict.fromkeys(clause))
+            if any(-lit in clause for lit in clause):
+                continue  # tautologies, such as the clauses of retired rules
+            if len(clause) == 1:
+                units.append(clause[0])
+                continue
+            index = len(self._clauses)
+            self._clauses.append(clause)
+            self._watches[self._slot(-clause[0])].append(index)
+            self._watches[self._slot(-clause[1])].append(index)
+        for lit in units:
+            if not self._enqueue(lit):
+                self.consistent = False
+        if not self.consistent or self._propagate() is not None:
+            self.consistent = False
+
+    @staticmethod
+    def _slot(lit):
+        # Watch lists are indexed by the literal whose assignment wakes the clause up
+        return 2 * lit if lit > 0 else -2 * lit + 1
+
+    def _value(self, lit):
+        value = self._values[abs(lit)]
+        return value if lit > 0 else -value
+
+    def _enqueue(self, lit):
+        value = self._value(lit)
+        if value:
+            return value > 0
+        self._values[abs(lit)] = 1 if lit > 0 else -1
+        self._trail.append(lit)
+        return True
+
+    def _propagate(self):
+        """Propagate the pending trail; returns a falsified clause, or None."""
+        values, trail, clauses, watches = self._values, self._trail, self._clauses, self._watches
+        while self._head < len(trail):
+            lit = trail[self._head]
+            self._head += 1
+            false_lit = -lit
+            watching = watches[self._slot(lit)]
+            i = 0
+            while i < len(watching):
+                clause = clauses[watching[i]]
+                if clause[0] == false_lit:
+                    clause[0], clause[1] = clause[1], false_lit
+                other = clause[0]
+                other_value = values[abs(other)] if other > 0 else -values[abs(other)]
+                if other_value > 0:
+                    i += 1
+                    continue
+                # Look for another literal that is not false to watch instead
+                for k in range(2, len(clause)):
+                    candidate = clause[k]
+                    value = values[abs(candidate)] if candidate > 0 else -values[abs(candidate)]
+                    if value >= 0:
+                        clause[1], clause[k] = candidate, false_lit
+                        watches[self._slot(-candidate)].append(watching[i])
+                        watching[i] = watching[-1]
+                        watching.pop()
+                        break
+                else:
+                    if other_value < 0:
+                        self._head = len(trail)
+                        return clause
+                    self._enqueue(other)
+                    i += 1
+        return None
+
+    def _backtrack(self, length):
+        values, trail = self._values, self._trail
+        while len(trail) > length:
+            values[abs(trail.pop())] = 0
+        self._head = min(self._head, length)
+
+    def _literal(self, name, selected):
+        feature_id = self.compiled.feature_ids.get(name)
+        if feature_id is None:
+            raise KeyError(f"Unknown feature: {name}")
+        return feature_id if selected else -feature_id
+
+    def _changes(self, before, after):
+        # Report the feature assignments that differ between two trail segments
+        names = self.compiled.names
+        before, after = set(before), set(after)
+        return {
+            'forced': sorted(names[lit] for lit in after - before if lit > 0 and lit in names),
+            'excluded': sorted(names[-lit] for lit in after - before if lit < 0 and -lit in names),
+            'released': sorted(names[abs(lit)] for lit in before - after
+                               if abs(lit) in names and self._values[abs(lit)] == 0),
+        }
+
+    def _assume(self, lit):
+        # Push a decision and propagate it; on a conflict nothing is kept
+        start = len(self._trail)
+        if self._enqueue(lit):
+            conflict = self._propagate()
+            if conflict is None:
+                self._decisions.append((lit, start))
+                return None
+        else:
+            conflict = [lit]
+        self._backtrack(start)
+        return conflict
+
+    @timed('propagate')
+    def decide(self, name, selected):
+        """
+        Select (or deselect) a feature, replacing any earlier decision about it.
+        Returns {'valid', 'forced', 'excluded', 'released'}: whether the decision
+        fits the earlier ones, and the features that became true, false or open.
+        A decision that conflicts is not applied; 'conflict' then names the
+        features of the clause it violates.
+        """
+        lit = self._literal(name, selected)
+        if not self.consistent:
+            return {'valid': False, 'conflict': [], 'forced': [], 'excluded': [], 'released': []}
+        position = self._position(abs(lit))
+        start = self._decisions[position][1] if position is not None else len(self._trail)
+        before = self._trail[start:]
+        if position is not None:
+            previous = self._decisions[position][0]
+            self._retract(position)
+        conflict = self._assume(lit)
+        if conflict is not None:
+            if position is not None:
+                self._assume(previous)  # held before, so it still holds
+            names = self.compiled.names
+            return {'valid': False, 'conflict': sorted(names[abs(l)] for l in conflict if abs(l) in names),
+                    'forced': [], 'excluded': [], 'released': []}
+        return dict(self._changes(before, self._trail[start:]), valid=True)
+
+    def retract(self, name):
+        """Withdraw the decision about a feature; returns the changes like decide()."""
+        position = self._position(self._literal(name, True))
+        if position is None:
+            return {'valid': self.consistent, 'forced': [], 'excluded': [], 'released': []}
+        start = self._decisions[position][1]
+        before = self._trail[start:]
+        self._retract(position)
+        return dict(self._changes(before, self._trail[start:]), valid=True)
+
+    def undo(self):
+        """Withdraw the latest decision; returns the changes like decide(), or None if there was none."""
+        if not self._decisions:
+            return None
+        lit, start = self._decisions[-1]
+        before = self._trail[start:]
+        self._retract(len(self._decisions) - 1)
+        return dict(self._changes(before, self._trail[start:]), valid=True)
+
+    def decide_all(self, decisions):
+        """
+        Make `decisions`, an ordered list of (feature, selected), the current ones.
+        The leading decisions already in place are kept and only the rest is
+        undone and replayed, so a client sending its whole selection on every
+        click pays for the click alone. Returns state() plus 'refused': the
+        features whose decision conflicted with the ones before it.
+        """
+        literals = [self._literal(name, selected) for name, selected in decisions]
+        keep = 0
+        while keep < min(len(literals), len(self._decisions)) and self._decisions[keep][0] == literals[keep]:
+            keep += 1
+        if keep < len(self._decisions):
+            self._backtrack(self._decisions[keep][1])
+            del self._decisions[keep:]
+        refused = []
+        for name, selected in decisions[keep:]:
+            if not self.decide(name, selected)['valid']:
+                refused.append(name)
+        return dict(self.state(), refused=refused)
+
+    def _position(self, var):
+        for position, (lit, _) in enumerate(self._decisions):
+            if abs(lit) == var:
+                return position
+        return None
+
+    def _retract(self, position):
+        # Undo back to the decision and replay the later ones; with fewer
+        # decisions these propagate to a subset of before, so they can't conflict
+        later = [lit for lit, _ in self._decisions[position + 1:]]
+        self._backtrack(self._decisions[position][1])
+        del self._decisions[position:]
+        for lit in later:
+            self._assume(lit)
+
+    def value(self, name):
+        """True or False if the feature is decided or forced, None while it is open."""
+        value = self._values[self._literal(name, True)]
+        return None if value == 0 else value > 0
+
+    def state(self):
+        """The current selection: decided features, and those forced on or ruled out."""
+        names = self.compiled.names
+        decided = {abs(lit) for lit, _ in self._decisions}
+        return {
+            'valid': self.consistent,
+            'selected': [names[lit] for lit, _ in self._decisions if lit > 0],
+            'deselected': [names[-lit] for lit, _ in self._decisions if lit < 0],
+            'forced': sorted(names[lit] for lit in self._trail if lit > 0 and lit in names and lit not in decided),
+            'excluded': sorted(names[-lit] for lit in self._trail
+                               if lit < 0 and -lit in names and -lit not in decided),
+        }
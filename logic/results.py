@@ -0,0 +1,165 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def result_key(kind, digest, *params):
+    """
+    Cache key for a result of `kind` computed from the model with `digest`;
+    `params` are whatever else the result depends on (JSON-serialisable).
+    """
+    return f"{kind}:{digest}:{json.dumps(params, sort_keys=True)}"
+
+
+class SQLiteTier:
+    """
+    On-disk result tier in a SQLite file, shared by every process that opens it.
+    Values are pickled; entries older than `ttl` seconds are dropped and the
+    least recently used ones go once there are more than `max_entries`.
+    Connections are per process, so a tier created before a fork keeps working
+    in the children.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        with self._lock, self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    def _connection(self):
+        # A connection inherited through fork must not be used by the child
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._connection() as conn:
+            row = conn.execute(
+                "SELECT value, created FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, blob, now, now),
+            )
+            conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results"
+                " ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+class ResultCache:
+    """
+    Content-addressed cache of computed results (formulas, MWP lists, analyses,
+    compiled CNF). A bounded in-memory LRU tier with a TTL sits in front of an
+    optional on-disk tier (e.g. SQLiteTier); memory misses that hit the disk
+    tier are promoted. Hit and miss counts are kept per tier.
+    """
+
+    def __init__(self, max_entries=512, ttl=3600, disk=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, stored at)
+        self._lock = threading.Lock()
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _put_memory(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        value = self._get_memory(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self._put_memory(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value, persist=True):
+        """
+        Store a result. With persist=False it stays in memory only, for values
+        that are cheap to recompute or expensive to serialise.
+        """
+        self._put_memory(key, value)
+        if persist and self.disk is not None:
+            self.disk.put(key, value)
+
+    def get_or_compute(self, key, compute, persist=True):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value, persist)
+        return value
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            'memoryEntries': len(self._entries),
+            'diskEntries': len(self.disk) if self.disk is not None else None,
+            'memoryHits': self.memory_hits,
+            'diskHits': self.disk_hits,
+            'misses': self.misses,
+            'hitRate': hits / lookups if lookups else 0.0,
+        }
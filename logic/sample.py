@@ -0,0 +1,244 @@
+import itertools
+import multiprocessing
+import random
+
+from pysat.solvers import Solver
+
+from logic.analysis import ModelCounter, subtree_counts
+from logic.metrics import timed
+from logic.model import as_model
+from logic.session import SolverSession
+from logic.translate import compile_cnf
+
+# Random samples are drawn in chunks with seeds derived from (seed, chunk), so the
+# result depends on the seed only and not on how many workers drew the chunks
+CHUNK_SIZE = 16
+
+# Tree samples rejected by the cross-tree constraints in a row before sampling
+# switches to conditioned model counts
+MAX_REJECTIONS = 1000
+
+
+def _configuration(model, compiled):
+    # Names of the selected features in a solver model, in feature order
+    positive = {lit for lit in model if lit > 0}
+    return [compiled.names[v] for v in compiled.feature_vars() if v in positive]
+
+
+class _TreeSampler:
+    """
+    Uniform sampling by knowledge compilation. The feature tree is a compiled
+    form of its own configurations: the number of configurations below every
+    feature is known, so a configuration of the tree is drawn top-down with each
+    choice weighted by those counts, which makes all of them equally likely.
+    Draws that break a cross-tree constraint are rejected, which keeps the
+    valid configurations equally likely. When constraints reject too much,
+    the remaining features are drawn from exact counts of the conditioned CNF.
+    """
+
+    def __init__(self, model, compiled, rng, max_decisions=200000):
+        self.model = model
+        self.compiled = compiled
+        self.rng = rng
+        self.max_decisions = max_decisions
+        self.counts = subtree_counts(model)
+        self.constraints = [self.compiled.rule_clauses(i) for i, rule in enumerate(compiled.rules)
+                            if rule[0] == 'constraint']
+        self.conditioned = False  # switched on once rejection proved too slow
+
+    def _draw_tree(self):
+        # Selected feature names of a uniformly drawn configuration of the tree
+        model, counts, rng = self.model, self.counts, self.rng
+        selected = []
+        stack = [model.root] if model.root is not None else []
+        while stack:
+            name = stack.pop()
+            selected.append(name)
+            feature = model[name]
+            for child in feature.children:
+                if model[child].mandatory or rng.randrange(counts[child] + 1) < counts[child]:
+                    stack.append(child)
+            if feature.group_type == 'xor':
+                pick = rng.randrange(sum(counts[member] for member in feature.group))
+                for member in feature.group:
+                    if pick < counts[member]:
+                        stack.append(member)
+                        break
+                    pick -= counts[member]
+            elif feature.group_type == 'or':
+                while True:  # members are independent, conditioned on at least one
+                    members = [m for m in feature.group if rng.randrange(counts[m] + 1) < counts[m]]
+                    if members:
+                        break
+                stack.extend(members)
+        return selected
+
+    def _satisfies(self, selected):
+        ids = self.compiled.feature_ids
+        true = {ids[name] for name in selected}
+        return all(any((lit > 0) == (abs(lit) in true) for lit in clause)
+                   for clauses in self.constraints for clause in clauses)
+
+    def _draw_conditioned(self):
+        # Fix the features one by one, each with odds from exact counts of the CNF
+        counter = ModelCounter(self.max_decisions)
+        clauses = [list(clause) for clause in self.compiled.clauses]
+        variables = range(1, self.compiled.nv + 1)
+        total = counter.count(clauses, variables)
+        if total == 0:
+            return None
+        for v in self.compiled.feature_vars():
+            with_v = counter.count(clauses + [[v]], variables)
+            lit = v if self.rng.randrange(total) < with_v else -v
+            total = with_v if lit > 0 else total - with_v
+            clauses.append([lit])
+        true = {lit for clause in clauses if len(clause) == 1 for lit in clause if lit > 0}
+        return [self.compiled.names[v] for v in self.compiled.feature_vars() if v in true]
+
+    def sample(self):
+        """One configuration (feature names in feature order), or None if there is none."""
+        if self.model.root is None:
+            return []
+        if not self.conditioned:
+            for _ in range(MAX_REJECTIONS):
+                selected = self._draw_tree()
+                if self._satisfies(selected):
+                    index = self.compiled.feature_ids
+                    return sorted(selected, key=index.get)
+            self.conditioned = True
+        return self._draw_conditioned()
+
+
+def _draw(model, compiled, count, seed, max_decisions=200000):
+    sampler = _TreeSampler(model, compiled, random.Random(seed), max_decisions)
+    samples = []
+    for _ in range(count):
+        configuration = sampler.sample()
+        if configuration is None:
+            break
+        samples.append(configuration)
+    return samples
+
+
+def _compile_exact(model, constraints):
+    # Exact encodings determine the auxiliary variables, so counts are configuration counts
+    return compile_cnf(model, constraints, exact=True)
+
+
+def sample_chunk(source, count, seed, constraints=()):
+    """`count` random configurations drawn with the given seed; see random_sample."""
+    model = as_model(source)
+    return _draw(model, _compile_exact(model, constraints), count, seed)
+
+
+def draw_chunks(source, chunks, constraints=()):
+    """Draw several of the chunks listed by sample_chunks, one after the other."""
+    model = as_model(source)
+    compiled = _compile_exact(model, constraints)
+    return [configuration for size, seed in chunks for configuration in _draw(model, compiled, size, seed)]
+
+
+def sample_chunks(count, seed):
+    """(size, seed) of the chunks that make up a random sample of `count` configurations."""
+    return [(min(CHUNK_SIZE, count - start), f"{seed}:{start // CHUNK_SIZE}")
+            for start in range(0, count, CHUNK_SIZE)]
+
+
+@timed('random_sample')
+def random_sample(source, count, seed=0, constraints=(), workers=1):
+    """
+    `count` uniformly drawn valid configurations (feature names, repeats
+    possible) of a model, reproducible from `seed`. With `workers` > 1 the
+    chunks are drawn on a process pool; the result is the same either way.
+    Raises CountBudgetExceeded when the cross-tree constraints rule out
+    nearly every configuration of the tree and the model is too hard to count.
+    """
+    model = as_model(source)
+    chunks = sample_chunks(count, seed)
+    arguments = [(model, size, chunk_seed, constraints) for size, chunk_seed in chunks]
+    if workers > 1 and len(chunks) > 1:
+        with multiprocessing.get_context().Pool(min(workers, len(chunks))) as pool:
+            results = pool.starmap(sample_chunk, arguments)
+    else:
+        results = [sample_chunk(*args) for args in arguments]
+    return [configuration for result in results for configuration in result]
+
+
+@timed('twise_sample')
+def twise_sample(source, t=2, seed=0, constraints=(), max_configurations=None):
+    """
+    A t-wise covering sample: valid configurations such that every combination
+    of t feature values that occurs in some valid configuration occurs in one
+    of them. Greedy in the style of YASA: each interaction is added to the first
+    configuration under construction that can still take it (checked by the
+    solver), and interactions that the current solution of such a configuration
+    already shows are fixed there without a solver call. Core and dead features
+    are left out of the interactions. Returns {'configurations', 'interactions',
+    'invalid', 'uncovered'}; interactions are uncovered only when
+    `max_configurations` stopped the sample from growing.
+    """
+    if t < 1:
+        raise ValueError("t must be at least 1")
+    compiled = compile_cnf(source, constraints)
+    rng = random.Random(seed)
+    with SolverSession(compiled) as session:
+        implied = session.implied()
+    if not implied['valid']:
+        return {'configurations': [], 'interactions': 0, 'invalid': 0, 'uncovered': 0}
+    fixed = {compiled.feature_ids[name] for name in implied['forced'] + implied['forbidden']}
+    variables = [v for v in compiled.feature_vars() if v not in fixed]
+    rng.shuffle(variables)
+
+    configurations = []  # [fixed literals, current solution, literals the fixed ones imply], as sets
+    interactions = invalid = uncovered = 0
+    with Solver(name='m22', bootstrap_with=compiled.clauses) as solver:
+        # What each literal implies by propagation rules out most clashes without a solver call
+        implies = {}
+        for v in variables:
+            for lit in (v, -v):
+                implies[lit] = set(solver.propagate(assumptions=[lit])[1])
+
+        for combination in itertools.combinations(variables, t):
+            for signs in itertools.product((1, -1), repeat=t):
+                interaction = [sign * v for sign, v in zip(signs, combination)]
+                interactions += 1
+                if any(-b in implies[a] for a in interaction for b in interaction):
+                    invalid += 1
+                    continue
+                placed = False
+                for configuration in configurations:
+                    if all(lit in configuration[1] for lit in interaction):
+                        configuration[0].update(interaction)
+                        placed = True
+                        break
+                if placed:
+                    continue
+                for configuration in configurations:
+                    literals, _, closure = configuration
+                    if any(-lit in closure for lit in interaction):
+                        continue
+                    if solver.solve(assumptions=list(literals) + interaction):
+                        literals.update(interaction)
+                        configuration[1] = set(solver.get_model())
+                        for lit in interaction:
+                            closure |= implies[lit]
+                        placed = True
+                        break
+                if placed:
+                    continue
+                if not solver.solve(assumptions=interaction):
+                    invalid += 1
+                elif max_configurations is not None and len(configurations) >= max_configurations:
+                    uncovered += 1
+                else:
+                    closure = set().union(*(implies[lit] for lit in interaction))
+                    configurations.append([set(interaction), set(solver.get_model()), closure])
+        if not configurations and solver.solve():
+            configurations.append([set(), set(solver.get_model()), set()])  # every feature is fixed
+
+    return {
+        'configurations': [_configuration(solution, compiled) for _, solution, _ in configurations],
+        'interactions': interactions,
+        'invalid': invalid,
+        'uncovered': uncovered,
+    }
@@ -0,0 +1,303 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from pysat.solvers import Solver
+
+from logic.metrics import timed
+from logic.translate import compile_cnf
+
+
+class SolverSession:
+    """
+    A warm incremental SAT solver for one feature model.
+    All checks are answered with assumptions, so the clauses are loaded only once.
+    When the compiled CNF is edited, add_rule and retire_rule update the solver
+    in place: added rules, and the `retirable` rules given up front, are guarded
+    by a selector literal that is assumed true until the rule is retired.
+    Retirable rules share selectors in groups of about the square root of their
+    number, which keeps both the assumptions of every check and the clauses
+    reloaded by a retirement small. The native solver is released by close()
+    (or by leaving a `with` block).
+    """
+
+    def __init__(self, source, retirable=()):
+        self.compiled = compile_cnf(source)
+        self.last_used = time.monotonic()
+        self._selectors = {}  # rule index -> selector literal guarding it
+        self._guarded = {}  # selector literal -> rule indexes it guards
+        self._lock = threading.Lock()
+        self.solver = self._load(retirable)
+
+    def _load(self, retirable):
+        retirable = list(retirable)
+        size = max(1, math.isqrt(len(retirable)))
+        guarded = {}  # clause index -> selector literal
+        for i in range(0, len(retirable), size):
+            selector = self._guard(retirable[i:i + size])
+            for rule in retirable[i:i + size]:
+                _, _, start, end = self.compiled.rules[rule]
+                guarded.update((clause, selector) for clause in range(start, end))
+        clauses = self.compiled.clauses
+        if guarded:
+            clauses = [clause + [-guarded[i]] if i in guarded else clause for i, clause in enumerate(clauses)]
+        return Solver(name='m22', bootstrap_with=clauses)
+
+    def _guard(self, rules):
+        # A new selector for `rules`; their clauses are loaded by the caller
+        selector = self.compiled.aux()
+        self._guarded[selector] = set(rules)
+        for rule in rules:
+            self._selectors[rule] = selector
+        return selector
+
+    def _add_guarded(self, rules):
+        selector = self._guard(rules)
+        for rule in rules:
+            for clause in self.compiled.rule_clauses(rule):
+                self.solver.add_clause(clause + [-selector])
+
+    def add_rule(self, rule):
+        """Load the clauses of a rule just added to the compiled CNF."""
+        with self._lock:
+            self._add_guarded([rule])
+
+    def retire_rule(self, rule):
+        """
+        Drop a rule retired in the compiled CNF. A guarded rule's selector is
+        switched off and the other rules it guarded are loaded again under a
+        new one. MiniSat cannot delete any other clause, so the solver is then
+        rebuilt from the current clauses.
+        """
+        with self._lock:
+            selector = self._selectors.pop(rule, None)
+            if selector is not None:
+                self.solver.add_clause([-selector])
+                rules = self._guarded.pop(selector)
+                rules.discard(rule)
+                if rules:
+                    self._add_guarded(sorted(rules))
+                return
+            retirable = list(self._selectors)
+            self._selectors.clear()
+            self._guarded.clear()
+            self.solver.delete()
+            self.solver = self._load(retirable)
+
+    def _assumptions(self, selected, deselected):
+        ids = self.compiled.feature_ids
+        unknown = [name for name in list(selected) + list(deselected) if name not in ids]
+        if unknown:
+            raise KeyError(f"Unknown features: {', '.join(unknown)}")
+        return [ids[name] for name in selected] + [-ids[name] for name in deselected]
+
+    def _with_selectors(self, assumptions):
+        if self._guarded:
+            return list(self._guarded) + assumptions
+        return assumptions
+
+    def _solve(self, assumptions):
+        if self.solver is None:
+            raise RuntimeError("Solver session is closed")
+        self.last_used = time.monotonic()
+        return self.solver.solve(assumptions=self._with_selectors(assumptions))
+
+    def _selected(self, model):
+        names = self.compiled.names
+        return [names[lit] for lit in model if lit > 0 and lit in names]
+
+    def check(self, selected=(), deselected=()):
+        """
+        Check whether the (partial) selection can be completed to a valid product.
+        Returns (valid, names of the features in one such product).
+        """
+        with self._lock:
+            assumptions = self._assumptions(selected, deselected)
+            if not self._solve(assumptions):
+                return False, []
+            return True, self._selected(self.solver.get_model())
+
+    def solve_literals(self, literals):
+        """
+        Satisfiability under raw variable-id assumptions, for callers that already
+        work with the compiled ids (e.g. batch validation).
+        """
+        with self._lock:
+            return self._solve(literals)
+
+    @timed('implied')
+    def implied(self, selected=(), deselected=()):
+        """
+        Work out which features the (partial) selection forces on and which it rules out.
+        Literals that unit propagation derives from the selection are implied
+        outright. Every other feature keeping its value across all models found
+        so far is probed by assuming the opposite value. Before each probe the
+        solver is told to prefer the opposite of every remaining candidate, so
+        each model found on the way rules out as many of them as it can.
+        """
+        with self._lock:
+            assumptions = self._assumptions(selected, deselected)
+            if not self._solve(assumptions):
+                return {'valid': False, 'forced': [], 'forbidden': []}
+
+            names = self.compiled.names
+            model = self.solver.get_model()
+            _, propagated = self.solver.propagate(assumptions=self._with_selectors(assumptions))
+            decided = set(assumptions).union(propagated)
+            implied = [lit for lit in propagated if abs(lit) in names and lit not in assumptions]
+            # model[v - 1] is the literal of variable v; variables in no clause are left out
+            values = [model[v - 1] if v <= len(model) else -v for v in names]
+            candidates = {lit for lit in values if lit not in decided}
+            while candidates:
+                self.solver.set_phases([-lit for lit in candidates])
+                lit = candidates.pop()
+                if self._solve(assumptions + [-lit]):
+                    # Everything that differs in this model is not implied either
+                    model = self.solver.get_model()
+                    candidates = {c for c in candidates if model[abs(c) - 1] == c}
+                else:
+                    implied.append(lit)
+
+            forced = sorted(names[lit] for lit in implied if lit > 0)
+            forbidden = sorted(names[-lit] for lit in implied if lit < 0)
+            return {'valid': True, 'forced': forced, 'forbidden': forbidden}
+
+    def close(self):
+        with self._lock:
+            if self.solver is not None:
+                self.solver.delete()
+                self.solver = None
+
+    @property
+    def closed(self):
+        return self.solver is None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SessionPool:
+    """
+    Solver sessions keyed by fileId. At most `max_sessions` are kept alive and
+    sessions idle for longer than `idle_timeout` seconds are closed, so the
+    native solver memory stays bounded. Requests hold a session through
+    checkout(); one that is evicted or discarded while checked out is closed
+    when the last holder returns it, and expire() leaves it alone.
+    """
+
+    def __init__(self, max_sessions=32, idle_timeout=600):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict()
+        self._users = {}  # session -> number of checkouts not yet returned
+        self._dropped = set()  # sessions out of the pool, closed once returned
+        self._lock = threading.Lock()
+
+    def get(self, key, source_factory):
+        """
+        Return the session for `key`, creating it from `source_factory()` if needed.
+        The session is not reserved; use checkout() to keep it open while in use.
+        """
+        session = self._acquire(key, source_factory)
+        self.release(session)
+        return session
+
+    @contextmanager
+    def checkout(self, key, source_factory):
+        """The session for `key`, kept open until the `with` block is left."""
+        session = self._acquire(key, source_factory)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def _acquire(self, key, source_factory):
+        with self._lock:
+            session = self._take(key)
+        if session is None:
+            created = SolverSession(source_factory())
+            evicted = []
+            with self._lock:
+                session = self._take(key)
+                if session is None:
+                    session = self._reserve(key, created)
+                else:
+                    evicted.append(created)  # lost the race, keep the other one
+                while len(self._sessions) > self.max_sessions:
+                    evicted.append(self._drop(self._sessions.popitem(last=False)[1]))
+            for old in evicted:
+                if old is not None:
+                    old.close()
+        self.expire()
+        return session
+
+    def _take(self, key):
+        # Under self._lock: check out the live session of `key`, if there is one
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            return None
+        self._sessions.move_to_end(key)
+        return self._reserve(key, session)
+
+    def _reserve(self, key, session):
+        self._sessions[key] = session
+        self._users[session] = self._users.get(session, 0) + 1
+        session.last_used = time.monotonic()
+        return session
+
+    def _drop(self, session):
+        # Under self._lock: the session left the pool, returned if it can be closed now
+        if session in self._users:
+            self._dropped.add(session)
+            return None
+        return session
+
+    def release(self, session):
+        """Return a session taken by checkout()."""
+        with self._lock:
+            users = self._users.pop(session) - 1
+            if users:
+                self._users[session] = users
+                return
+            session.last_used = time.monotonic()
+            if session not in self._dropped:
+                return
+            self._dropped.discard(session)
+        session.close()
+
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            idle = [key for key, session in self._sessions.items()
+                    if session not in self._users and now - session.last_used > self.idle_timeout]
+            sessions = [self._sessions.pop(key) for key in idle]
+        for session in sessions:
+            session.close()
+        return idle
+
+    def discard(self, key):
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                session = self._drop(session)
+        if session is not None:
+            session.close()
+
+    def close_all(self):
+        with self._lock:
+            sessions = [self._drop(session) for session in self._sessions.values()]
+            self._sessions.clear()
+        for session in sessions:
+            if session is not None:
+                session.close()
+
+    def __contains__(self, key):
+        return key in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,546 @@
+import abc
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Legacy flat uploads are named "<uuid4>_<filename>"
+_LEGACY_NAME = re.compile(r"^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})_(.+)$")
+
+
+class EditConflict(Exception):
+    """Raised by add_edit when the upload's edit log no longer ends where the caller expected."""
+
+
+class UploadStore(abc.ABC):
+    """
+    Interface for storing uploaded feature models by fileId.
+    """
+
+    @abc.abstractmethod
+    def save(self, file_id, filename, file, digest=None):
+        """
+        Store an upload (a werkzeug FileStorage, a binary file object or bytes) and
+        return its path. `digest` is the SHA-256 of the content, if already known.
+        """
+
+    @abc.abstractmethod
+    def lookup(self, file_id):
+        """
+        Return {'path', 'filename', 'created', 'size', 'digest'} for an upload, or None.
+        Edited uploads also have 'edits', the model edits applied on top of the file.
+        """
+
+    @abc.abstractmethod
+    def add_edit(self, file_id, edit, sequence):
+        """
+        Record a model edit (see logic.edit) for an upload as its edit number
+        `sequence` (counted from 0); False if the upload is unknown. Raises
+        EditConflict, without recording it, if the log does not hold exactly
+        `sequence` edits, i.e. another edit took that number first.
+        """
+
+    def edits(self, file_id, start=0):
+        """The edits of an upload from sequence number `start` on, in order; [] if it is unknown."""
+        entry = self.lookup(file_id)
+        return entry.get('edits', [])[start:] if entry is not None else []
+
+    def path(self, file_id):
+        """Return the path of a stored upload, or None if it is unknown."""
+        entry = self.lookup(file_id)
+        return entry['path'] if entry else None
+
+    def digest(self, file_id):
+        """Return the SHA-256 of a stored upload's content, or None if it is unknown."""
+        entry = self.lookup(file_id)
+        return entry['digest'] if entry else None
+
+    @abc.abstractmethod
+    def delete(self, file_id):
+        """Remove an upload and return whether it existed; its blob goes with its last fileId."""
+
+    @abc.abstractmethod
+    def expire(self, now=None):
+        """Remove expired uploads and return their fileIds."""
+
+    @abc.abstractmethod
+    def stats(self):
+        """Counts and sizes of the stored uploads, for /stats/uploads."""
+
+    # Subclasses provide on_remove, gc_interval, _gc_thread and _stopped for these
+    def _removed(self, digests):
+        for digest in digests:
+            if digest is not None:
+                for callback in self.on_remove:
+                    callback(digest)
+
+    def start_gc(self):
+        """Start the background thread that expires old uploads (again, in a forked child)."""
+        if self._gc_thread is not None and self._gc_thread.is_alive():
+            return
+
+        def run():
+            while not self._stopped.wait(self.gc_interval):
+                try:
+                    self.expire()
+                except (OSError, sqlite3.Error):
+                    logger.warning("Expiring uploads failed, retrying in %ss", self.gc_interval, exc_info=True)
+
+        self._gc_thread = threading.Thread(target=run, name='upload-store-gc', daemon=True)
+        self._gc_thread.start()
+
+    def stop_gc(self):
+        self._stopped.set()
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return stream_digest(f)
+
+
+def _write_incoming(root, file_id, file):
+    # Write an upload under <root>/incoming before it is moved to its blob path
+    incoming = os.path.join(root, 'incoming')
+    os.makedirs(incoming, exist_ok=True)
+    tmp_path = os.path.join(incoming, file_id)
+    if isinstance(file, bytes):
+        with open(tmp_path, 'wb') as out:
+            out.write(file)
+    elif hasattr(file, 'read'):
+        file.seek(0)
+        with open(tmp_path, 'wb') as out:
+            shutil.copyfileobj(file, out)
+    else:
+        file.save(tmp_path)
+    return tmp_path
+
+
+def stream_digest(stream):
+    """SHA-256 of a binary file object's content from its current position to the end."""
+    sha = hashlib.sha256()
+    for block in iter(lambda: stream.read(1 << 16), b''):
+        sha.update(block)
+    return sha.hexdigest()
+
+
+class LocalUploadStore(UploadStore):
+    """
+    Uploads on local disk, content-addressed: each distinct file is stored once as
+    <root>/<first two chars of its SHA-256>/<SHA-256>.xml and every fileId points
+    at one of these blobs, so byte-identical uploads share storage and digests.
+    An in-memory index gives O(1) lookups; it is persisted as an append-only
+    journal (index.log) that is replayed on start-up and compacted on expiry.
+    Uploads older than `ttl` seconds are removed by a background thread; a blob
+    is deleted with its last fileId, after which `on_remove` callbacks get its digest.
+    """
+
+    def __init__(self, root, ttl=24 * 3600, gc_interval=600):
+        self.root = root
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+        self.on_expire = []  # callbacks taking the expired fileId
+        self.on_remove = []  # callbacks taking the digest of a deleted blob
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._index = {}  # fileId -> {'path', 'filename', 'created', 'size', 'digest'}
+        self._refs = {}  # blob path -> number of fileIds using it
+        self._bytes = 0  # size of the distinct blobs
+        self._lock = threading.Lock()
+        self._journal_path = os.path.join(root, 'index.log')
+        self._gc_thread = None
+        self._stopped = threading.Event()
+
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self._journal_path):
+            with open(self._journal_path, 'r', encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn write from a crash
+                    if record.get('op') == 'put':
+                        self._index[record['id']] = record['entry']
+                    elif record.get('op') == 'del':
+                        self._index.pop(record['id'], None)
+                    elif record.get('op') == 'edit' and record['id'] in self._index:
+                        self._index[record['id']].setdefault('edits', []).append(record['edit'])
+        else:
+            self._import_legacy()
+        # Drop entries whose files disappeared behind our back
+        for file_id, entry in list(self._index.items()):
+            if not os.path.exists(entry['path']):
+                del self._index[file_id]
+            elif 'digest' not in entry:
+                entry['digest'] = _file_digest(entry['path'])  # uploads from before deduplication
+        for entry in self._index.values():
+            if entry['path'] not in self._refs:
+                self._bytes += entry['size']
+            self._refs[entry['path']] = self._refs.get(entry['path'], 0) + 1
+        self._compact()
+
+    def _import_legacy(self):
+        # Index uploads left in the old flat layout so their fileIds keep working
+        for name in os.listdir(self.root):
+            match = _LEGACY_NAME.match(name)
+            path = os.path.join(self.root, name)
+            if match and os.path.isfile(path):
+                stat = os.stat(path)
+                self._index[match.group(1)] = {
+                    'path': path, 'filename': match.group(2),
+                    'created': stat.st_mtime, 'size': stat.st_size,
+                }
+
+    def _append(self, record):
+        with open(self._journal_path, 'a', encoding='utf-8') as journal:
+            journal.write(json.dumps(record) + '\n')
+
+    def _compact(self):
+        tmp_path = self._journal_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as journal:
+            for file_id, entry in self._index.items():
+                journal.write(json.dumps({'op': 'put', 'id': file_id, 'entry': entry}) + '\n')
+        os.replace(tmp_path, self._journal_path)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.xml")
+
+    def _add(self, file_id, filename, path, size, digest):
+        # Point file_id at a stored blob; the caller holds the lock
+        if path not in self._refs:
+            self._bytes += size
+        self._refs[path] = self._refs.get(path, 0) + 1
+        old = self._index.get(file_id)
+        if old is not None:
+            self._release(old)  # after taking the new reference, in case it is the same blob
+        entry = {'path': path, 'filename': filename, 'created': time.time(),
+                 'size': size, 'digest': digest}
+        self._index[file_id] = entry
+        self._append({'op': 'put', 'id': file_id, 'entry': entry})
+
+    def save(self, file_id, filename, file, digest=None):
+        if digest is not None:
+            # Content that is already stored needs no write at all
+            path = self._blob_path(digest)
+            with self._lock:
+                if path in self._refs:
+                    self._add(file_id, filename, path, os.path.getsize(path), digest)
+                    return path
+
+        tmp_path = _write_incoming(self.root, file_id, file)
+        digest = digest or _file_digest(tmp_path)
+        size = os.path.getsize(tmp_path)
+
+        path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            if path in self._refs or os.path.exists(path):
+                os.remove(tmp_path)  # identical content is already stored
+            else:
+                os.replace(tmp_path, path)
+            self._add(file_id, filename, path, size, digest)
+        return path
+
+    def lookup(self, file_id):
+        entry = self._index.get(file_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry = dict(entry)
+        if 'edits' in entry:
+            entry['edits'] = list(entry['edits'])  # the stored log keeps growing
+        return entry
+
+    def edits(self, file_id, start=0):
+        with self._lock:
+            entry = self._index.get(file_id)
+            return entry.get('edits', [])[start:] if entry is not None else []
+
+    def add_edit(self, file_id, edit, sequence):
+        # Only the edit is journaled; the stored file itself never changes
+        with self._lock:
+            entry = self._index.get(file_id)
+            if entry is None:
+                return False
+            edits = entry.setdefault('edits', [])
+            if len(edits) != sequence:
+                raise EditConflict(f"{file_id} has {len(edits)} edits, not {sequence}")
+            edits.append(edit)
+            self._append({'op': 'edit', 'id': file_id, 'edit': edit})
+        return True
+
+    def _release(self, entry):
+        # Drop one reference to a blob; returns its digest if the blob was deleted
+        refs = self._refs.get(entry['path'], 0) - 1
+        if refs > 0:
+            self._refs[entry['path']] = refs
+            return None
+        self._refs.pop(entry['path'], None)
+        self._bytes -= entry['size']
+        try:
+            os.remove(entry['path'])
+        except FileNotFoundError:
+            pass
+        return entry['digest']
+
+    def delete(self, file_id):
+        with self._lock:
+            entry = self._index.pop(file_id, None)
+            if entry is None:
+                return False
+            removed = self._release(entry)
+            self._append({'op': 'del', 'id': file_id})
+        self._removed([removed])
+        return True
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        cutoff = now - self.ttl
+        with self._lock:
+            expired = [file_id for file_id, entry in self._index.items() if entry['created'] < cutoff]
+            removed = [self._release(self._index.pop(file_id)) for file_id in expired]
+            if expired:
+                self.expired += len(expired)
+                self._compact()
+        for file_id in expired:
+            for callback in self.on_expire:
+                callback(file_id)
+        self._removed(removed)
+        return expired
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'uploads': len(self._index),
+            'blobs': len(self._refs),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.0,
+            'expired': self.expired,
+        }
+
+    def __contains__(self, file_id):
+        return file_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+
+class SQLiteUploadStore(UploadStore):
+    """
+    Uploads shared by several server processes. Blobs are content-addressed on
+    disk like in LocalUploadStore, but the index is a SQLite file that every
+    process opens, so any worker can serve any fileId. A blob's references are
+    counted in the index and it is moved in or deleted inside the transaction
+    that changes them, so processes never delete a blob another one still uses.
+    Connections are per process and re-opened after a fork. Model edits are
+    rows numbered per upload, so an edit is only logged under the sequence
+    number its editor gave it and workers replay just the edits they lack.
+    """
+
+    def __init__(self, root, db_path=None, ttl=24 * 3600, gc_interval=600):
+        self.root = root
+        self.db_path = db_path or os.path.join(root, 'index.db')
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+        self.on_expire = []  # callbacks taking the expired fileId
+        self.on_remove = []  # callbacks taking the digest of a deleted blob
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0  # by this process
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._gc_thread = None
+        self._stopped = threading.Event()
+
+        os.makedirs(root, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                " file_id TEXT PRIMARY KEY, path TEXT NOT NULL, filename TEXT NOT NULL,"
+                " created REAL NOT NULL, size INTEGER NOT NULL, digest TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS uploads_path ON uploads (path)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS edits ("
+                " file_id TEXT NOT NULL, sequence INTEGER NOT NULL, edit TEXT NOT NULL,"
+                " PRIMARY KEY (file_id, sequence))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS uploads_created ON uploads (created)")
+
+    def _connection(self):
+        # A connection inherited through fork must not be used by the child
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False,
+                                         isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the database's write lock up front, so blob moves
+        # and deletes are serialised across processes
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.xml")
+
+    @staticmethod
+    def _referenced(conn, path):
+        return conn.execute("SELECT 1 FROM uploads WHERE path = ? LIMIT 1", (path,)).fetchone() is not None
+
+    def _release(self, conn, path, digest):
+        # Delete a blob nothing points at any more; returns its digest if it was deleted
+        if self._referenced(conn, path):
+            return None
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return digest
+
+    def save(self, file_id, filename, file, digest=None):
+        tmp_path = None
+        if digest is None or not os.path.exists(self._blob_path(digest)):
+            tmp_path = _write_incoming(self.root, file_id, file)
+            digest = digest or _file_digest(tmp_path)
+        path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        removed = None
+        with self._transaction() as conn:
+            if not os.path.exists(path):
+                if tmp_path is None:  # deleted by another process since we looked
+                    tmp_path = _write_incoming(self.root, file_id, file)
+                os.replace(tmp_path, path)
+                tmp_path = None
+            old = conn.execute("SELECT path, digest FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads (file_id, path, filename, created, size, digest)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (file_id, path, filename, time.time(), os.path.getsize(path), digest),
+            )
+            conn.execute("DELETE FROM edits WHERE file_id = ?", (file_id,))
+            if old is not None and old[0] != path:
+                removed = self._release(conn, *old)
+        if tmp_path is not None:
+            os.remove(tmp_path)  # identical content is already stored
+        self._removed([removed])
+        return path
+
+    def lookup(self, file_id):
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT path, filename, created, size, digest FROM uploads WHERE file_id = ?", (file_id,)
+            ).fetchone()
+            edits = conn.execute(
+                "SELECT edit FROM edits WHERE file_id = ? ORDER BY sequence", (file_id,)
+            ).fetchall() if row is not None else []
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry = {'path': row[0], 'filename': row[1], 'created': row[2], 'size': row[3], 'digest': row[4]}
+        if edits:
+            entry['edits'] = [json.loads(edit) for edit, in edits]
+        return entry
+
+    def edits(self, file_id, start=0):
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT edit FROM edits WHERE file_id = ? AND sequence >= ? ORDER BY sequence", (file_id, start)
+            ).fetchall()
+        return [json.loads(edit) for edit, in rows]
+
+    def add_edit(self, file_id, edit, sequence):
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM uploads WHERE file_id = ?", (file_id,)).fetchone() is None:
+                return False
+            # Appended only while the log holds exactly `sequence` edits
+            logged = conn.execute(
+                "INSERT INTO edits (file_id, sequence, edit) SELECT ?, ?, ?"
+                " WHERE (SELECT COUNT(*) FROM edits WHERE file_id = ?) = ?",
+                (file_id, sequence, json.dumps(edit), file_id, sequence),
+            ).rowcount
+            if not logged:
+                raise EditConflict(f"{file_id} does not have {sequence} edits")
+        return True
+
+    def delete(self, file_id):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT path, digest FROM uploads WHERE file_id = ?", (file_id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM uploads WHERE file_id = ?", (file_id,))
+            conn.execute("DELETE FROM edits WHERE file_id = ?", (file_id,))
+            removed = self._release(conn, *row)
+        self._removed([removed])
+        return True
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        cutoff = now - self.ttl
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT file_id, path, digest FROM uploads WHERE created < ?", (cutoff,)).fetchall()
+            conn.execute("DELETE FROM uploads WHERE created < ?", (cutoff,))
+            conn.executemany("DELETE FROM edits WHERE file_id = ?", [(file_id,) for file_id, _, _ in rows])
+            blobs = {(path, digest) for _, path, digest in rows}
+            removed = [self._release(conn, path, digest) for path, digest in blobs]
+        expired = [file_id for file_id, _, _ in rows]
+        self.expired += len(expired)
+        for file_id in expired:
+            for callback in self.on_expire:
+                callback(file_id)
+        self._removed(removed)
+        return expired
+
+    def stats(self):
+        with self._lock:
+            uploads, = self._connection().execute("SELECT COUNT(*) FROM uploads").fetchone()
+            blobs, size = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT size FROM uploads GROUP BY path)"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'uploads': uploads,
+            'blobs': blobs,
+            'bytes': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.0,
+            'expired': self.expired,
+        }
+
+    def __contains__(self, file_id):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT 1 FROM uploads WHERE file_id = ?", (file_id,)
+            ).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+
@@ -1,42 +1,280 @@
+import re
+
 from pysat.formula import CNF
 
-def translate_to_cnf(feature_hierarchy, constraints):
-    cnf = CNF()
-    feature_ids = {name: i + 1 for i, name in enumerate(feature_hierarchy)}  # Map features to unique IDs
-
-    # Encode mandatory relationships
-    for feature, details in feature_hierarchy.items():
-        if details['parent']:
-            parent_id = feature_ids[details['parent']]
-            child_id = feature_ids[feature]
-            # Parent implies child (mandatory relationship)
-            if details['mandatory']:
-                cnf.append([-parent_id, child_id])  # parent → child
-            # Child implies parent
-            cnf.append([-child_id, parent_id])  # child → parent
-
-    # Encode XOR and OR groups
-    for feature, details in feature_hierarchy.items():
-        if details.get('group'):
-            group_type = details['group']['type']
-            children = [feature_ids[child] for child in details['group']['children']]
-
-            if group_type == 'xor':  # XOR: (A ∧ ¬B) ∨ (B ∧ ¬A) ...
-                for i, a in enumerate(children):
-                    for b in children[i + 1:]:
-                        cnf.append([-a, -b])  # At most one selected
-                cnf.append(children)  # At least one selected
-
-            elif group_type == 'or':  # OR: At least one selected
-                cnf.append(children)
+from logic.metrics import timed
+from logic.model import as_model
+from logic.parse import constraint_translator
+
+# "A → B", "A -> B", "A implies B", "A requires B", "A excludes B"
+BINARY_CONSTRAINT = re.compile(r"^\s*(.+?)\s*(→|->|=>|\bimplies\b|\brequires\b|\bexcludes\b)\s*(.+?)\s*$", re.IGNORECASE)
+
+# Groups larger than this get a sequential-counter at-most-one encoding instead of pairwise clauses
+PAIRWISE_AMO_LIMIT = 5
+
+
+def _variable_key(name):
+    return name.replace(" ", "").lower()
+
+
+def constraint_clauses(formula, lookup):
+    """
+    Translate a binary constraint formula into CNF clauses.
+    `lookup` maps variable keys (lower-case names without spaces) to variable ids.
+    Returns None if the formula is not understood or names unknown features.
+    """
+    match = BINARY_CONSTRAINT.match(formula.strip().rstrip("."))
+    if not match:
+        return None
+    left = lookup.get(_variable_key(match.group(1)))
+    right = lookup.get(_variable_key(match.group(3)))
+    if left is None or right is None:
+        return None
+    if match.group(2).lower() == "excludes":
+        return [[-left, -right]]  # ~(left ∧ right)
+    return [[-left, right]]  # left → right
+
+
+class CompiledCNF:
+    """
+    Integer-clause CNF of a feature model.
+    Feature names are interned to variable ids (`feature_ids` / `names`); auxiliary
+    variables of the at-most-one encodings are numbered after them. Every clause
+    belongs to a rule such as ('xor', parent, children) so the human-readable
+    formulas can be rendered on demand. Rules can be retired in place (see
+    retire_rule) so edits never renumber the clauses or rules that follow.
+    """
+
+    def __init__(self, feature_ids=None):
+        self.feature_ids = dict(feature_ids or {})  # name -> id
+        self.names = {v: k for k, v in self.feature_ids.items()}  # id -> name
+        self.nv = max(self.names, default=0)
+        self.clauses = []
+        self.rules = []  # (kind, args, first clause index, end clause index)
+        self.unsupported = []  # constraint formulas that could not be encoded
+        self.constraint_rules = []  # per constraint formula: its rule index, or None if unsupported
+
+    def var(self, name):
+        """Return the variable id of a feature, interning it if it is new."""
+        feature_id = self.feature_ids.get(name)
+        if feature_id is None:
+            self.nv += 1
+            feature_id = self.nv
+            self.feature_ids[name] = feature_id
+            self.names[feature_id] = name
+        return feature_id
+
+    def aux(self):
+        self.nv += 1
+        return self.nv
+
+    def add_rule(self, kind, args, clauses):
+        """Append a rule and its clauses; returns the rule's index."""
+        start = len(self.clauses)
+        self.clauses.extend(clauses)
+        self.rules.append((kind, args, start, len(self.clauses)))
+        return len(self.rules) - 1
+
+    def rule_clauses(self, index):
+        _, _, start, end = self.rules[index]
+        return self.clauses[start:end]
+
+    def retire_rule(self, index):
+        """
+        Drop a rule without moving anything else: its clauses are overwritten
+        with a tautology, which every solver ignores, and it is no longer rendered.
+        """
+        kind, args, start, end = self.rules[index]
+        if kind == 'retired':
+            return
+        for i in range(start, end):
+            self.clauses[i] = [1, -1]
+        self.rules[index] = ('retired', (kind, args), start, end)
+
+    def feature_vars(self):
+        return sorted(self.names)
+
+    def to_cnf(self):
+        return CNF(from_clauses=self.clauses)
+
+    @timed('formulas')
+    def formulas(self, include_constraints=False):
+        """
+        Render the rules as propositional logic formulas.
+        """
+        formulas = []
+        for kind, args, _, _ in self.rules:
+            if kind == 'root':
+                formulas.append(f"{args} = True")  # Root feature is always true
+            elif kind in ('mandatory', 'parent'):
+                formulas.append(f"{args[0]} → {args[1]}")
+            elif kind == 'xor':
+                parent, children = args
+                formulas.append(f"{parent} → ({' ∨ '.join(children)})")
+                if len(children) <= PAIRWISE_AMO_LIMIT:
+                    pairwise_exclusions = " ∧ ".join(
+                        [f"~({a} ∧ {b})" for i, a in enumerate(children) for b in children[i + 1:]]
+                    )
+                    formulas.append(f"{parent} → ({pairwise_exclusions})")
+                else:
+                    formulas.append(f"{parent} → AtMostOne({', '.join(children)})")
+            elif kind == 'or':
+                parent, children = args
+                formulas.append(f"{parent} → ({' ∨ '.join(children)})")
+            elif kind == 'constraint' and include_constraints:
+                formulas.append(args)
+        return formulas
+
+
+def at_most_one(variables, compiled, exact=False):
+    """
+    At-most-one clauses over `variables`: pairwise for small groups, otherwise
+    Sinz's sequential counter (3n - 4 clauses and n - 1 auxiliary variables).
+    With `exact`, each counter s_i is also forced to equal x_1 ∨ ... ∨ x_i, so the
+    auxiliary variables are determined by the features and model counts stay exact.
+    """
+    if len(variables) <= PAIRWISE_AMO_LIMIT:
+        return [[-a, -b] for i, a in enumerate(variables) for b in variables[i + 1:]]
+
+    clauses = []
+    counters = [compiled.aux() for _ in variables[:-1]]
+    clauses.append([-variables[0], counters[0]])
+    for i in range(1, len(variables) - 1):
+        clauses.append([-variables[i], counters[i]])
+        clauses.append([-counters[i - 1], counters[i]])
+        clauses.append([-variables[i], -counters[i - 1]])
+    clauses.append([-variables[-1], -counters[-1]])
+    if exact:
+        clauses.append([-counters[0], variables[0]])
+        for i in range(1, len(variables) - 1):
+            clauses.append([-counters[i], counters[i - 1], variables[i]])
+    return clauses
+
+
+def add_parent_rules(compiled, feature):
+    """
+    Rules tying a solitary feature to its parent: child → parent, and parent → child if mandatory.
+    """
+    if not feature.parent:
+        return
+    feature_id = compiled.var(feature.name)
+    parent_id = compiled.var(feature.parent)
+    if feature.mandatory:
+        compiled.add_rule('mandatory', (feature.parent, feature.name), [[-parent_id, feature_id]])  # parent → child
+    compiled.add_rule('parent', (feature.name, feature.parent), [[-feature_id, parent_id]])  # child → parent
+
+
+def add_group_rule(compiled, feature, exact=False):
+    """
+    The xor/or rule of the group owned by `feature`; returns its index, or None
+    for an unknown group type.
+    """
+    feature_id = compiled.var(feature.name)
+    children = [compiled.var(child) for child in feature.group]
+    if feature.group_type == 'xor':
+        # XOR: exactly one child when the parent is selected
+        return compiled.add_rule('xor', (feature.name, feature.group),
+                                 [[-feature_id] + children] + at_most_one(children, compiled, exact))
+    if feature.group_type == 'or':
+        # OR: at least one child when the parent is selected
+        return compiled.add_rule('or', (feature.name, feature.group), [[-feature_id] + children])
+    return None
+
+
+def add_group_rules(compiled, feature, exact=False):
+    """
+    Rules of the xor/or group owned by `feature`, plus member → parent for every member.
+    """
+    feature_id = compiled.var(feature.name)
+    add_group_rule(compiled, feature, exact)
+    for child in feature.group:
+        child_id = compiled.var(child)
+        compiled.add_rule('parent', (child, feature.name), [[-child_id, feature_id]])
+
+
+def compile_cnf(source, constraints=(), feature_ids=None, exact=False):
+    """
+    Compile a parsed feature model and its cross-tree constraints into a CompiledCNF.
+    `constraints` are extra formulas (e.g. entered by the user) on top of the model's own.
+    Pass the `feature_ids` of an earlier compilation to keep variable ids stable, and
+    `exact` when every model of the CNF must correspond to exactly one configuration
+    (for model counting).
+    """
+    if isinstance(source, CompiledCNF):
+        return source
+    return _compile_cnf(as_model(source), constraints, feature_ids, exact)
+
+
+@timed('compile_cnf')
+def _compile_cnf(model, constraints, feature_ids, exact):
+    compiled = CompiledCNF(feature_ids)
+
+    # Intern every feature first so auxiliary variables never collide with them
+    for name in model.features:
+        compiled.var(name)
+
+    # Depth-first walk with an explicit stack; each feature's rules come before its
+    # solitary sub-trees, followed by its group rules and then the group members' sub-trees
+    stack = [('feature', model.root, False)] if model.root is not None else []
+    if stack:
+        compiled.add_rule('root', model.root, [[compiled.var(model.root)]])
+    while stack:
+        action, name, in_group = stack.pop()
+        feature = model[name]
+        if action == 'group':
+            add_group_rules(compiled, feature, exact)
+            continue
+        # Group members are related to their parent by the group rules
+        if not in_group:
+            add_parent_rules(compiled, feature)
+        for child in reversed(feature.group):
+            stack.append(('feature', child, True))
+        if feature.group:
+            stack.append(('group', name, False))
+        for child in reversed(feature.children):
+            stack.append(('feature', child, False))
 
     # Translate cross-tree constraints
-    for constraint in constraints:
-        if "requires" in constraint.lower():
+    translator = constraint_translator(model)
+    lookup = variable_lookup(compiled)
+    formulas = []
+    for constraint in model.constraints:
+        if constraint.get('booleanExpression'):
+            formulas.append(constraint['booleanExpression'])
+        elif constraint.get('englishStatement'):
             # Example: "The Location feature is required to filter the catalog by location."
-            parts = constraint.split("requires")
-            req_feature = feature_ids[parts[0].strip()]
-            dependent_feature = feature_ids[parts[1].strip()]
-            cnf.append([-dependent_feature, req_feature])  # dependent → required
+            formulas.append(translator.translate(constraint['englishStatement']))
+        else:
+            formulas.append(None)  # keeps constraint_rules aligned with model.constraints
+    formulas.extend(constraints)
+
+    for formula in formulas:
+        add_constraint_rule(compiled, formula, lookup)
+
+    return compiled
+
+
+def add_constraint_rule(compiled, formula, lookup):
+    """
+    Encode one constraint formula; returns its rule index, or None if the formula
+    is empty or not understood (then it is listed in `compiled.unsupported`).
+    """
+    clauses = constraint_clauses(formula, lookup) if formula else None
+    rule = compiled.add_rule('constraint', formula, clauses) if clauses else None
+    if formula and rule is None:
+        compiled.unsupported.append(formula)
+    compiled.constraint_rules.append(rule)
+    return rule
+
+
+def variable_lookup(compiled):
+    """Variable keys (lower-case names without spaces) to variable ids, for constraint_clauses."""
+    return {_variable_key(name): feature_id for name, feature_id in compiled.feature_ids.items()}
+
 
-    return cnf, feature_ids
+def translate_to_cnf(source, constraints=()):
+    """
+    Encode a parsed feature model as a PySAT CNF; returns (cnf, feature_ids).
+    """
+    compiled = compile_cnf(source, constraints)
+    return compiled.to_cnf(), compiled.feature_ids
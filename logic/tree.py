@@ -0,0 +1,168 @@
+import weakref
+
+from logic.model import as_model
+
+
+class TreeIndex:
+    """
+    Interval numbering of a feature tree, built once per model. Features are
+    numbered in depth-first pre-order (solitary children before group members),
+    so the sub-tree of the feature at position i is exactly the positions
+    [i, end[i]). With depth, parent and group-owner arrays alongside, ancestor
+    tests, depth and group lookups are O(1), descendants are one slice and the
+    lowest common ancestor takes O(log n) with binary lifting.
+    """
+
+    def __init__(self, model):
+        self.names = []  # position -> feature name, in pre-order
+        self.position = {}  # feature name -> position
+        self.parent = []  # position -> parent position, -1 for the root
+        self.depth = []  # position -> depth, 0 for the root
+        self.group_owner = []  # position -> position of the feature owning its group, or -1
+        self._model = model
+        self._jumps = None  # binary lifting table, built on the first lca()
+
+        stack = [(model.root, -1, False)] if model.root is not None else []
+        while stack:
+            name, parent, in_group = stack.pop()
+            position = len(self.names)
+            self.names.append(name)
+            self.position[name] = position
+            self.parent.append(parent)
+            self.depth.append(self.depth[parent] + 1 if parent >= 0 else 0)
+            self.group_owner.append(parent if in_group else -1)
+            feature = model[name]
+            # Pushed in reverse so they are numbered in order
+            for member in reversed(feature.group):
+                stack.append((member, position, True))
+            for child in reversed(feature.children):
+                stack.append((child, position, False))
+
+        # Sub-tree sizes bottom-up: in reverse pre-order every child comes before its parent
+        size = [1] * len(self.names)
+        for position in range(len(self.names) - 1, 0, -1):
+            size[self.parent[position]] += size[position]
+        self.end = [position + size[position] for position in range(len(self.names))]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.position
+
+    def _pos(self, name):
+        position = self.position.get(name)
+        if position is None:
+            raise KeyError(f"Unknown feature: {name}")
+        return position
+
+    @property
+    def root(self):
+        return self.names[0] if self.names else None
+
+    def is_ancestor(self, ancestor, name):
+        """Whether `ancestor` is a proper ancestor of `name`."""
+        a, b = self._pos(ancestor), self._pos(name)
+        return a < b < self.end[a]
+
+    def depth_of(self, name):
+        return self.depth[self._pos(name)]
+
+    def parent_of(self, name):
+        parent = self.parent[self._pos(name)]
+        return self.names[parent] if parent >= 0 else None
+
+    def subtree_size(self, name):
+        """Number of features in the sub-tree of `name`, itself included."""
+        position = self._pos(name)
+        return self.end[position] - position
+
+    def descendants(self, name):
+        """Every feature below `name`, in pre-order."""
+        position = self._pos(name)
+        return self.names[position + 1:self.end[position]]
+
+    def ancestors(self, name):
+        """The features above `name`, from its parent up to the root."""
+        result = []
+        position = self.parent[self._pos(name)]
+        while position >= 0:
+            result.append(self.names[position])
+            position = self.parent[position]
+        return result
+
+    def group_of(self, name):
+        """(owner, group type) of the xor/or group `name` belongs to, or None if it is solitary."""
+        owner = self.group_owner[self._pos(name)]
+        if owner < 0:
+            return None
+        owner_name = self.names[owner]
+        return owner_name, self._model[owner_name].group_type
+
+    def lca(self, a, b):
+        """Lowest common ancestor of two features (a feature counts as its own ancestor)."""
+        a, b = self._pos(a), self._pos(b)
+        if a <= b < self.end[a]:
+            return self.names[a]
+        if b <= a < self.end[b]:
+            return self.names[b]
+        jumps = self._lifting()
+        # Climb from a to the highest ancestor that still does not contain b
+        for level in reversed(jumps):
+            up = level[a]
+            if up >= 0 and not up <= b < self.end[up]:
+                a = up
+        return self.names[self.parent[a]]
+
+    def _lifting(self):
+        # jumps[k][i] is the 2^k-th ancestor of position i, or -1
+        if self._jumps is None:
+            jumps = [self.parent]
+            while any(p >= 0 for p in jumps[-1]):
+                previous = jumps[-1]
+                jumps.append([previous[p] if p >= 0 else -1 for p in previous])
+            self._jumps = jumps
+        return self._jumps
+
+    def nodes(self, root=None, max_depth=None):
+        """
+        The sub-tree of `root` (the whole tree by default) in pre-order, as dicts
+        for clients: name, depth, parent, number of descendants, mandatory flag
+        and the type of the group the feature belongs to. `max_depth` (relative
+        to `root`) cuts off deeper features.
+        """
+        start = self._pos(root) if root is not None else 0
+        stop = self.end[start] if self.names else 0
+        limit = self.depth[start] + max_depth if max_depth is not None and self.names else None
+        result = []
+        for position in range(start, stop):
+            depth = self.depth[position]
+            if limit is not None and depth > limit:
+                continue
+            name = self.names[position]
+            owner = self.group_owner[position]
+            parent = self.parent[position]
+            result.append({
+                "name": name,
+                "depth": depth,
+                "parent": self.names[parent] if parent >= 0 else None,
+                "descendants": self.end[position] - position - 1,
+                "mandatory": self._model[name].mandatory,
+                "groupType": self._model[self.names[owner]].group_type if owner >= 0 else None,
+            })
+        return result
+
+
+# Indexes of live models; an entry is rebuilt when its model has been edited since
+_indexes = weakref.WeakKeyDictionary()
+
+
+def tree_index(source):
+    """The TreeIndex of a model (or XML path), built on first use and then reused."""
+    model = as_model(source)
+    digest = model.digest()
+    entry = _indexes.get(model)
+    if entry is None or entry[0] != digest:
+        entry = (digest, TreeIndex(model))
+        _indexes[model] = entry
+    return entry[1]
@@ -1,25 +1,36 @@
 from pysat.solvers import Solver
 
+from logic.metrics import timed
+from logic.tree import TreeIndex
+
+@timed('validate_configuration')
 def validate_configuration(cnf, feature_ids, selected_features, feature_hierarchy):
-    from pysat.solvers import Solver
-    
-    solver = Solver()
-    for clause in cnf.clauses:
-        solver.add_clause(clause)
+    """
+    Check a selection against the CNF and the feature tree. `feature_hierarchy`
+    is a TreeIndex (see logic/tree.py), or a dict of {'parent': ...} per feature.
+    """
+    if isinstance(feature_hierarchy, TreeIndex):
+        parent_of = feature_hierarchy.parent_of
+    else:
+        def parent_of(feature):
+            return feature_hierarchy[feature].get('parent')
 
     selected_ids = [feature_ids[feature] for feature in selected_features if feature in feature_ids]
     assumptions = selected_ids  # Assuming selected features are true
 
-    if solver.solve(assumptions=assumptions):
-        model = solver.get_model()
+    # The solver is deleted on leaving the block; use SolverSession for repeated checks
+    with Solver(bootstrap_with=cnf.clauses) as solver:
+        satisfiable = solver.solve(assumptions=assumptions)
+        model = solver.get_model() if satisfiable else None
 
+    if satisfiable:
         # Ensure model includes parent-child relationships
         id_to_feature = {v: k for k, v in feature_ids.items()}
         model_features = {id_to_feature[abs(var)]: (var > 0) for var in model if abs(var) in id_to_feature}
 
         for feature in selected_features:
             # Check parent-child consistency
-            parent = feature_hierarchy[feature].get('parent')
+            parent = parent_of(feature)
             if parent and model_features[feature]:  # If a feature is selected
                 if not model_features[parent]:  # Its parent must also be selected
                     return False, []
@@ -1,31 +1,85 @@
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
 from lxml import etree
 
+logger = logging.getLogger(__name__)
+
+# Compiled schemas not in use right now: path -> (mtime, [schema, ...])
+_schema_cache = {}
+_schema_cache_lock = threading.Lock()
+
+
+@contextmanager
+def checkout_schema(xsd_file):
+    """
+    The compiled XMLSchema for xsd_file, for the caller alone until the `with`
+    block is left. lxml schemas are not re-entrant, so concurrent validations
+    each use their own; idle ones are reused, and all of them are recompiled
+    once the file's mtime changes.
+    """
+    path = os.path.abspath(xsd_file)
+    mtime = os.stat(path).st_mtime_ns
+    with _schema_cache_lock:
+        entry = _schema_cache.get(path)
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, [])
+            _schema_cache[path] = entry
+        schema = entry[1].pop() if entry[1] else None
+    if schema is None:
+        schema = etree.XMLSchema(etree.parse(path))
+    try:
+        yield schema
+    finally:
+        with _schema_cache_lock:
+            # Schemas of a file that has changed since are dropped
+            if _schema_cache.get(path) is entry:
+                entry[1].append(schema)
+
+
+def get_schema(xsd_file):
+    """Compile xsd_file ahead of its first use, e.g. before forking workers."""
+    with checkout_schema(xsd_file):
+        pass
+
+
+def assert_valid(xml_doc, xsd_file):
+    """
+    Validate an already parsed document against the cached schema.
+    Raises etree.DocumentInvalid with the schema's error message on failure.
+    """
+    with checkout_schema(xsd_file) as schema:
+        schema.assertValid(xml_doc)
+
+
+def clear_schema_cache():
+    with _schema_cache_lock:
+        _schema_cache.clear()
+
+
 def validate_xml(xml_file, xsd_file):
     # Parse the XML and XSD files
     try:
-        # Parse the XSD schema
-        with open(xsd_file, 'r') as schema_file:
-            schema_root = etree.parse(schema_file)
-            schema = etree.XMLSchema(schema_root)
-        
         # Parse the XML file
         with open(xml_file, 'r') as xml_file:
             xml_root = etree.parse(xml_file)
 
-        # Validate the XML file against the XSD schema
-        is_valid = schema.validate(xml_root)
-        
+        # Validate the XML file against the compiled XSD schema
+        with checkout_schema(xsd_file) as schema:
+            is_valid = schema.validate(xml_root)
+            errors = [error.message for error in schema.error_log]
+
         if is_valid:
-            print("The XML file is valid according to the schema.")
+            logger.debug("The XML file is valid according to the schema.")
             return True
         else:
-            print("The XML file is NOT valid. Errors:")
-            for error in schema.error_log:
-                print(error.message)
+            logger.info("The XML file is NOT valid. Errors: %s", "; ".join(errors))
             return False
     except etree.XMLSyntaxError as e:
-        print(f"Error parsing the XML file: {e}")
+        logger.info("Error parsing the XML file: %s", e)
         return
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.exception("An error occurred: %s", e)
         return
@@ -0,0 +1,104 @@
+"""
+Production entry point: the app under gunicorn, with several worker processes
+that each serve requests on a pool of threads.
+
+    python server.py --workers 4 --threads 8 --bind 0.0.0.0:8000
+    gunicorn -c server.py 'server:create_app()'
+
+The same settings come from WEB_WORKERS, WEB_THREADS, WEB_BIND and WEB_TIMEOUT.
+Uploads, parsed models, compiled CNF, results and asynchronous job states are
+shared between the workers through files and SQLite in the upload folder
+(STORE_BACKEND=sqlite), so any worker can serve any fileId. The XSD schema and
+the native libraries are loaded in the master before it forks the workers (see
+warm_up), so workers start with them instead of loading them on first use.
+Analysis jobs are started by a fork server (ANALYSIS_START_METHOD), so they
+never inherit a lock held by one of the worker's request threads.
+"""
+import argparse
+import importlib
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+XSD_FILE = os.path.join(HERE, 'logic', 'feature-model.xsd')
+# Imported by warm_up; importing app itself would start its threads in the master
+APP_MODULES = ('flask', 'logic.analysis', 'logic.batch', 'logic.binary', 'logic.calculate',
+               'logic.edit', 'logic.sample', 'logic.store', 'logic.tree')
+
+# gunicorn settings, read when this file is passed with -c
+bind = os.environ.get('WEB_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_WORKERS', 2))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+# Heartbeat of the worker's main loop; requests on its threads may take longer
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+chdir = HERE
+
+
+def create_app():
+    """
+    The Flask app configured for several server processes. Environment settings
+    win; by default the stores are shared and the analysis processes are split
+    between the web workers instead of each of them using every CPU.
+    """
+    os.environ.setdefault('STORE_BACKEND', 'sqlite')
+    os.environ.setdefault('ANALYSIS_START_METHOD', 'forkserver')
+    web_workers = int(os.environ.get('WEB_WORKERS', workers))
+    os.environ.setdefault('ANALYSIS_WORKERS', str(max(1, (os.cpu_count() or 1) // web_workers)))
+    from app import app
+
+    return app
+
+
+def warm_up():
+    """
+    Load what the first requests would otherwise wait for: the compiled schema,
+    the SAT solver and numpy extensions and the modules of the app. Forked
+    workers inherit all of it. Nothing here starts threads or opens files that
+    stay open, both of which do not survive a fork.
+    """
+    from pysat.solvers import Solver
+
+    from logic.xmlvalidate import get_schema
+
+    for module in APP_MODULES:
+        importlib.import_module(module)
+    get_schema(XSD_FILE)
+    with Solver(name='m22', bootstrap_with=[[1, 2], [-1]]) as solver:
+        solver.solve()
+
+
+def on_starting(server):
+    # gunicorn hook: runs once in the master, before any worker is forked
+    warm_up()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the app with gunicorn.")
+    parser.add_argument('--bind', default=bind)
+    parser.add_argument('--workers', type=int, default=workers)
+    parser.add_argument('--threads', type=int, default=threads)
+    parser.add_argument('--timeout', type=int, default=timeout)
+    args = parser.parse_args(argv)
+    os.environ['WEB_WORKERS'] = str(args.workers)
+
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': args.bind, 'workers': args.workers, 'threads': args.threads,
+                'worker_class': worker_class, 'timeout': args.timeout, 'chdir': chdir,
+                'on_starting': on_starting,
+            }
+            for name, value in options.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return create_app()
+
+    Server().run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,6 +22,8 @@ $(document).ready(function () {
       processData: false,
       success: function (response) {
         fileId = response.fileId; // Save fileId from the response
+        window.currentFileId = fileId; // Shared with validation.js
+        renderFeatureTree(fileId);
         if (response.constraints && response.constraints.length > 0) {
           const constraintsList = $("#constraints-list");
           constraintsList.empty(); // Clear previous constraints
@@ -108,55 +110,20 @@ $(document).ready(function () {
 
     if (!isValid) return;
 
-    // Send logic data to the backend
-    $.ajax({
-      url: "/process_logic_and_mwp",
-      type: "POST",
-      contentType: "application/json",
-      data: JSON.stringify({ fileId, logicData }),
-      success: function (response) {
-        console.log("Response received:", response);
-
-        // Display the constraints, logic, and MWP
-        $("#propositional-section").hide();
-        $("#mwp-section").show();
-
-        const logicMapping = response.logicMapping || {};
-        const propositionalLogic = response.propositionalLogic || [];
-        const mwpConfigurations = response.mwpConfigurations || [];
-
-        // Display Cross-Tree Constraints
-        const constraintsList = $("#final-constraints-list");
-        constraintsList.empty();
-        propositionalLogic.forEach((constraint, index) => {
-          constraintsList.append(`<li>${index + 1}. ${constraint}</li>`);
-        });
-
-        // Display Logic Mapping
-        const logicList = $("#logic-list");
-        logicList.empty();
-        for (const key in logicMapping) {
-          logicList.append(`<li>${key}: ${logicMapping[key]}</li>`);
-        }
-
-        // Display MWP Configurations
-        const mwpList = $("#mwp-list");
-        mwpList.empty();
-        mwpConfigurations.forEach((config, index) => {
-          mwpList.append(`<li>${index + 1}. ${config}</li>`);
-        });
-      },
-      error: function (xhr) {
-        alert("An error occurred while processing the request.");
-      },
-    });
+    // Display the constraints, logic, and MWP; configurations are streamed
+    // from the backend and rendered as they arrive (see mwp.js)
+    $("#propositional-section").hide();
+    $("#mwp-section").show();
+    renderMWP(fileId, logicData);
   });
 
   // Restart application flow
   $("#restart").on("click", function () {
     $("#mwp-section").hide();
+    $("#tree-section").hide();
     $("#upload-section").show();
     $("#xml-file").val(""); // Reset the file input
     fileId = null; // Reset fileId
+    window.currentFileId = null;
   });
 });
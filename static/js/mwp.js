@@ -1,60 +1,126 @@
 // mwp.js
 
-function calculateMWP() {
-  const xmlFile = document.getElementById("xml-file").files[0];
+// Rows are appended in batches so long result sets don't re-layout the page per row
+const MWP_RENDER_BATCH = 200;
 
-  if (!xmlFile) {
-    $("#mwp-result").html(
-      '<div class="alert alert-danger">Please upload an XML file first.</div>'
-    );
+// Decode a hex bitset over featureOrder (bit i is the feature with id i + 1)
+function decodeBitset(bits, featureOrder) {
+  const value = BigInt("0x" + bits);
+  return featureOrder.filter((_, i) => (value >> BigInt(i)) & 1n);
+}
+
+// POST to /process_logic_and_mwp in streaming mode and call the handlers for each
+// JSON line as it arrives: onHeader(header), onConfiguration(names, index),
+// onEnd(end) and onError(message)
+async function streamMWP(request, handlers) {
+  let featureOrder = null;
+  const response = await fetch("/process_logic_and_mwp", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ ...request, stream: true }),
+  });
+  if (!response.ok) {
+    const body = await response.json().catch(() => ({}));
+    handlers.onError(body.error || "An error occurred while processing the request.");
     return;
   }
 
-  const reader = new FileReader();
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  const handleLine = (line) => {
+    if (!line.trim()) return;
+    const message = JSON.parse(line);
+    if (message.type === "header") {
+      featureOrder = message.featureOrder || null;
+      handlers.onHeader(message);
+    } else if (message.type === "configuration") {
+      const names = featureOrder
+        ? decodeBitset(message.configuration, featureOrder)
+        : message.configuration.split(", ");
+      handlers.onConfiguration(names, message.index);
+    } else if (message.type === "end") {
+      handlers.onEnd(message);
+    } else if (message.type === "error") {
+      handlers.onError(message.error);
+    }
+  };
+
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop(); // keep the incomplete last line
+    lines.forEach(handleLine);
+  }
+  handleLine(buffer + decoder.decode());
+}
 
-  reader.onload = function (e) {
-    const xmlContent = e.target.result;
+// Show the logic and MWP configurations of an upload, rendering configurations as
+// they are found and fetching further pages with "Load more"
+function renderMWP(fileId, logicData, pageSize = 500) {
+  const mwpList = $("#mwp-list");
+  mwpList.empty();
+  $("#mwp-more").remove();
+  let pending = [];
 
-    $.ajax({
-      url: "/calculate_mwp",
-      type: "POST",
-      contentType: "application/json",
-      data: JSON.stringify({ xml_file: xmlContent }),
-      success: function (response) {
-        const { mwp_configurations, count } = response;
+  const flush = () => {
+    if (pending.length) {
+      mwpList.append(pending);
+      pending = [];
+    }
+  };
 
-        if (count > 0) {
-          let resultHTML = `<p><strong>MWP Configurations (${count}):</strong></p><ul>`;
-          mwp_configurations.forEach((config) => {
-            resultHTML += `<li>${config}</li>`;
+  const loadPage = (cursor) =>
+    streamMWP(
+      { fileId, logicData, pageSize, cursor, encoding: "bitset" },
+      {
+        onHeader: (header) => {
+          if (cursor) return; // logic is shown with the first page
+          const constraintsList = $("#final-constraints-list");
+          constraintsList.empty();
+          (header.propositionalLogic || []).forEach((constraint, index) => {
+            constraintsList.append(`<li>${index + 1}. ${constraint}</li>`);
           });
-          resultHTML += "</ul>";
 
-          $("#mwp-result").html(resultHTML);
-        } else {
-          // No configurations found
-          $("#mwp-result").html(
-            '<div class="alert alert-info">No MWP configurations satisfy the constraints.</div>'
+          const logicList = $("#logic-list");
+          logicList.empty();
+          const logicMapping = header.logicMapping || {};
+          for (const key in logicMapping) {
+            logicList.append(`<li>${key}: ${logicMapping[key]}</li>`);
+          }
+          // Model constraints the solver could not encode are not reflected in the products
+          (header.unsupported || []).forEach((formula) => {
+            logicList.append($('<li class="text-warning">').text(`Not applied: ${formula}`));
+          });
+        },
+        onConfiguration: (names, index) => {
+          pending.push($("<li>").text(`${index + 1}. ${names.join(", ")}`));
+          if (pending.length >= MWP_RENDER_BATCH) flush();
+        },
+        onEnd: (end) => {
+          flush();
+          if (end.nextCursor) {
+            const more = $('<button id="mwp-more" class="btn btn-secondary btn-sm">Load more</button>');
+            more.on("click", () => {
+              more.remove();
+              loadPage(end.nextCursor);
+            });
+            mwpList.after(more);
+          }
+        },
+        onError: (message) => {
+          flush();
+          mwpList.append(
+            $('<li class="text-danger">').text(message)
           );
-        }
-      },
-      error: function (xhr) {
-        const errorMessage = xhr.responseJSON
-          ? xhr.responseJSON.error
-          : "An error occurred.";
-        $("#mwp-result").html(
-          `<div class="alert alert-danger">${errorMessage}</div>`
-        );
-      },
+        },
+      }
+    ).catch(() => {
+      alert("An error occurred while processing the request.");
     });
-  };
-
-  reader.onerror = function () {
-    $("#mwp-result").html(
-      '<div class="alert alert-danger">Error reading the XML file.</div>'
-    );
-  };
 
-  // Read the file content as text
-  reader.readAsText(xmlFile);
+  return loadPage(null);
 }
@@ -0,0 +1,103 @@
+// tree.js
+
+// Feature tree with selection checkboxes, loaded from /models/<fileId>/tree.
+// Nodes arrive in pre-order, so the sub-tree of node i is the `descendants`
+// nodes right after it: collapsing or deselecting a branch is a single slice.
+let treeNodes = [];
+let treePositions = {}; // feature name -> position in treeNodes
+let treeDecisions = []; // features the user checked, in order
+
+function renderFeatureTree(fileId) {
+  $.getJSON(`/models/${encodeURIComponent(fileId)}/tree`, function (response) {
+    treeNodes = response.nodes;
+    treePositions = {};
+    treeNodes.forEach((node, i) => (treePositions[node.name] = i));
+
+    // Names come from the uploaded model, so they are only ever set as text
+    const tree = $("#feature-tree");
+    tree.empty();
+    treeNodes.forEach((node, i) => {
+      const toggle = node.descendants > 0
+        ? $('<button type="button" class="btn btn-sm btn-link p-0 me-1 tree-toggle">').attr("data-pos", i).text("−")
+        : $('<span class="me-3">');
+      const check = $('<input class="form-check-input tree-check" type="checkbox">')
+        .attr({ "data-pos": i, id: `tree-check-${i}` });
+      const label = $('<label class="form-check-label">').attr("for", `tree-check-${i}`)
+        .append(node.mandatory ? $("<strong>").text(node.name) : document.createTextNode(node.name));
+      if (node.groupType) {
+        label.append(" ", $('<small class="text-muted">').text(`(${node.groupType})`));
+      }
+      tree.append(
+        $('<div class="form-check">').attr("id", `tree-node-${i}`).css("margin-left", `${node.depth * 1.5}rem`)
+          .append(toggle, check, label)
+      );
+    });
+    $("#tree-section").show();
+    treeDecisions = [];
+    propagateSelection(fileId);
+  }).fail(function (xhr) {
+    $("#feature-tree").empty().append(
+      $('<div class="alert alert-danger">').text(xhr.responseJSON?.error || "Error loading the feature tree.")
+    );
+  });
+}
+
+function treeSubtree(pos) {
+  return treeNodes.slice(pos + 1, pos + 1 + treeNodes[pos].descendants);
+}
+
+$(document).on("click", ".tree-toggle", function () {
+  const pos = Number($(this).data("pos"));
+  const collapse = $(this).text() === "−";
+  $(this).text(collapse ? "+" : "−");
+  // Expanding shows the whole branch again, nested toggles reset with it
+  treeSubtree(pos).forEach((node) => {
+    const i = treePositions[node.name];
+    $(`#tree-node-${i}`).toggle(!collapse);
+    $(`#tree-node-${i} .tree-toggle`).text("−");
+  });
+});
+
+// The server propagates the checked features through the model's rules and
+// constraints; boxes it forces on or rules out are set and locked
+function propagateSelection(fileId) {
+  $.ajax({
+    url: `/models/${encodeURIComponent(fileId)}/propagate`,
+    type: "POST",
+    contentType: "application/json",
+    data: JSON.stringify({ decisions: treeDecisions.map((name) => ({ feature: name, selected: true })) }),
+    success: function (response) {
+      const checked = new Set(response.selected.concat(response.forced));
+      const locked = new Set(response.forced.concat(response.excluded));
+      treeNodes.forEach((node, i) =>
+        $(`#tree-check-${i}`).prop("checked", checked.has(node.name)).prop("disabled", locked.has(node.name))
+      );
+      if (response.refused.length > 0) {
+        treeDecisions = treeDecisions.filter((name) => !response.refused.includes(name));
+        $("#validation-result").empty().append(
+          $('<div class="alert alert-danger">').text("Conflicts with the current selection: " + response.refused.join(", "))
+        );
+        return;
+      }
+      window.selectedFeatures = Array.from(checked);
+      window.deselectedFeatures = [];
+      if (treeDecisions.length > 0) {
+        validateConfiguration();
+      }
+    },
+    error: function (xhr) {
+      $("#validation-result").empty().append(
+        $('<div class="alert alert-danger">').text(xhr.responseJSON?.error || "Error propagating the selection.")
+      );
+    },
+  });
+}
+
+$(document).on("change", ".tree-check", function () {
+  const name = treeNodes[Number($(this).data("pos"))].name;
+  treeDecisions = treeDecisions.filter((decided) => decided !== name);
+  if (this.checked) {
+    treeDecisions.push(name);
+  }
+  propagateSelection(window.currentFileId);
+});
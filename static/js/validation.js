@@ -1,8 +1,10 @@
 // validation.js
 
-// Function to validate the configuration
+// Function to validate the configuration against the uploaded model.
+// The server keeps a warm solver per fileId, so this is cheap to call on every change.
 function validateConfiguration() {
   const selectedFeatures = window.selectedFeatures || [];
+  const deselectedFeatures = window.deselectedFeatures || [];
 
   if (selectedFeatures.length === 0) {
     $("#validation-result").html(
@@ -11,50 +13,49 @@ function validateConfiguration() {
     return;
   }
 
-  // Get the uploaded XML file
-  const xmlFile = document.getElementById("xml-file").files[0];
+  // The fileId returned by /parse when the XML file was uploaded
+  const fileId = window.currentFileId;
 
-  if (!xmlFile) {
+  if (!fileId) {
     $("#validation-result").html(
       '<div class="alert alert-danger">Please upload an XML file.</div>'
     );
     return;
   }
 
-  // Create a FileReader to read the XML file content
-  const reader = new FileReader();
-
-  reader.onload = function (e) {
-    const xmlContent = e.target.result; // Get the XML file content
-
-    // Send AJAX request with the selected features and XML content
-    $.ajax({
-      url: "/validate",
-      type: "POST",
-      contentType: "application/json",
-      data: JSON.stringify({
-        selected_features: selectedFeatures,
-        xml_file: xmlContent, // Send the XML content here
-      }),
-      success: function (response) {
-        $("#validation-result").html(
-          '<div class="alert alert-success">Valid Configuration!</div>'
-        );
-      },
-      error: function (xhr) {
+  $.ajax({
+    url: "/validate",
+    type: "POST",
+    contentType: "application/json",
+    data: JSON.stringify({
+      fileId: fileId,
+      selected_features: selectedFeatures,
+      deselected_features: deselectedFeatures,
+    }),
+    success: function (response) {
+      if (!response.valid) {
         $("#validation-result").html(
-          '<div class="alert alert-danger">' + xhr.responseJSON.error + "</div>"
+          '<div class="alert alert-danger">Invalid Configuration!</div>'
         );
-      },
-    });
-  };
-
-  reader.onerror = function () {
-    $("#validation-result").html(
-      '<div class="alert alert-danger">Error reading the XML file.</div>'
-    );
-  };
-
-  // Read the file content as text
-  reader.readAsText(xmlFile);
+        return;
+      }
+
+      // Feature names come from the uploaded model, so they are set as text
+      const result = $("#validation-result").html('<div class="alert alert-success">Valid Configuration!</div>');
+      if (response.forced.length > 0) {
+        result.append($("<p>").append("<strong>Now required:</strong> ", document.createTextNode(response.forced.join(", "))));
+      }
+      if (response.forbidden.length > 0) {
+        result.append($("<p>").append("<strong>Now excluded:</strong> ", document.createTextNode(response.forbidden.join(", "))));
+      }
+    },
+    error: function (xhr) {
+      const errorMessage = xhr.responseJSON
+        ? xhr.responseJSON.error
+        : "An error occurred.";
+      $("#validation-result").html(
+        '<div class="alert alert-danger">' + errorMessage + "</div>"
+      );
+    },
+  });
 }
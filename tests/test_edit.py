@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from logic.edit import EditorPool, ModelEditor
+from logic.model import load_model
+
+XML_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logic', 'feature-model.xml')
+
+
+@pytest.mark.parametrize('edit', [
+    {'op': 'addConstraint', 'englishStatement': 5},
+    {'op': 'addConstraint'},
+    {'op': 'removeConstraint', 'index': 1},
+    {'op': 'removeConstraint', 'index': True},
+    {'op': 'setMandatory', 'feature': 'Call', 'mandatory': 'false'},
+    {'op': 'setMandatory', 'feature': 'Nope', 'mandatory': True},
+    {'op': 'setGroupType', 'feature': 'Location', 'groupType': 'and'},
+    {'op': 'bogus'},
+])
+def test_rejected_edit_leaves_the_model_unchanged(edit):
+    editor = ModelEditor(load_model(XML_FILE))
+    digest, rules = editor.model.digest(), len(editor.compiled.rules)
+    with pytest.raises((KeyError, IndexError, ValueError)):
+        editor.apply(edit)
+    assert editor.model.digest() == digest
+    assert len(editor.compiled.rules) == rules
+    assert len(editor._constraint_rules) == len(editor.model.constraints)
+    assert editor.applied == 0
+
+
+def test_checked_out_session_outlives_discard():
+    pool = EditorPool()
+    model = load_model(XML_FILE)
+    pool.get('upload', lambda: model, lambda start: [])
+    with pool.checkout('upload') as session:
+        pool.discard('upload')
+        assert not session.closed
+    assert session.closed
+    with pool.checkout('upload') as session:
+        assert session is None
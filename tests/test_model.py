@@ -0,0 +1,28 @@
+import io
+import os
+
+import pytest
+from lxml import etree
+
+from logic.model import load_model
+
+XSD_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logic', 'feature-model.xsd')
+
+
+def entity_bomb():
+    # Nested internal entities: each level expands to ten copies of the one before
+    entities = '<!ENTITY a0 "dha">' + ''.join(
+        f'<!ENTITY a{i} "{f"&a{i - 1};" * 10}">' for i in range(1, 10))
+    return (
+        f'<?xml version="1.0"?><!DOCTYPE featureModel [{entities}]>'
+        '<featureModel><feature name="A"/><constraints><constraint>'
+        '<englishStatement>&a9;</englishStatement><booleanExpression>A</booleanExpression>'
+        '</constraint></constraints></featureModel>'
+    ).encode()
+
+
+@pytest.mark.parametrize('xsd_file', [XSD_FILE, None])
+def test_entity_bomb_is_rejected(xsd_file):
+    # Expanded under the validator, this used to crash the process
+    with pytest.raises(etree.XMLSyntaxError):
+        load_model(io.BytesIO(entity_bomb()), xsd_file)
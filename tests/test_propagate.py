@@ -0,0 +1,65 @@
+import io
+import random
+
+from pysat.solvers import Solver
+
+from logic.generate import generate_model
+from logic.model import load_model
+from logic.propagate import SelectionPropagator
+from logic.translate import compile_cnf
+
+
+def random_model(seed):
+    out = io.StringIO()
+    generate_model(out, depth=4, branching=3, constraint_density=0.3, seed=seed)
+    return load_model(io.BytesIO(out.getvalue().encode()))
+
+
+def decisions(propagator):
+    return [lit for lit, _ in propagator._decisions]
+
+
+def test_propagation_matches_sat_on_random_models():
+    for seed in range(30):
+        model = random_model(seed)
+        compiled = compile_cnf(model)
+        names = list(model.features)
+        rng = random.Random(seed)
+        propagator = SelectionPropagator(compiled)
+        with Solver(name='m22', bootstrap_with=compiled.clauses) as solver:
+            for step in range(25):
+                r = rng.random()
+                if r < 0.7:
+                    propagator.decide(rng.choice(names), rng.random() < 0.5)
+                elif r < 0.85:
+                    propagator.undo()
+                else:
+                    propagator.retract(rng.choice(names))
+                assumptions = decisions(propagator)
+                # Everything propagated follows from the decisions
+                for lit in propagator._trail:
+                    assert not solver.solve(assumptions=assumptions + [-lit]), (seed, step, lit)
+                # and undo/retract leave the state a fresh propagation would reach
+                fresh = SelectionPropagator(compiled)
+                for lit in assumptions:
+                    assert fresh._assume(lit) is None, (seed, step)
+                assert set(fresh._trail) == set(propagator._trail), (seed, step)
+
+
+def test_decide_all_keeps_the_common_prefix():
+    model = random_model(7)
+    compiled = compile_cnf(model)
+    names = list(model.features)
+    rng = random.Random(7)
+    propagator = SelectionPropagator(compiled)
+    selection = []
+    for _ in range(40):
+        if selection and rng.random() < 0.3:
+            selection.pop(rng.randrange(len(selection)))
+        else:
+            selection.append((rng.choice(names), rng.random() < 0.5))
+        result = propagator.decide_all(selection)
+        fresh = SelectionPropagator(compiled)
+        expected = fresh.decide_all(selection)
+        assert result == expected
+        assert set(fresh._trail) == set(propagator._trail)